@@ -0,0 +1,190 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import cv2
+import keras
+import tensorflow as tf
+
+arg_parser = argparse.ArgumentParser(
+    description='Converting food recognition model from Keras to TFLite or ONNX for CPU inference.'
+)
+arg_parser.add_argument(
+    '-i',
+    help='File path of input Keras model archive, in .h5 format.',
+    type=str,
+    required=True
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of generated .tflite or .onnx file, the format is decided by the extension.',
+    type=str,
+    required=True
+)
+arg_parser.add_argument(
+    '-q',
+    help='Quantization of the generated model.',
+    choices=['none', 'float16', 'int8'],
+    default='none'
+)
+arg_parser.add_argument(
+    '--images',
+    help='Directory of sample images, used for int8 calibration and the parity check. '
+        'Random inputs are used if not specified.',
+    type=str,
+    default=None
+)
+arg_parser.add_argument(
+    '--check',
+    help='Compare the masks of the generated model with the Keras model, and measure the '
+        'startup time and memory of both.',
+    action='store_true'
+)
+args = arg_parser.parse_args()
+
+IMAGE_SIZE = (512, 512)
+MASK_THRESHOLD = 0.5
+SAMPLE_COUNT = 16
+
+
+def load_samples():
+    """ Load normalized sample inputs, normalized the same way as
+        `fvolume.recognition._get_segmentation`.
+    """
+    if args.images is None:
+        return np.random.default_rng(0).standard_normal((SAMPLE_COUNT, *IMAGE_SIZE, 3)).astype(np.float32)
+    samples = []
+    for path in sorted(glob.glob(os.path.join(args.images, '*')))[:SAMPLE_COUNT]:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        image = np.swapaxes(cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), IMAGE_SIZE), 0, 1)
+        image = (image - np.mean(image, axis=(0, 1))) / np.std(image, axis=(0, 1))
+        samples.append(image.astype(np.float32))
+    return np.array(samples)
+
+
+def convert_tflite(model, output_path, samples):
+    """ Convert the Keras model to TFLite, `samples` are used for int8 calibration.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if args.q == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif args.q == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([sample[np.newaxis]] for sample in samples)
+    with open(output_path, 'wb') as out_file:
+        out_file.write(converter.convert())
+
+
+def convert_onnx(model, output_path):
+    """ Convert the Keras model to ONNX, int8 quantization only covers the weights.
+    """
+    import tf2onnx
+    tf2onnx.convert.from_keras(
+        model,
+        input_signature=[tf.TensorSpec((None, *IMAGE_SIZE, 3), tf.float32, name='input_image')],
+        output_path=output_path
+    )
+    if args.q == 'float16':
+        import onnx
+        from onnxconverter_common import float16
+        onnx.save(float16.convert_float_to_float16(onnx.load(output_path), keep_io_types=True), output_path)
+    elif args.q == 'int8':
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(output_path, output_path, weight_type=QuantType.QInt8)
+
+
+# The script run in a fresh interpreter to measure the startup time and the peak
+# memory of loading a backend and running one prediction.
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+import numpy as np
+start_time = time.perf_counter()
+backend, path = sys.argv[1], sys.argv[2]
+if backend == 'keras':
+    import keras, tensorflow as tf
+    model = tf.keras.models.load_model(path, custom_objects={'lovasz_hinge': keras.losses.binary_crossentropy})
+    predict = model.predict
+elif backend == 'tflite':
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    interpreter = Interpreter(model_path=path)
+    interpreter.allocate_tensors()
+    def predict(images):
+        interpreter.set_tensor(interpreter.get_input_details()[0]['index'], images)
+        interpreter.invoke()
+        return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+else:
+    import onnxruntime
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    predict = lambda images: session.run(None, {session.get_inputs()[0].name: images})[0]
+load_time = time.perf_counter() - start_time
+predict(np.zeros((1, 512, 512, 3), dtype=np.float32))
+print(json.dumps({
+    'load_seconds': load_time,
+    'first_prediction_seconds': time.perf_counter() - start_time - load_time,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+'''
+
+
+def measure_startup(backend, path):
+    """ Measure the startup time and peak memory of a backend in a new interpreter.
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT, backend, path],
+        check=True,
+        stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def check(model, output_path, output_format, samples):
+    """ Print the mask parity and the startup benchmark of the converted model.
+    """
+    if output_format == 'tflite':
+        interpreter = tf.lite.Interpreter(model_path=output_path)
+        input_index = interpreter.get_input_details()[0]['index']
+        output_index = interpreter.get_output_details()[0]['index']
+        interpreter.resize_tensor_input(input_index, samples.shape)
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(input_index, samples)
+        interpreter.invoke()
+        converted_result = interpreter.get_tensor(output_index)
+    else:
+        import onnxruntime
+        session = onnxruntime.InferenceSession(output_path, providers=['CPUExecutionProvider'])
+        converted_result = session.run(None, {session.get_inputs()[0].name: samples})[0]
+    keras_result = model.predict(samples)
+    print(json.dumps({
+        'max_abs_difference': float(np.max(np.abs(keras_result - converted_result))),
+        'mask_agreement': float(np.mean((keras_result >= MASK_THRESHOLD) == (converted_result >= MASK_THRESHOLD))),
+        'keras_startup': measure_startup('keras', args.i),
+        '{}_startup'.format(output_format): measure_startup(output_format, output_path)
+    }, indent=4))
+
+
+output_format = os.path.splitext(args.o)[1][1:]
+if output_format not in ('tflite', 'onnx'):
+    arg_parser.error('The output path should end with .tflite or .onnx.')
+
+keras_model = tf.keras.models.load_model(
+    args.i,
+    custom_objects={'lovasz_hinge': keras.losses.binary_crossentropy}
+)
+sample_images = load_samples()
+
+if output_format == 'tflite':
+    convert_tflite(keras_model, args.o, sample_images)
+else:
+    convert_onnx(keras_model, args.o)
+
+if args.check:
+    check(keras_model, args.o, output_format, sample_images)
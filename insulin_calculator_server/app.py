@@ -5,7 +5,10 @@ import flask
 import fvolume
 import fdensitylib
 
+import config
 import data_manager
+import jobs
+import pipeline
 
 
 application = flask.Flask(__name__)
@@ -19,10 +22,59 @@ def response_nutrition_estimate():
     if not (args.get('session_id') and args.get('token')):
         flask.abort(400, 'Request metadata not found.')
     session_data_manager = data_manager.SessionDataManager(args.get('session_id'))
+    # The peripheral data is validated before any file of the session is archived.
+    try:
+        session_data_manager.register_peripheral_file(files['peripheral'])
+    except ValueError:
+        flask.abort(400, 'Unexpected peripheral data.')
     session_data_manager.register_image_file(files['image'])
-    session_data_manager.register_peripheral_file(files['peripheral'])
-    response = '{"results": []}'
-    return response
+    response, timings = pipeline.nutrition_estimation_pipeline.run(session_data_manager)
+    return flask.Response(
+        response,
+        mimetype='application/json',
+        headers={'Server-Timing': pipeline.format_server_timing(timings)}
+    )
+
+@application.route('/nutritionestimation/jobs', methods=['POST'])
+def response_nutrition_estimate_job():
+    files, args = flask.request.files, flask.request.form
+    if not (files['image'] and files['peripheral']):
+        flask.abort(400, 'Unexpected file attachments.')
+    if not (args.get('session_id') and args.get('token')):
+        flask.abort(400, 'Request metadata not found.')
+    session_data_manager = data_manager.SessionDataManager(args.get('session_id'))
+    try:
+        session_data_manager.register_peripheral_file(files['peripheral'])
+    except ValueError:
+        flask.abort(400, 'Unexpected peripheral data.')
+    session_data_manager.register_image_file(files['image'])
+    try:
+        job_id = jobs.job_manager.submit(run_estimation_job, session_data_manager)
+    except jobs.JobQueueFullError:
+        flask.abort(429, 'Too many pending estimation jobs.')
+    return flask.Response(
+        json.dumps({'job_id': job_id, 'status_url': flask.url_for('response_job_status', job_id=job_id)}),
+        status=202,
+        mimetype='application/json'
+    )
+
+@application.route('/nutritionestimation/jobs/<job_id>', methods=['GET'])
+def response_job_status(job_id):
+    try:
+        wait = min(float(flask.request.args.get('wait', 0)), config.JOB_MAX_WAIT)
+    except ValueError:
+        flask.abort(400, 'Unexpected wait time.')
+    status = jobs.job_manager.wait(job_id, wait) if wait > 0 else jobs.job_manager.get_status(job_id)
+    if status is None:
+        flask.abort(404, 'Job not found or expired.')
+    return flask.Response(json.dumps(status), mimetype='application/json')
+
+def run_estimation_job(session_data_manager):
+    """ Run the estimation pipeline for an asynchronous job, the job result is 
+        the result json object.
+    """
+    response, _ = pipeline.nutrition_estimation_pipeline.run(session_data_manager)
+    return json.loads(response)
 
 @application.route('/densitycollect', methods=['GET', 'POST'])
 def response_density_collect():
@@ -34,13 +86,38 @@ def response_density_collect():
     if not (args.get('name') and args.get('weight')):
         flask.abort(400, 'Request metadata not found.')
     session_data_manager = data_manager.SessionDataManager(args.get('session_id'), collection_session=True)
+    try:
+        session_data_manager.register_peripheral_file(files['peripheral'])
+    except ValueError:
+        flask.abort(400, 'Unexpected peripheral data.')
     session_data_manager.register_image_file(files['image'])
-    session_data_manager.register_peripheral_file(files['peripheral'])
     session_data_manager.register_collection_additional_image(files['additional'])
     session_data_manager.register_collection_label(args.get('name'), args.get('weight'))
     return '{"status": "OK"}'
 
+@application.route('/ready', methods=['GET'])
+def response_ready():
+    ready = fvolume.model_registry.registry.is_ready()
+    return flask.Response(
+        json.dumps({'ready': ready, 'models': fvolume.model_registry.registry.get_status()}),
+        status=200 if ready else 503,
+        mimetype='application/json'
+    )
+
+@application.route('/metrics', methods=['GET'])
+def response_metrics():
+    classification_cache = fvolume.classification.get_classification_cache()
+    metrics = {
+        'stage_timings_ms': pipeline.nutrition_estimation_pipeline.metrics.get_stats(),
+        'segmentation_scheduler': fvolume.recognition.segmentation_scheduler.get_stats(),
+        'classification_cache': classification_cache.get_stats() if classification_cache is not None else None,
+        'undistort_map_cache': fvolume.utils.get_undistort_map_cache_info(),
+        'archive_writer': data_manager.archive_writer.get_stats(),
+        'jobs': jobs.job_manager.get_stats()
+    }
+    return flask.Response(json.dumps(metrics), mimetype='application/json')
+
 # Use gunicorn instead of directly running app.py to achieve better performance.
-# `gunicorn --bind 0.0.0.0:5000 --timeout 300 app`
+# `gunicorn -c gunicorn.conf.py app`
 if __name__ == '__main__':
     application.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,151 @@
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from fdensitylib import library
+
+arg_parser = argparse.ArgumentParser(
+    description='Measuring the loading and lookup time of the density library with a '
+        'large synthetic library. Run from the server directory with '
+        '`python -m benchmarks.density_library`.'
+)
+arg_parser.add_argument(
+    '-n',
+    help='Number of entries of the synthetic library.',
+    type=int,
+    default=100000
+)
+arg_parser.add_argument(
+    '--lookups',
+    help='Number of lookups of each kind.',
+    type=int,
+    default=10000
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of the JSON report.',
+    type=str,
+    default=None
+)
+args = arg_parser.parse_args()
+
+WORDS = [
+    'plain', 'glazed', 'chocolate', 'fried', 'grilled', 'roasted', 'beef', 'chicken', 'pork', 'rice',
+    'noodle', 'bagel', 'donut', 'burger', 'salad', 'soup', 'cake', 'bread', 'cheese', 'potato',
+    'spicy', 'sweet', 'sour', 'baked', 'steamed', 'tomato', 'egg', 'tofu', 'fish', 'shrimp'
+]
+GROUP_COUNT = 500
+
+
+def make_entries(count, seed=0):
+    """ Make `count` synthetic library entries with unique names.
+    """
+    rng = random.Random(seed)
+    entries = []
+    for index in range(count):
+        name = '{} {}'.format(' '.join(rng.sample(WORDS, 3)).title(), index)
+        entries.append(('Group {}'.format(index % GROUP_COUNT), name, 0.0, rng.uniform(200.0, 1200.0)))
+    return entries
+
+
+def write_csv(path, entries):
+    """ Write the entries as a CSV density library file.
+    """
+    with open(path, 'w', newline='', encoding='utf8') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(library.LIBRARY_COLUMNS)
+        writer.writerows(entries)
+
+
+def write_sqlite(path, entries):
+    """ Write the entries as a SQLite density library file.
+    """
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute(
+            'CREATE TABLE density_library ("group" TEXT, name TEXT, area_density REAL, volume_density REAL)'
+        )
+        connection.executemany('INSERT INTO density_library VALUES (?, ?, ?, ?)', entries)
+    connection.close()
+
+
+def measure(function, queries):
+    """ Returning the mean wall time of `function` over `queries`, in microseconds.
+    """
+    start_time = time.perf_counter()
+    for group, name in queries:
+        function(group, name)
+    return (time.perf_counter() - start_time) / len(queries) * 1e6
+
+
+def get_legacy_density(density_library, group, name):
+    """ The lookup of the previous dictionary literal library.
+    """
+    if group in density_library:
+        if name in density_library[group]:
+            return density_library[group][name]
+        else:
+            return [*density_library[group].values()][0]
+    else:
+        return 0.0, 0.0
+
+
+entries = make_entries(args.n)
+rng = random.Random(1)
+samples = [rng.choice(entries) for _ in range(args.lookups)]
+queries = {
+    'exact': [(group, name) for group, name, _, _ in samples],
+    'normalized': [(group, name.upper().replace(' ', ', ')) for group, name, _, _ in samples],
+    'fuzzy': [(group, name[:-1] + 'x' + name[-1:]) for group, name, _, _ in samples],
+    'group_fallback': [(group, 'Unknown Food') for group, _, _, _ in samples],
+    'missing': [('Unknown Group', 'Unknown Food') for _ in samples]
+}
+# Names of common words only, which share a word with a large part of the library
+# but match none of it, so both the group and the global fuzzy lookups compare
+# the most names. Each name is unique, so none of the lookups is cached.
+worst_case_names = set()
+while len(worst_case_names) < min(args.lookups, 10000):
+    worst_case_names.add(' '.join(rng.sample(WORDS, 4)).title())
+worst_case_queries = [(rng.choice(entries)[0], name) for name in sorted(worst_case_names)]
+report = {'entries': args.n, 'lookups': args.lookups, 'load_seconds': {}, 'lookup_us': {}, 'legacy_lookup_us': {}}
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    for extension, write in (('.csv', write_csv), ('.sqlite3', write_sqlite)):
+        path = os.path.join(temp_dir, 'density_library' + extension)
+        write(path, entries)
+        start_time = time.perf_counter()
+        density_library = library.DensityLibrary(library.load_entries(path))
+        report['load_seconds'][extension[1:]] = time.perf_counter() - start_time
+        report['{}_file_bytes'.format(extension[1:])] = os.path.getsize(path)
+
+for kind, kind_queries in queries.items():
+    report['lookup_us'][kind] = measure(density_library.get_density, kind_queries)
+    if kind in ('normalized', 'fuzzy'):
+        report['lookup_us'][kind + '_cached'] = measure(density_library.get_density, kind_queries)
+
+# The worst case lookups, with and without `FUZZY_MATCH_MAX_CANDIDATES`.
+for max_candidates, kind in ((library.config.FUZZY_MATCH_MAX_CANDIDATES, 'fuzzy_worst_case'), (None, 'fuzzy_worst_case_uncapped')):
+    library.config.FUZZY_MATCH_MAX_CANDIDATES = max_candidates
+    density_library._fuzzy_cache.clear()
+    lookup_us = [measure(density_library.get_density, [query]) for query in worst_case_queries]
+    report['lookup_us'][kind] = sum(lookup_us) / len(lookup_us)
+    report['lookup_us'][kind + '_max'] = max(lookup_us)
+
+legacy_library = {}
+for group, name, area_density, volume_density in entries:
+    legacy_library.setdefault(group, {})[name] = [area_density, volume_density]
+for kind in ('exact', 'group_fallback', 'missing'):
+    report['legacy_lookup_us'][kind] = measure(
+        lambda group, name: get_legacy_density(legacy_library, group, name),
+        queries[kind]
+    )
+
+print(json.dumps(report, indent=4))
+if args.o is not None:
+    with open(args.o, 'w') as out_file:
+        json.dump(report, out_file, indent=4)
@@ -0,0 +1,134 @@
+import argparse
+import json
+import time
+import numpy as np
+import cv2
+import skimage.measure
+
+import fvolume
+from fvolume import recognition
+
+arg_parser = argparse.ArgumentParser(
+    description='Measuring the entity labeling on segmentation masks with many small '
+        'components, against the previous per-label implementation. Run from the server '
+        'directory with `python -m benchmarks.entity_labeling`.'
+)
+arg_parser.add_argument(
+    '-n',
+    help='Number of masks of each component count.',
+    type=int,
+    default=5
+)
+arg_parser.add_argument(
+    '--components',
+    help='Numbers of small components of the masks, besides the large entities.',
+    type=int,
+    nargs='+',
+    default=[0, 100, 500, 2000]
+)
+arg_parser.add_argument(
+    '--entities',
+    help='Number of large food entities of the masks.',
+    type=int,
+    default=6
+)
+arg_parser.add_argument(
+    '--skip-legacy',
+    help='Skip the previous per-label implementation.',
+    action='store_true'
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of the JSON report.',
+    type=str,
+    default=None
+)
+args = arg_parser.parse_args()
+
+
+def get_legacy_entity_labeling(image, mask):
+    """ The previous entity labeling, which thresholds the mask with
+        `np.vectorize` and scans the whole label mask once per label.
+    """
+    bin_func = np.vectorize(lambda x: 0 if x < fvolume.config.FOOD_PROB_THRESHOLD else 1)
+    binary_mask = bin_func(mask)
+    label_mask = skimage.measure.label(binary_mask, connectivity=2, background=0)
+    boxes = [[
+            *map(lambda x: (min(x), max(x) + 1), np.where(label_mask == entity))
+        ] for entity in np.unique(label_mask)
+    ]
+    invalid_entity_indices = [
+        index
+        for index, box in enumerate(boxes)
+        if min(box[0][1] - box[0][0], box[1][1] - box[1][0]) < fvolume.config.FOOD_MIN_SIZE_THRESHOLD
+    ]
+    label_mask[np.isin(label_mask, invalid_entity_indices)] = 0
+    boxes = [box for index, box in enumerate(boxes) if index not in invalid_entity_indices]
+    return label_mask, boxes[1:]
+
+
+def make_mask(rng, entity_count, component_count):
+    """ Make a segmentation probability mask of `config.UNIFIED_IMAGE_SIZE`, with
+        `entity_count` large ellipses and `component_count` specks below
+        `config.FOOD_MIN_SIZE_THRESHOLD`, like the noise of a real mask.
+    """
+    mask = np.zeros(fvolume.config.UNIFIED_IMAGE_SIZE, dtype=np.float32)
+    size = np.array(fvolume.config.UNIFIED_IMAGE_SIZE)
+    for _ in range(entity_count):
+        center = rng.integers(size // 8, size * 7 // 8)
+        axes = rng.integers(size // 24, size // 10)
+        cv2.ellipse(mask, (int(center[1]), int(center[0])), (int(axes[1]), int(axes[0])), 0, 0, 360, 1.0, -1)
+    max_radius = max(1, int(fvolume.config.FOOD_MIN_SIZE_THRESHOLD // 4))
+    for _ in range(component_count):
+        center = rng.integers(0, size)
+        cv2.circle(mask, (int(center[1]), int(center[0])), int(rng.integers(0, max_radius)), 1.0, -1)
+    # Soften the probabilities around the threshold.
+    return np.clip(mask * rng.uniform(0.45, 1.0, mask.shape), 0.0, 1.0).astype(np.float32)
+
+
+report = {
+    'masks': args.n,
+    'entities': args.entities,
+    'unified_image_size': fvolume.config.UNIFIED_IMAGE_SIZE,
+    'settings': []
+}
+for component_count in args.components:
+    rng = np.random.default_rng(component_count)
+    timings = {'labeling': [], 'legacy': []}
+    labels, kept_entities, identical = [], [], True
+    for _ in range(args.n):
+        mask = make_mask(rng, args.entities, component_count)
+        start_time = time.perf_counter()
+        label_mask, boxes = recognition._get_entity_labeling(None, mask)
+        timings['labeling'].append(time.perf_counter() - start_time)
+        labels.append(int(skimage.measure.label(mask >= fvolume.config.FOOD_PROB_THRESHOLD, connectivity=2).max()))
+        kept_entities.append(len(boxes))
+        if not args.skip_legacy:
+            start_time = time.perf_counter()
+            legacy_label_mask, legacy_boxes = get_legacy_entity_labeling(None, mask)
+            timings['legacy'].append(time.perf_counter() - start_time)
+            identical = identical and np.array_equal(label_mask, legacy_label_mask) and [
+                [tuple(map(int, edge)) for edge in box] for box in boxes
+            ] == [
+                [tuple(map(int, edge)) for edge in box] for box in legacy_boxes
+            ]
+    setting = {
+        'components': component_count,
+        'mean_labels': float(np.mean(labels)),
+        'mean_kept_entities': float(np.mean(kept_entities)),
+        **{
+            '{}_ms'.format(name): {
+                'p50': float(np.percentile(values, 50) * 1000.0),
+                'max': float(np.max(values) * 1000.0)
+            }
+            for name, values in timings.items() if len(values) > 0
+        }
+    }
+    if not args.skip_legacy:
+        setting['identical'] = bool(identical)
+    report['settings'].append(setting)
+
+print(json.dumps(report, indent=4))
+if args.o is not None:
+    with open(args.o, 'w') as out_file:
+        json.dump(report, out_file, indent=4)
@@ -0,0 +1,99 @@
+import argparse
+import json
+import time
+import numpy as np
+
+import fvolume
+from fvolume import estimation
+from fvolume import utils
+
+from benchmarks import synthetic_scenes
+
+arg_parser = argparse.ArgumentParser(
+    description='Measuring the interpolation point filter on full frame point clouds of '
+        'synthetic scenes, against the previous per-point filter. Run from the server '
+        'directory with `python -m benchmarks.interpolation_filter`.'
+)
+arg_parser.add_argument(
+    '-n',
+    help='Number of scenes.',
+    type=int,
+    default=3
+)
+arg_parser.add_argument(
+    '--skip-legacy',
+    help='Skip the previous per-point filter, which takes seconds per frame.',
+    action='store_true'
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of the JSON report.',
+    type=str,
+    default=None
+)
+args = arg_parser.parse_args()
+
+
+def filter_legacy_interpolation_points(point_cloud, distance, count):
+    """ The previous per-point filter over a dictionary grid lookup.
+    """
+    lookup = {}
+    x_min, y_min = np.min(point_cloud[:,0]), np.min(point_cloud[:,1])
+    indices = [
+        (utils.get_relative_index(point[0], x_min, distance), utils.get_relative_index(point[1], y_min, distance))
+        for point in point_cloud
+    ]
+    for index, point in zip(indices, point_cloud):
+        lookup.setdefault(index, []).append(point)
+    filtered_points = []
+    for (x_index, y_index), point in zip(indices, point_cloud):
+        close_points = np.array([
+            close_point
+            for x_offset in (-1, 0, 1) for y_offset in (-1, 0, 1)
+            for close_point in lookup.get((x_index + x_offset, y_index + y_offset), ())
+        ])
+        if np.sum(np.sum(np.square(close_points - point), axis=1) < distance ** 2) > count:
+            filtered_points.append(point)
+    return np.array(filtered_points).reshape(-1, 3)
+
+
+def get_full_point_cloud(scene):
+    """ Returning the point cloud of all the valid pixels of the regulated depth
+        map of a synthetic scene.
+    """
+    calibration = scene['peripheral']['calibration_data']
+    depth_map = utils.regulate_image(scene['peripheral']['depth_data'], calibration)
+    x_rays, y_rays = synthetic_scenes.get_regulated_rays(depth_map.shape, calibration)
+    valid_mask = depth_map > 0
+    return np.column_stack([
+        x_rays[valid_mask] * depth_map[valid_mask],
+        y_rays[valid_mask] * depth_map[valid_mask],
+        depth_map[valid_mask]
+    ])
+
+
+report = {'scenes': args.n, 'unified_image_size': fvolume.config.UNIFIED_IMAGE_SIZE, 'frames': []}
+for seed in range(args.n):
+    point_cloud = get_full_point_cloud(synthetic_scenes.make_scene(seed))
+    start_time = time.perf_counter()
+    filtered_point_cloud = estimation._filter_interpolation_points(point_cloud)
+    frame = {
+        'points': len(point_cloud),
+        'kept_points': len(filtered_point_cloud),
+        'seconds': time.perf_counter() - start_time
+    }
+    if not args.skip_legacy:
+        start_time = time.perf_counter()
+        legacy_point_cloud = filter_legacy_interpolation_points(
+            point_cloud,
+            fvolume.config.INTERPOLATION_POINT_FILTER_DISTANCE,
+            fvolume.config.INTERPOLATION_POINT_FILTER_COUNT
+        )
+        frame['legacy_seconds'] = time.perf_counter() - start_time
+        frame['identical'] = bool(np.array_equal(filtered_point_cloud, legacy_point_cloud))
+    report['frames'].append(frame)
+
+print(json.dumps(report, indent=4))
+if args.o is not None:
+    with open(args.o, 'w') as out_file:
+        json.dump(report, out_file, indent=4)
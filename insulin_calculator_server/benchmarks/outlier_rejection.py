@@ -0,0 +1,89 @@
+import argparse
+import json
+import time
+import numpy as np
+
+import fvolume
+from fvolume import estimation
+
+import data_manager
+
+arg_parser = argparse.ArgumentParser(
+    description='Comparing the accuracy and runtime of the outlier rejection methods '
+        'of volume estimation on stored sessions. Run from the server directory with '
+        '`python -m benchmarks.outlier_rejection`.'
+)
+arg_parser.add_argument(
+    'sessions',
+    help='Directory of stored recognition sessions.',
+    type=str
+)
+arg_parser.add_argument(
+    '--methods',
+    help='Outlier rejection methods to compare, the first one is the reference.',
+    nargs='+',
+    default=['lof', 'sorted_lof', 'mad', 'quantile']
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of the JSON report.',
+    type=str,
+    default=None
+)
+args = arg_parser.parse_args()
+
+rejection_seconds = []
+get_depth_inlier_mask = estimation._get_depth_inlier_mask
+
+
+def timed_get_depth_inlier_mask(depths, method=None):
+    """ `estimation._get_depth_inlier_mask` which records its wall time.
+    """
+    start_time = time.perf_counter()
+    inlier_mask = get_depth_inlier_mask(depths, method)
+    rejection_seconds.append(time.perf_counter() - start_time)
+    return inlier_mask
+
+
+estimation._get_depth_inlier_mask = timed_get_depth_inlier_mask
+
+volumes = {method: [] for method in args.methods}
+timings = {method: {'estimation': [], 'rejection': []} for method in args.methods}
+for session_dir in data_manager.find_session_dirs(args.sessions):
+    image, peripheral = data_manager.load_session_dir(session_dir)
+    label_mask, _, _ = fvolume.recognition.get_recognition_results(image, peripheral['calibration_data'])
+    for method in args.methods:
+        fvolume.config.OUTLIER_REJECTION_METHOD = method
+        rejection_seconds.clear()
+        start_time = time.perf_counter()
+        area_volumes = estimation.get_area_volume(
+            peripheral['depth_data'],
+            peripheral['calibration_data'],
+            peripheral.get('device_attitude'),
+            label_mask
+        )
+        timings[method]['estimation'].append(time.perf_counter() - start_time)
+        timings[method]['rejection'].append(sum(rejection_seconds))
+        volumes[method].extend(volume for _, volume in area_volumes)
+
+reference_volumes = np.array(volumes[args.methods[0]])
+report = {'sessions': len(timings[args.methods[0]]['estimation']), 'entities': len(reference_volumes), 'methods': {}}
+for method in args.methods:
+    relative_errors = np.abs(np.array(volumes[method]) - reference_volumes) / np.maximum(reference_volumes, 1e-9)
+    report['methods'][method] = {
+        **{
+            '{}_ms'.format(stage): {
+                name: float(np.percentile(values, percentile) * 1000.0) if len(values) > 0 else None
+                for name, percentile in (('p50', 50), ('p95', 95))
+            } for stage, values in timings[method].items()
+        },
+        'volume_relative_error': {
+            name: float(np.percentile(relative_errors, percentile)) if len(relative_errors) > 0 else None
+            for name, percentile in (('p50', 50), ('p95', 95), ('max', 100))
+        }
+    }
+
+print(json.dumps(report, indent=4))
+if args.o is not None:
+    with open(args.o, 'w') as out_file:
+        json.dump(report, out_file, indent=4)
@@ -0,0 +1,113 @@
+import argparse
+import json
+import time
+import numpy as np
+
+import fvolume
+from fvolume import estimation
+
+import data_manager
+
+arg_parser = argparse.ArgumentParser(
+    description='Comparing the accuracy and runtime of the plane detection of volume '
+        'estimation with different `PLANE_FIT_SAMPLE_SIZE` on stored sessions. Run from '
+        'the server directory with `python -m benchmarks.plane_detection`.'
+)
+arg_parser.add_argument(
+    'sessions',
+    help='Directory of stored recognition sessions.',
+    type=str
+)
+arg_parser.add_argument(
+    '--sample-sizes',
+    help='Sample sizes to compare with fitting on the full point cloud, which is the '
+        'reference.',
+    type=int,
+    nargs='+',
+    default=[65536, 16384, 4096, 1024]
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of the JSON report.',
+    type=str,
+    default=None
+)
+args = arg_parser.parse_args()
+
+sample_sizes = [None] + args.sample_sizes
+plane_results = []
+get_plane_recognition = estimation._get_plane_recognition
+
+
+def timed_get_plane_recognition(point_cloud, fit_mask=None):
+    """ `estimation._get_plane_recognition` which records its wall time and
+        result.
+    """
+    start_time = time.perf_counter()
+    inlier_mask, rotation = get_plane_recognition(point_cloud, fit_mask)
+    plane_results.append((time.perf_counter() - start_time, inlier_mask, rotation))
+    return inlier_mask, rotation
+
+
+estimation._get_plane_recognition = timed_get_plane_recognition
+
+records = {sample_size: {'plane': [], 'estimation': [], 'angle': [], 'mismatch': [], 'volume': []} for sample_size in sample_sizes}
+for session_dir in data_manager.find_session_dirs(args.sessions):
+    image, peripheral = data_manager.load_session_dir(session_dir)
+    regulated_image, regulated_depth_map = fvolume.utils.regulate_session_images(
+        image,
+        peripheral['depth_data'],
+        peripheral['calibration_data']
+    )
+    label_mask, _, _ = fvolume.recognition.get_recognition_results(
+        image,
+        peripheral['calibration_data'],
+        regulated_image=regulated_image
+    )
+    for sample_size in sample_sizes:
+        fvolume.config.PLANE_FIT_SAMPLE_SIZE = sample_size
+        plane_results.clear()
+        start_time = time.perf_counter()
+        area_volumes = estimation.get_area_volume(
+            None,
+            peripheral['calibration_data'],
+            peripheral.get('device_attitude'),
+            label_mask,
+            regulated_depth_map
+        )
+        records[sample_size]['estimation'].append(time.perf_counter() - start_time)
+        plane_seconds, inlier_mask, rotation = plane_results[0]
+        if sample_size is None:
+            reference_inlier_mask, reference_rotation = inlier_mask, rotation
+        records[sample_size]['plane'].append(plane_seconds)
+        records[sample_size]['angle'].append(np.degrees((reference_rotation.inv() * rotation).magnitude()))
+        records[sample_size]['mismatch'].append(np.mean(inlier_mask != reference_inlier_mask))
+        records[sample_size]['volume'].extend(volume for _, volume in area_volumes)
+
+
+def get_percentiles(values, percentiles, scale=1.0):
+    """ Returning the percentiles of `values` by their names, `None` if there
+        is no value.
+    """
+    return {
+        name: float(np.percentile(values, percentile) * scale) if len(values) > 0 else None
+        for name, percentile in percentiles
+    }
+
+
+reference_volumes = np.array(records[None]['volume'])
+report = {'sessions': len(records[None]['plane']), 'entities': len(reference_volumes), 'sample_sizes': {}}
+for sample_size in sample_sizes:
+    relative_errors = np.abs(np.array(records[sample_size]['volume']) - reference_volumes) / np.maximum(reference_volumes, 1e-9)
+    report['sample_sizes']['full' if sample_size is None else str(sample_size)] = {
+        'plane_ms': get_percentiles(records[sample_size]['plane'], (('p50', 50), ('p95', 95)), 1000.0),
+        'estimation_ms': get_percentiles(records[sample_size]['estimation'], (('p50', 50), ('p95', 95)), 1000.0),
+        'plane_angle_degrees': get_percentiles(records[sample_size]['angle'], (('p50', 50), ('p95', 95), ('max', 100))),
+        'inlier_mismatch_fraction': get_percentiles(records[sample_size]['mismatch'], (('p50', 50), ('p95', 95), ('max', 100))),
+        'volume_relative_error': get_percentiles(relative_errors, (('p50', 50), ('p95', 95), ('max', 100)))
+    }
+
+print(json.dumps(report, indent=4))
+if args.o is not None:
+    with open(args.o, 'w') as out_file:
+        json.dump(report, out_file, indent=4)
@@ -0,0 +1,291 @@
+import argparse
+import concurrent.futures
+import http.server
+import json
+import platform
+import resource
+import threading
+import time
+import zlib
+import numpy as np
+
+import fvolume
+import fdensitylib
+
+import config
+import data_manager
+import pipeline
+
+# The stages compared against the baseline report.
+COMPARED_STAGES = ('regulation', 'recognition', 'classification', 'estimation', 'density', 'total')
+
+
+class StubClassifierHandler(http.server.BaseHTTPRequestHandler):
+    """ A local stand-in of the commercial classifier, which answers each
+        image with food candidates from the density library. The candidates
+        are chosen by the checksum of the image, so that the same image is
+        always answered the same.
+
+    Attributes:
+        entries: The density library entries to choose the candidates from.
+        latency: The time to wait before answering, in seconds.
+    """
+    entries = []
+    latency = 0.0
+
+    def do_POST(self):
+        buffer = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.latency)
+        start = zlib.crc32(buffer)
+        items = [
+            {'group': group, 'name': name, 'score': 1.0 / (index + 1)}
+            for index, (group, name, _, _) in enumerate(
+                self.entries[(start + offset) % len(self.entries)] for offset in range(3)
+            )
+        ]
+        content = json.dumps({'is_food': True, 'results': [{'items': items}]}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_classifier(latency):
+    """ Start the stub classifier on a local port in a background thread.
+
+    Args:
+        latency: The time for the stub to wait before answering, in seconds.
+
+    Returns:
+        The `http.server.ThreadingHTTPServer` of the stub.
+    """
+    StubClassifierHandler.entries = fdensitylib.library.load_entries(fdensitylib.config.DENSITY_LIBRARY_PATH)
+    StubClassifierHandler.latency = latency
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubClassifierHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub_classifier', daemon=True).start()
+    return server
+
+
+def get_process_peak_rss_mb(pid):
+    """ Returning the peak resident set size of the process `pid` in megabytes,
+        read from `/proc`. `None` if it is not available, such as on macOS.
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def get_peak_rss_mb(estimation_pids):
+    """ Returning the peak resident set size of this process, and of each of the
+        running estimation processes, in megabytes. The estimation processes are
+        started by the fork server rather than this process, so they are not
+        counted in `RUSAGE_CHILDREN`, and are sampled from `/proc` instead.
+
+    Args:
+        estimation_pids: The pids of the estimation processes.
+    """
+    # `ru_maxrss` is in kilobytes on Linux, and in bytes on macOS.
+    unit = 1024.0 * 1024.0 if platform.system() == 'Darwin' else 1024.0
+    estimation_peak_rss = [get_process_peak_rss_mb(pid) for pid in estimation_pids]
+    estimation_peak_rss = [rss for rss in estimation_peak_rss if rss is not None]
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        'estimation_processes': estimation_peak_rss,
+        'estimation_processes_total': sum(estimation_peak_rss)
+    }
+
+
+def replay_session(estimation_pipeline, session_dir, load_seconds):
+    """ Load a stored session and run it through the pipeline, the loading time
+        is appended to `load_seconds`. Returning the number of estimated
+        entities.
+    """
+    start_time = time.perf_counter()
+    image, peripheral = data_manager.load_session_dir(session_dir)
+    load_seconds.append(time.perf_counter() - start_time)
+    results, _ = estimation_pipeline.estimate(image, peripheral)
+    return len(results)
+
+
+def replay(session_dirs, worker_count, process_count):
+    """ Replay the sessions through a new pipeline by `worker_count` concurrent
+        threads, like a gunicorn `gthread` worker.
+
+    Args:
+        session_dirs: The directories of the sessions to replay.
+        worker_count: The number of concurrent requests.
+        process_count: The number of volume estimation processes of the pipeline.
+
+    Returns:
+        A dictionary with the counts of `sessions`, `failed` sessions and
+            `entities`, the `wall_seconds` and `throughput` in sessions per
+            second, the `stages` statistics of `pipeline.PipelineMetrics` and of
+            the session loading, and the `peak_rss_mb` so far, see
+            `get_peak_rss_mb`.
+    """
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=process_count)
+    # Load the models and start the pools outside of the measurement.
+    replay_session(estimation_pipeline, session_dirs[0], [])
+    metrics = estimation_pipeline.metrics = pipeline.PipelineMetrics(window=len(session_dirs))
+    load_seconds = []
+    failed_count = entity_count = 0
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        futures = [
+            executor.submit(replay_session, estimation_pipeline, session_dir, load_seconds)
+            for session_dir in session_dirs
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                entity_count += future.result()
+            except Exception as error:
+                failed_count += 1
+                print('Failed to replay a session: {!r}'.format(error))
+    wall_seconds = time.perf_counter() - start_time
+    load_metrics = pipeline.PipelineMetrics(window=max(1, len(load_seconds)))
+    for duration in load_seconds:
+        load_metrics.record({'load': duration})
+    # The estimation processes are sampled before they are shut down.
+    peak_rss_mb = get_peak_rss_mb(estimation_pipeline.get_process_pids())
+    estimation_pipeline.shutdown()
+    return {
+        'sessions': len(session_dirs),
+        'failed': failed_count,
+        'entities': entity_count,
+        'wall_seconds': wall_seconds,
+        'throughput': (len(session_dirs) - failed_count) / wall_seconds,
+        'stages': {**load_metrics.get_stats(), **metrics.get_stats()},
+        'peak_rss_mb': peak_rss_mb
+    }
+
+
+def compare_reports(report, baseline):
+    """ Returning the ratios of the p50 and p95 stage latencies and of the
+        throughput of `report` to those of `baseline`, for the worker counts in
+        both of them. Ratios above 1 for latencies, or below 1 for throughput,
+        are regressions.
+    """
+    ratios = {}
+    for worker_count, run in report['runs'].items():
+        baseline_run = baseline['runs'].get(worker_count)
+        if baseline_run is None:
+            continue
+        ratios[worker_count] = {'throughput': run['throughput'] / baseline_run['throughput']}
+        for stage in COMPARED_STAGES:
+            if stage in run['stages'] and stage in baseline_run['stages']:
+                ratios[worker_count][stage] = {
+                    name: run['stages'][stage][name] / max(baseline_run['stages'][stage][name], 1e-9)
+                    for name in ('p50', 'p95')
+                }
+    return ratios
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Replaying stored recognition sessions through the nutrition estimation '
+            'pipeline with a local stub classifier, and reporting the stage latencies, '
+            'the peak memory and the throughput. Run from the server directory with '
+            '`python -m benchmarks.replay`.'
+    )
+    arg_parser.add_argument(
+        'sessions',
+        help='Directory of stored recognition sessions.',
+        type=str,
+        nargs='?',
+        default=config.RECOGNITION_STORAGE_DIR
+    )
+    arg_parser.add_argument(
+        '-w',
+        help='Numbers of concurrent requests to replay the sessions with.',
+        type=int,
+        nargs='+',
+        default=[1, 2, 4, 8]
+    )
+    arg_parser.add_argument(
+        '-p',
+        help='Number of volume estimation processes of the pipeline, 0 to estimate in '
+            'the request threads.',
+        type=int,
+        default=config.ESTIMATION_PROCESS_COUNT
+    )
+    arg_parser.add_argument(
+        '-n',
+        help='Maximum number of sessions to replay.',
+        type=int,
+        default=None
+    )
+    arg_parser.add_argument(
+        '--repeat',
+        help='Number of times to replay each session.',
+        type=int,
+        default=1
+    )
+    arg_parser.add_argument(
+        '--classifier-latency',
+        help='Time for the stub classifier to wait before answering, in milliseconds.',
+        type=float,
+        default=0.0
+    )
+    arg_parser.add_argument(
+        '--baseline',
+        help='Path of a previous JSON report to compare with.',
+        type=str,
+        default=None
+    )
+    arg_parser.add_argument(
+        '-o',
+        help='Output path of the JSON report.',
+        type=str,
+        default=None
+    )
+    args = arg_parser.parse_args()
+
+    session_dirs = data_manager.find_session_dirs(args.sessions)[:args.n] * args.repeat
+    if len(session_dirs) == 0:
+        raise SystemExit('No session is found in {}.'.format(args.sessions))
+    server = start_stub_classifier(args.classifier_latency / 1000.0)
+    fvolume.classification.config_secure.CLASSIFIER_URL = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    # Every crop should reach the stub classifier.
+    fvolume.config.CLASSIFICATION_CACHE_BACKEND = None
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'config': {
+            'estimation_process_count': args.p,
+            'classifier_latency_ms': args.classifier_latency,
+            'unified_image_size': fvolume.config.UNIFIED_IMAGE_SIZE,
+            'seg_model_backend': fvolume.config.SEG_MODEL_BACKEND,
+            'outlier_rejection_method': fvolume.config.OUTLIER_REJECTION_METHOD,
+            'plane_fit_sample_size': fvolume.config.PLANE_FIT_SAMPLE_SIZE,
+            'entity_worker_count': fvolume.config.ENTITY_WORKER_COUNT
+        },
+        'runs': {}
+    }
+    for worker_count in args.w:
+        report['runs'][str(worker_count)] = replay(session_dirs, worker_count, args.p)
+    if args.baseline is not None:
+        with open(args.baseline) as in_file:
+            report['baseline_ratios'] = compare_reports(report, json.load(in_file))
+    server.shutdown()
+
+    print(json.dumps(report, indent=4))
+    if args.o is not None:
+        with open(args.o, 'w') as out_file:
+            json.dump(report, out_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
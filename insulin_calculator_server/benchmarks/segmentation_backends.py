@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import fvolume
+
+# The model path of each segmentation backend.
+MODEL_PATHS = {
+    'keras': fvolume.config.SEG_MODEL_PATH,
+    'tflite': fvolume.config.SEG_TFLITE_MODEL_PATH,
+    'onnx': fvolume.config.SEG_ONNX_MODEL_PATH
+}
+
+
+def get_sample_images(count, seed=0):
+    """ Returning `count` random normalized images, normalized the same way as
+        `fvolume.recognition._get_segmentation`.
+    """
+    return np.random.default_rng(seed).standard_normal(
+        (count, *fvolume.config.UNIFIED_IMAGE_SIZE, 3)
+    ).astype(np.float32)
+
+
+def measure_backend(backend, sample_count, batch_size, repeat, output_path):
+    """ Load a segmentation backend in this process, predict the sample images,
+        and save the raw outputs to `output_path`. This runs in a new interpreter
+        for each backend, so that the startup time and the peak memory include
+        importing the runtime.
+
+    Returns:
+        A dictionary with the `load_seconds`, the `first_prediction_seconds`, the
+            `batch_ms` percentiles and the `peak_rss_mb`.
+    """
+    start_time = time.perf_counter()
+    model = fvolume.segmentation_backend.load_segmentation_backend(backend)
+    load_seconds = time.perf_counter() - start_time
+    images = get_sample_images(sample_count)
+    start_time = time.perf_counter()
+    model.predict(images[:1])
+    first_prediction_seconds = time.perf_counter() - start_time
+    batch_seconds, outputs = [], []
+    for _ in range(repeat):
+        outputs = []
+        for start in range(0, sample_count, batch_size):
+            start_time = time.perf_counter()
+            outputs.append(model.predict(images[start:start + batch_size]))
+            batch_seconds.append(time.perf_counter() - start_time)
+    np.save(output_path, np.concatenate(outputs))
+    # `ru_maxrss` is in kilobytes on Linux, and in bytes on macOS.
+    unit = 1024.0 * 1024.0 if platform.system() == 'Darwin' else 1024.0
+    return {
+        'load_seconds': load_seconds,
+        'first_prediction_seconds': first_prediction_seconds,
+        'batch_ms': {
+            name: float(np.percentile(batch_seconds, percentile) * 1000.0)
+            for name, percentile in (('p50', 50), ('p95', 95))
+        },
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    }
+
+
+def run_backend(backend, args, output_path):
+    """ Run `measure_backend` in a new interpreter, returning its report.
+    """
+    output = subprocess.run(
+        [
+            sys.executable, '-m', 'benchmarks.segmentation_backends', '--child', backend,
+            '-n', str(args.n), '-b', str(args.b), '--repeat', str(args.repeat),
+            '--child-output', output_path
+        ],
+        check=True,
+        stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Comparing the segmentation backends against the Keras model, by the '
+            'mask agreement, the startup time, the prediction latency and the peak memory. '
+            'Each backend is measured in a new interpreter. Run from the server directory '
+            'with `python -m benchmarks.segmentation_backends`.'
+    )
+    arg_parser.add_argument(
+        '--backends',
+        help='Backends to compare with the Keras model, those without a model file are skipped.',
+        choices=['tflite', 'onnx'],
+        nargs='+',
+        default=['tflite', 'onnx']
+    )
+    arg_parser.add_argument(
+        '-n',
+        help='Number of random sample images.',
+        type=int,
+        default=16
+    )
+    arg_parser.add_argument(
+        '-b',
+        help='Batch size of the predictions.',
+        type=int,
+        default=1
+    )
+    arg_parser.add_argument(
+        '--repeat',
+        help='Number of times to predict the sample images.',
+        type=int,
+        default=3
+    )
+    arg_parser.add_argument(
+        '-o',
+        help='Output path of the JSON report.',
+        type=str,
+        default=None
+    )
+    arg_parser.add_argument('--child', help=argparse.SUPPRESS, default=None)
+    arg_parser.add_argument('--child-output', help=argparse.SUPPRESS, default=None)
+    args = arg_parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure_backend(args.child, args.n, args.b, args.repeat, args.child_output)))
+        return
+
+    report = {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'samples': args.n,
+        'batch_size': args.b,
+        'unified_image_size': fvolume.config.UNIFIED_IMAGE_SIZE,
+        'seg_model_threads': fvolume.config.SEG_MODEL_THREADS,
+        'backends': {}
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        outputs = {}
+        for backend in ['keras', *args.backends]:
+            if not os.path.exists(MODEL_PATHS[backend]):
+                print('Skipping {}, the model is not found at {}.'.format(backend, MODEL_PATHS[backend]))
+                continue
+            output_path = os.path.join(temp_dir, '{}.npy'.format(backend))
+            report['backends'][backend] = run_backend(backend, args, output_path)
+            outputs[backend] = np.load(output_path)
+        if 'keras' not in outputs:
+            raise SystemExit('The Keras model is required as the reference.')
+        keras_mask = outputs['keras'] >= fvolume.config.FOOD_PROB_THRESHOLD
+        for backend in args.backends:
+            if backend in outputs:
+                report['backends'][backend]['max_abs_difference'] = float(np.max(np.abs(outputs[backend] - outputs['keras'])))
+                report['backends'][backend]['mask_agreement'] = float(np.mean(
+                    (outputs[backend] >= fvolume.config.FOOD_PROB_THRESHOLD) == keras_mask
+                ))
+
+    print(json.dumps(report, indent=4))
+    if args.o is not None:
+        with open(args.o, 'w') as out_file:
+            json.dump(report, out_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
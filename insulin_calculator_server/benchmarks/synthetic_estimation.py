@@ -0,0 +1,117 @@
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+
+import fvolume
+
+from benchmarks import synthetic_scenes
+
+arg_parser = argparse.ArgumentParser(
+    description='Comparing the accuracy and runtime of volume estimation on synthetic '
+        'scenes of known volumes, over depth map resolutions, regulated resolutions and '
+        'noise levels. Run from the server directory with '
+        '`python -m benchmarks.synthetic_estimation`.'
+)
+arg_parser.add_argument(
+    '-n',
+    help='Number of scenes of each setting.',
+    type=int,
+    default=20
+)
+arg_parser.add_argument(
+    '--depth-sizes',
+    help='Depth map sizes as WIDTHxHEIGHT.',
+    type=synthetic_scenes.parse_size,
+    nargs='+',
+    default=[(640, 480), (1280, 960)]
+)
+arg_parser.add_argument(
+    '--regulated-sizes',
+    help='Edge lengths of the regulated images, which override `UNIFIED_IMAGE_SIZE`.',
+    type=int,
+    nargs='+',
+    default=[512, 768, 1024]
+)
+arg_parser.add_argument(
+    '--entities',
+    help='Number of food entities of each scene.',
+    type=int,
+    default=3
+)
+arg_parser.add_argument(
+    '--noises',
+    help='Standard deviations of the depth noise, in meters.',
+    type=float,
+    nargs='+',
+    default=[0.0, 5e-4, 2e-3]
+)
+arg_parser.add_argument(
+    '-o',
+    help='Output path of the JSON report.',
+    type=str,
+    default=None
+)
+args = arg_parser.parse_args()
+
+
+def get_percentiles(values, percentiles, scale=1.0):
+    """ Returning the percentiles of `values` by their names, `None` if there
+        is no value.
+    """
+    return {
+        name: float(np.percentile(values, percentile) * scale) if len(values) > 0 else None
+        for name, percentile in percentiles
+    }
+
+
+report = {'scenes': args.n, 'entities': args.entities, 'settings': []}
+for depth_size, regulated_size, noise_std in itertools.product(args.depth_sizes, args.regulated_sizes, args.noises):
+    fvolume.config.UNIFIED_IMAGE_SIZE = (regulated_size, regulated_size)
+    timings = {'regulation': [], 'estimation': []}
+    volume_errors, area_errors = [], []
+    for seed in range(args.n):
+        scene = synthetic_scenes.make_scene(
+            seed=seed,
+            depth_size=depth_size,
+            image_size=depth_size,
+            entity_count=args.entities,
+            noise_std=noise_std
+        )
+        calibration = scene['peripheral']['calibration_data']
+        start_time = time.perf_counter()
+        regulated_depth_map = fvolume.utils.regulate_image(scene['peripheral']['depth_data'], calibration)
+        timings['regulation'].append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        area_volumes = fvolume.estimation.get_area_volume(
+            None,
+            calibration,
+            None,
+            scene['label_mask'],
+            regulated_depth_map
+        )
+        timings['estimation'].append(time.perf_counter() - start_time)
+        # Entities hidden in the label mask are not estimated.
+        labels = np.unique(scene['label_mask'])[1:]
+        for label, (area, volume) in zip(labels, area_volumes):
+            entity = scene['entities'][label - 1]
+            area_errors.append(area / entity['area'] - 1.0)
+            volume_errors.append(volume / entity['volume'] - 1.0)
+    report['settings'].append({
+        'depth_size': list(depth_size),
+        'regulated_size': regulated_size,
+        'noise_std': noise_std,
+        **{
+            '{}_ms'.format(stage): get_percentiles(values, (('p50', 50), ('p95', 95)), 1000.0)
+            for stage, values in timings.items()
+        },
+        'volume_relative_error': get_percentiles(volume_errors, (('p5', 5), ('p50', 50), ('p95', 95))),
+        'volume_absolute_relative_error': get_percentiles(np.abs(volume_errors), (('p50', 50), ('p95', 95), ('max', 100))),
+        'area_relative_error': get_percentiles(area_errors, (('p5', 5), ('p50', 50), ('p95', 95)))
+    })
+
+print(json.dumps(report, indent=4))
+if args.o is not None:
+    with open(args.o, 'w') as out_file:
+        json.dump(report, out_file, indent=4)
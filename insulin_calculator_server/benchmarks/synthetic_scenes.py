@@ -0,0 +1,468 @@
+import argparse
+import json
+import os
+import numpy as np
+from PIL import Image
+from scipy.spatial.transform import Rotation
+
+import fvolume
+
+import data_manager
+import peripheral_format
+
+# The reference dimensions of the synthetic camera intrinsics, `(width, height)`,
+# the same as the color camera of an iPhone.
+REFERENCE_DIMENSIONS = (4032, 3024)
+
+# The focal length of the synthetic camera, in pixels of `REFERENCE_DIMENSIONS`.
+FOCAL_LENGTH = 2800.0
+
+# The number of entries of the synthetic lens distortion lookup table.
+LOOKUP_TABLE_SIZE = 42
+
+# The shapes of the synthetic food entities.
+SHAPES = ('box', 'hemisphere', 'cylinder')
+
+# The color of the table, and the colors of the food entities in turn.
+TABLE_COLOR = (176, 148, 116)
+ENTITY_COLORS = ((214, 160, 62), (120, 170, 70), (190, 70, 50), (240, 220, 170), (110, 70, 40))
+
+# The number of rays cast at once, which bounds the memory of rendering large
+# images.
+RAY_CHUNK_SIZE = 1 << 20
+
+# The name of the ground truth file of the written sessions.
+TRUTH_FILE_NAME = 'synthetic_truth.json'
+
+# The name of the regulated label mask file of the written sessions.
+LABEL_MASK_FILE_NAME = 'label_mask.png'
+
+
+def make_calibration(rng, distortion):
+    """ Make the calibration data of a synthetic camera, with its principal
+        point and distortion center slightly off the image center.
+
+    Args:
+        rng: The `np.random.Generator`.
+        distortion: The magnification of the lens distortion at the farthest
+            corner from the distortion center.
+
+    Returns:
+        The calibration data as a json object, like the `calibration_data` of a
+            peripheral.
+    """
+    center = np.array(REFERENCE_DIMENSIONS) / 2.0 + rng.uniform(-20.0, 20.0, size=2)
+    return {
+        'intrinsic_matrix': [[FOCAL_LENGTH, 0.0, 0.0], [0.0, FOCAL_LENGTH, 0.0], [center[0], center[1], 1.0]],
+        'intrinsic_matrix_reference_dimensions': list(REFERENCE_DIMENSIONS),
+        'lens_distortion_center': (center + rng.uniform(-10.0, 10.0, size=2)).tolist(),
+        'lens_distortion_lookup_table': (distortion * np.linspace(0.0, 1.0, LOOKUP_TABLE_SIZE) ** 2).tolist()
+    }
+
+
+def _get_undistorted_positions(positions, calibration):
+    """ Returning the positions before the lens distortion of `calibration`,
+        which inverts the mapping of `fvolume.utils.get_lens_distortion_maps`.
+
+    Args:
+        positions: The distorted positions in pixels of `REFERENCE_DIMENSIONS`,
+            represented as a numpy array with shape `(n, 2)`.
+        calibration: The calibration data.
+    """
+    lookup_table = np.array(calibration['lens_distortion_lookup_table'])
+    center = np.array(calibration['lens_distortion_center'])
+    radius_max = np.sqrt(np.sum(np.maximum(center, np.array(REFERENCE_DIMENSIONS) - center) ** 2))
+    # The distorted radius is monotonic in the undistorted radius, so it is
+    # inverted by interpolating over a fine grid.
+    radius_grid = np.linspace(0.0, 2.0 * radius_max, 8192)
+    magnification = np.interp(radius_grid / radius_max, np.linspace(0.0, 1.0, len(lookup_table)), lookup_table)
+    distorted_radius_grid = radius_grid * (1.0 + magnification)
+    offsets = positions - center
+    distorted_radius = np.sqrt(np.sum(offsets ** 2, axis=1))
+    radius = np.interp(distorted_radius, distorted_radius_grid, radius_grid)
+    ratio = np.divide(radius, distorted_radius, out=np.ones_like(radius), where=distorted_radius > 0)
+    return center + offsets * ratio[:, np.newaxis]
+
+
+def get_pixel_rays(size, calibration):
+    """ Returning the camera rays of the pixels of a captured image, which is
+        distorted by the lens.
+
+    Args:
+        size: The image size `(width, height)`, with the same aspect ratio as
+            `REFERENCE_DIMENSIONS`.
+        calibration: The calibration data.
+
+    Returns:
+        `(x_rays, y_rays)`, two numpy arrays with shape `size`. The pixel `(i, j)`
+            with depth `d` is at `(x_rays[i, j] * d, y_rays[i, j] * d, d)` in the
+            camera coordinate system.
+    """
+    scale = REFERENCE_DIMENSIONS[0] / size[0]
+    positions = np.stack(np.meshgrid(
+        (np.arange(size[0]) + 0.5) * scale,
+        (np.arange(size[1]) + 0.5) * scale,
+        indexing='ij'
+    ), axis=-1).reshape(-1, 2)
+    positions = _get_undistorted_positions(positions, calibration)
+    intrinsic_matrix = np.array(calibration['intrinsic_matrix'])
+    return (
+        ((positions[:, 0] - intrinsic_matrix[2, 0]) / intrinsic_matrix[0, 0]).reshape(size),
+        ((positions[:, 1] - intrinsic_matrix[2, 1]) / intrinsic_matrix[0, 0]).reshape(size)
+    )
+
+
+def get_regulated_rays(size, calibration):
+    """ Returning the camera rays of the pixels of a regulated image of `size`,
+        which are the rays `fvolume.estimation` back-projects the regulated depth
+        map with.
+
+    Args:
+        size: The regulated image size `(width, height)`.
+        calibration: The calibration data.
+    """
+    intrinsic_matrix = np.array(calibration['intrinsic_matrix'])
+    scale = min(size) / min(REFERENCE_DIMENSIONS)
+    focal_length = intrinsic_matrix[0, 0] * scale
+    center_x = (intrinsic_matrix[2, 0] - (REFERENCE_DIMENSIONS[0] - REFERENCE_DIMENSIONS[1]) // 2) * scale
+    center_y = intrinsic_matrix[2, 1] * scale
+    return (
+        np.fromfunction(lambda i, j: (i - center_x) / focal_length, size),
+        np.fromfunction(lambda i, j: (j - center_y) / focal_length, size)
+    )
+
+
+def _intersect_entity(origins, directions, entity):
+    """ Returning the ray parameters where the rays first hit an entity, `inf`
+        for the rays missing it.
+
+    Args:
+        origins: The ray origins in the coordinate system of the entity, whose
+            z-axis is the table normal, with shape `(n, 3)`.
+        directions: The ray directions in the same coordinate system.
+        entity: The entity, see `make_scene`.
+    """
+    hits = np.full(len(directions), np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if entity['shape'] == 'box':
+            half_size = np.array([entity['length'] / 2.0, entity['width'] / 2.0, entity['height'] / 2.0])
+            origins = origins - np.array([0.0, 0.0, half_size[2]])
+            lows = (-half_size - origins) / directions
+            highs = (half_size - origins) / directions
+            near = np.fmax.reduce(np.fmin(lows, highs), axis=1)
+            far = np.fmin.reduce(np.fmax(lows, highs), axis=1)
+            hit_mask = (near <= far) & (far > 0)
+            hits[hit_mask] = near[hit_mask]
+        elif entity['shape'] == 'hemisphere':
+            b = np.sum(origins * directions, axis=1)
+            c = np.sum(origins ** 2, axis=1) - entity['radius'] ** 2
+            a = np.sum(directions ** 2, axis=1)
+            near = (-b - np.sqrt(b ** 2 - a * c)) / a
+            hit_mask = np.isfinite(near) & (near > 0) & (origins[:, 2] + near * directions[:, 2] >= 0)
+            hits[hit_mask] = near[hit_mask]
+        else:
+            a = np.sum(directions[:, :2] ** 2, axis=1)
+            b = np.sum(origins[:, :2] * directions[:, :2], axis=1)
+            c = np.sum(origins[:, :2] ** 2, axis=1) - entity['radius'] ** 2
+            side = (-b - np.sqrt(b ** 2 - a * c)) / a
+            side_heights = origins[:, 2] + side * directions[:, 2]
+            side_mask = np.isfinite(side) & (side > 0) & (side_heights >= 0) & (side_heights <= entity['height'])
+            top = (entity['height'] - origins[:, 2]) / directions[:, 2]
+            top_points = origins[:, :2] + top[:, np.newaxis] * directions[:, :2]
+            top_mask = (top > 0) & (np.sum(top_points ** 2, axis=1) <= entity['radius'] ** 2)
+            hits[side_mask] = side[side_mask]
+            hits[top_mask] = np.minimum(hits[top_mask], top[top_mask])
+    return hits
+
+
+def cast_rays(x_rays, y_rays, table_pose, entities):
+    """ Cast camera rays onto the table and the entities on it.
+
+    Args:
+        x_rays: The horizontal slopes of the rays, represented as a numpy array.
+        y_rays: The vertical slopes of the rays, with the same shape as `x_rays`.
+        table_pose: `(rotation, distance)`, the `Rotation` from the table
+            coordinate system to the camera coordinate system, and the depth of
+            the table at the optical axis.
+        entities: The entities on the table, see `make_scene`.
+
+    Returns:
+        `(depth_map, label_map)`, with the same shape as `x_rays`. The depth is
+            along the optical axis, the label is `0` for the table, and `k` for
+            the `k`th entity.
+    """
+    rotation, distance = table_pose
+    directions = np.stack([x_rays.ravel(), y_rays.ravel(), np.ones(x_rays.size)], axis=1)
+    depth_map = np.empty(x_rays.size)
+    label_map = np.zeros(x_rays.size, dtype=np.int32)
+    for start in range(0, x_rays.size, RAY_CHUNK_SIZE):
+        # The rays are cast from the camera in the table coordinate system, where
+        # the table is `z = 0`.
+        table_directions = rotation.inv().apply(directions[start:start + RAY_CHUNK_SIZE])
+        table_origin = rotation.inv().apply([0.0, 0.0, -distance])
+        hits = -table_origin[2] / table_directions[:, 2]
+        labels = np.zeros(len(hits), dtype=np.int32)
+        for label, entity in enumerate(entities, start=1):
+            yaw = Rotation.from_euler('z', entity['yaw'])
+            entity_hits = _intersect_entity(
+                yaw.inv().apply(table_origin - np.array([*entity['center'], 0.0]))[np.newaxis],
+                yaw.inv().apply(table_directions),
+                entity
+            )
+            closer_mask = entity_hits < hits
+            hits[closer_mask] = entity_hits[closer_mask]
+            labels[closer_mask] = label
+        # The ray directions are `(x, y, 1)` in the camera coordinate system, so
+        # the ray parameter is the depth.
+        depth_map[start:start + RAY_CHUNK_SIZE] = hits
+        label_map[start:start + RAY_CHUNK_SIZE] = labels
+    return depth_map.reshape(x_rays.shape), label_map.reshape(x_rays.shape)
+
+
+def _make_entity(rng, shape, center, size_range, height_range):
+    """ Make an entity with random sizes, and its ground truth top surface area
+        and volume.
+    """
+    entity = {'shape': shape, 'center': [float(value) for value in center], 'yaw': float(rng.uniform(0.0, np.pi))}
+    if shape == 'box':
+        entity['length'], entity['width'] = (float(value) for value in rng.uniform(*size_range, size=2))
+        entity['height'] = float(rng.uniform(*height_range))
+        entity['area'] = entity['length'] * entity['width']
+        entity['volume'] = entity['area'] * entity['height']
+        entity['footprint_radius'] = np.hypot(entity['length'], entity['width']) / 2.0
+    elif shape == 'hemisphere':
+        entity['radius'] = float(min(rng.uniform(*size_range) / 2.0, height_range[1]))
+        entity['height'] = entity['radius']
+        entity['area'] = np.pi * entity['radius'] ** 2
+        entity['volume'] = 2.0 / 3.0 * np.pi * entity['radius'] ** 3
+        entity['footprint_radius'] = entity['radius']
+    else:
+        entity['radius'] = float(rng.uniform(*size_range) / 2.0)
+        entity['height'] = float(rng.uniform(*height_range))
+        entity['area'] = np.pi * entity['radius'] ** 2
+        entity['volume'] = entity['area'] * entity['height']
+        entity['footprint_radius'] = entity['radius']
+    return entity
+
+
+def make_scene(
+    seed=None,
+    depth_size=(640, 480),
+    image_size=(640, 480),
+    regulated_size=None,
+    entity_count=3,
+    shapes=SHAPES,
+    size_range=(0.04, 0.1),
+    height_range=(0.01, 0.04),
+    distance=0.4,
+    max_tilt=15.0,
+    noise_std=5e-4,
+    dropout=0.0,
+    distortion=0.02
+):
+    """ Make a synthetic session of a tilted table with food entities of known
+        areas and volumes on it.
+
+    The depth map and the color image are rendered through the lens distortion
+        of the calibration, so that they are rectified by
+        `fvolume.utils.regulate_image`. The label mask is rendered with the rays
+        of the regulated depth map, so it matches the regulated images.
+
+    Args:
+        seed: The seed of the random generator, or `None`.
+        depth_size: The depth map size `(width, height)`, with the same aspect
+            ratio as `REFERENCE_DIMENSIONS`.
+        image_size: The color image size `(width, height)`, with the same
+            aspect ratio as `REFERENCE_DIMENSIONS`.
+        regulated_size: The label mask size `(width, height)`, defaults to
+            `fvolume.config.UNIFIED_IMAGE_SIZE`.
+        entity_count: The number of entities.
+        shapes: The shapes to choose the entities from, in `SHAPES`.
+        size_range: The range of the footprint lengths of the entities, the
+            diameters of the round ones, in meters.
+        height_range: The range of the heights of the entities, in meters. The
+            radius of a hemisphere is at most the maximum height.
+        distance: The depth of the table at the optical axis, in meters.
+        max_tilt: The maximum angle between the table normal and the optical
+            axis, in degrees.
+        noise_std: The standard deviation of the gaussian depth noise, in meters.
+        dropout: The fraction of the depth pixels without a valid depth, which
+            are `0`.
+        distortion: The magnification of the lens distortion at the farthest
+            corner from the distortion center.
+
+    Returns:
+        A dictionary with the `image` of shape `(height, width, 3)` in `uint8`,
+            the `peripheral` json object with the `calibration_data` and the
+            `depth_data` of shape `(height, width)` in `float32`, the
+            `label_mask` of shape `regulated_size`, and the `entities`. Each
+            entity has its `shape`, sizes and pose on the table, as well as its
+            ground truth top surface `area` and `volume`, in square meters and
+            cube meters. The `k`th entity is labeled `k` in `label_mask`.
+
+    Raises:
+        ValueError: If the sizes don't have the aspect ratio of
+            `REFERENCE_DIMENSIONS`, or the entities don't fit in the view.
+    """
+    for size in (depth_size, image_size):
+        if size[0] * REFERENCE_DIMENSIONS[1] != size[1] * REFERENCE_DIMENSIONS[0]:
+            raise ValueError('The size {} does not have the aspect ratio of {}.'.format(size, REFERENCE_DIMENSIONS))
+    regulated_size = tuple(fvolume.config.UNIFIED_IMAGE_SIZE if regulated_size is None else regulated_size)
+    rng = np.random.default_rng(seed)
+    calibration = make_calibration(rng, distortion)
+    # The table is tilted around a random axis in the image plane. The table is
+    # facing the camera, whose z-axis is the optical axis.
+    tilt_axis = rng.uniform(0.0, 2.0 * np.pi)
+    table_rotation = Rotation.from_rotvec(
+        np.radians(rng.uniform(0.0, max_tilt)) * np.array([np.cos(tilt_axis), np.sin(tilt_axis), 0.0])
+    ) * Rotation.from_euler('x', np.pi)
+    # The entities are placed inside the center square of the view, which is
+    # kept by the regulation, without overlapping footprints.
+    placement_range = 0.8 * distance * min(REFERENCE_DIMENSIONS) / 2.0 / FOCAL_LENGTH
+    entities = []
+    for _ in range(entity_count):
+        shape = shapes[rng.integers(len(shapes))]
+        for _ in range(100):
+            entity = _make_entity(
+                rng,
+                shape,
+                rng.uniform(-placement_range, placement_range, size=2),
+                size_range,
+                height_range
+            )
+            if np.all(np.abs(entity['center']) + entity['footprint_radius'] <= placement_range) and all(
+                np.hypot(*np.subtract(entity['center'], other['center']))
+                > entity['footprint_radius'] + other['footprint_radius'] + 0.005
+                for other in entities
+            ):
+                break
+        else:
+            raise ValueError('The entities do not fit in the view, try a smaller entity count or size.')
+        entities.append(entity)
+    table_pose = (table_rotation, distance)
+
+    depth_map, _ = cast_rays(*get_pixel_rays(depth_size, calibration), table_pose, entities)
+    depth_map += rng.normal(0.0, noise_std, size=depth_map.shape)
+    depth_map[rng.random(depth_map.shape) < dropout] = 0.0
+    _, image_labels = cast_rays(*get_pixel_rays(image_size, calibration), table_pose, entities)
+    palette = np.array([TABLE_COLOR] + [ENTITY_COLORS[index % len(ENTITY_COLORS)] for index in range(len(entities))])
+    image = palette[image_labels] + rng.normal(0.0, 8.0, size=(*image_size, 3))
+    _, label_mask = cast_rays(*get_regulated_rays(regulated_size, calibration), table_pose, entities)
+    for entity in entities:
+        del entity['footprint_radius']
+    return {
+        'image': np.ascontiguousarray(np.swapaxes(np.clip(image, 0, 255).astype(np.uint8), 0, 1)),
+        'peripheral': {
+            'calibration_data': calibration,
+            'depth_data': np.ascontiguousarray(depth_map.T.astype(np.float32))
+        },
+        'label_mask': label_mask,
+        'entities': entities
+    }
+
+
+def write_session(session_dir, scene, binary=False):
+    """ Write a synthetic scene as a stored session, which is loaded by
+        `data_manager.load_session_dir`. The ground truth entities and the
+        label mask are written beside it.
+
+    Args:
+        session_dir: The directory of the session, which is created.
+        scene: The scene made by `make_scene`.
+        binary: Whether to write the peripheral in the binary format, or in the
+            JSON format of the iOS client otherwise.
+    """
+    os.makedirs(session_dir, exist_ok=True)
+    Image.fromarray(scene['image']).save(os.path.join(session_dir, 'image.jpg'), quality=95)
+    if binary:
+        with open(os.path.join(session_dir, data_manager.PERIPHERAL_BINARY_FILE_NAME), 'wb') as out_file:
+            out_file.write(peripheral_format.encode_binary_peripheral(scene['peripheral'], dtype='float32'))
+    else:
+        with open(os.path.join(session_dir, data_manager.PERIPHERAL_JSON_FILE_NAME), 'w') as out_file:
+            json.dump({**scene['peripheral'], 'depth_data': scene['peripheral']['depth_data'].tolist()}, out_file)
+    Image.fromarray(scene['label_mask'].astype(np.uint8)).save(os.path.join(session_dir, LABEL_MASK_FILE_NAME))
+    with open(os.path.join(session_dir, TRUTH_FILE_NAME), 'w') as out_file:
+        json.dump({'entities': scene['entities']}, out_file, indent=4)
+
+
+def parse_size(value):
+    """ Parse a `WIDTHxHEIGHT` size argument.
+    """
+    width, _, height = value.partition('x')
+    return int(width), int(height)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Writing synthetic sessions of food entities of known volumes on a '
+            'tilted table, which can be replayed like stored recognition sessions. Run '
+            'from the server directory with `python -m benchmarks.synthetic_scenes`.'
+    )
+    arg_parser.add_argument(
+        'output',
+        help='Directory to write the sessions to.',
+        type=str
+    )
+    arg_parser.add_argument(
+        '-n',
+        help='Number of sessions.',
+        type=int,
+        default=20
+    )
+    arg_parser.add_argument(
+        '--depth-size',
+        help='Depth map size as WIDTHxHEIGHT.',
+        type=parse_size,
+        default=(640, 480)
+    )
+    arg_parser.add_argument(
+        '--image-size',
+        help='Color image size as WIDTHxHEIGHT.',
+        type=parse_size,
+        default=(1280, 960)
+    )
+    arg_parser.add_argument(
+        '--entities',
+        help='Number of food entities of each session.',
+        type=int,
+        default=3
+    )
+    arg_parser.add_argument(
+        '--noise',
+        help='Standard deviation of the depth noise, in meters.',
+        type=float,
+        default=5e-4
+    )
+    arg_parser.add_argument(
+        '--dropout',
+        help='Fraction of the depth pixels without a valid depth.',
+        type=float,
+        default=0.0
+    )
+    arg_parser.add_argument(
+        '--binary',
+        help='Write the peripheral in the binary format.',
+        action='store_true'
+    )
+    arg_parser.add_argument(
+        '--seed',
+        help='Seed of the first session, the following sessions use the following seeds.',
+        type=int,
+        default=0
+    )
+    args = arg_parser.parse_args()
+
+    for index in range(args.n):
+        scene = make_scene(
+            seed=args.seed + index,
+            depth_size=args.depth_size,
+            image_size=args.image_size,
+            entity_count=args.entities,
+            noise_std=args.noise,
+            dropout=args.dropout
+        )
+        write_session(os.path.join(args.output, '{:04d}'.format(index)), scene, args.binary)
+
+
+if __name__ == '__main__':
+    main()
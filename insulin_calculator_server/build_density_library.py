@@ -0,0 +1,318 @@
+import argparse
+import collections
+import concurrent.futures
+import csv
+import json
+import multiprocessing
+import os
+import sqlite3
+import numpy as np
+
+import fvolume
+import fdensitylib
+
+import config
+import data_manager
+
+# The version of the manifest format, manifests of other versions are ignored.
+MANIFEST_VERSION = 1
+
+# The kilograms of a pound, the weight of collection sessions is in pounds.
+POUND_TO_KILOGRAM = 0.45359237
+
+# The columns of the built library, which are `fdensitylib.library.LIBRARY_COLUMNS`
+# followed by the sample statistics.
+OUTPUT_COLUMNS = fdensitylib.library.LIBRARY_COLUMNS + (
+    'sample_count',
+    'area_density_mad',
+    'volume_density_mad'
+)
+
+# The number of processed sessions between manifest saves.
+MANIFEST_SAVE_INTERVAL = 50
+
+
+def get_session_signature(session_dir):
+    """ Returning the signature of a collection session, which changes when its
+        label or input files are changed.
+    """
+    paths = [
+        os.path.join(session_dir, 'collection_label.txt'),
+        os.path.join(session_dir, 'image.jpg'),
+        data_manager.get_peripheral_path(session_dir)
+    ]
+    return [[os.stat(path).st_mtime_ns, os.stat(path).st_size] for path in paths]
+
+
+def load_manifest(path):
+    """ Load the records of the processed sessions from a manifest, which are
+        keyed by the session directories relative to the sessions root. Empty if
+        the manifest doesn't exist or has another version.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf8') as in_file:
+        manifest = json.load(in_file)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['sessions']
+
+
+def save_manifest(path, records):
+    """ Save the records of the processed sessions to a manifest, through a
+        temporary file so that an interrupted run keeps the previous manifest.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf8') as out_file:
+        json.dump({'version': MANIFEST_VERSION, 'sessions': records}, out_file, indent=4, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def process_sessions(sessions_root, records, manifest_path, worker_count, rebuild=False):
+    """ Estimate the area and volume of the collection sessions that are new or
+        changed since they were recorded in `records`.
+
+    The sessions are segmented in this process, and their volumes are estimated
+        in a pool of `worker_count` processes. `records` is updated in place, and
+        saved to `manifest_path` every `MANIFEST_SAVE_INTERVAL` sessions.
+
+    Args:
+        sessions_root: The root directory of the collection sessions.
+        records: The records of the processed sessions, see `load_manifest`.
+        manifest_path: The path to save `records` to.
+        worker_count: The number of estimation processes.
+        rebuild: Whether to process all the sessions regardless of `records`.
+
+    Returns:
+        A dictionary with the counts of `found`, `skipped`, `processed` and
+            `failed` sessions.
+    """
+    stats = collections.Counter(found=0, skipped=0, processed=0, failed=0)
+    session_dirs = data_manager.find_session_dirs(sessions_root, ('image.jpg', 'collection_label.txt'))
+    stats['found'] = len(session_dirs)
+    for session_key in set(records) - {os.path.relpath(session_dir, sessions_root) for session_dir in session_dirs}:
+        del records[session_key]
+
+    def finish(session_key, record):
+        records[session_key] = record
+        stats['processed'] += 1
+        stats['failed'] += record['error'] is not None
+        if stats['processed'] % MANIFEST_SAVE_INTERVAL == 0:
+            save_manifest(manifest_path, records)
+
+    def finish_future(future):
+        session_key, record = futures.pop(future)
+        try:
+            area_volumes = future.result()
+            record['area'] = sum(area for area, _ in area_volumes)
+            record['volume'] = sum(volume for _, volume in area_volumes)
+            if record['volume'] <= 0:
+                record['error'] = 'The estimated volume is not positive.'
+        except Exception as error:
+            record['error'] = repr(error)
+        finish(session_key, record)
+
+    futures = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=worker_count,
+        mp_context=multiprocessing.get_context('forkserver')
+    ) as executor:
+        for session_dir in session_dirs:
+            session_key = os.path.relpath(session_dir, sessions_root)
+            signature = get_session_signature(session_dir)
+            if not rebuild and records.get(session_key, {}).get('signature') == signature:
+                stats['skipped'] += 1
+                continue
+            record = {
+                'signature': signature,
+                'name': None,
+                'weight': None,
+                'area': None,
+                'volume': None,
+                'error': None
+            }
+            try:
+                label = data_manager.load_collection_label(session_dir)
+                record['name'] = label['name'].strip()
+                record['weight'] = float(label['weight']) * POUND_TO_KILOGRAM
+                image, peripheral = data_manager.load_session_dir(session_dir)
+                regulated_image, regulated_depth_map = fvolume.utils.regulate_session_images(
+                    image,
+                    peripheral['depth_data'],
+                    peripheral['calibration_data']
+                )
+                label_mask, _, _ = fvolume.recognition.get_recognition_results(
+                    image,
+                    peripheral['calibration_data'],
+                    regulated_image=regulated_image
+                )
+                if np.max(label_mask) == 0:
+                    raise ValueError('No food is recognized.')
+            except Exception as error:
+                record['error'] = repr(error)
+                finish(session_key, record)
+                continue
+            # Bound the pending sessions, so that the depth maps and label masks
+            # of all the sessions are not held in memory at once.
+            while len(futures) >= 2 * worker_count:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    finish_future(future)
+            futures[executor.submit(
+                fvolume.estimation.get_area_volume,
+                None,
+                peripheral['calibration_data'],
+                peripheral.get('device_attitude'),
+                label_mask,
+                regulated_depth_map
+            )] = (session_key, record)
+        for future in concurrent.futures.as_completed(list(futures)):
+            finish_future(future)
+    save_manifest(manifest_path, records)
+    return dict(stats)
+
+
+def load_groups(groups_path, base_entries):
+    """ Returning a function that maps a food name to its group.
+
+    The group is looked up in the `name,group` CSV file at `groups_path`, then
+        in `base_entries` by the normalized name, and defaults to the name itself.
+    """
+    groups = {}
+    for group, name, _, _ in base_entries:
+        groups.setdefault(fdensitylib.library.normalize_name(name), group)
+    explicit_groups = {}
+    if groups_path is not None:
+        with open(groups_path, newline='', encoding='utf8') as in_file:
+            explicit_groups = {row['name']: row['group'] for row in csv.DictReader(in_file)}
+    return lambda name: explicit_groups.get(name, groups.get(fdensitylib.library.normalize_name(name), name))
+
+
+def aggregate_densities(records, get_group):
+    """ Aggregate the densities of each food over its sessions, the weights
+        of the records are in kilograms.
+
+    The density of a food is the median over its sessions, which is robust to
+        sessions with poor segmentation or estimation. The median absolute
+        deviation and the number of sessions are reported with it.
+
+    Returns:
+        A list of rows of `OUTPUT_COLUMNS`, sorted by group and name.
+    """
+    samples = collections.defaultdict(list)
+    for record in records.values():
+        if record['error'] is None:
+            samples[record['name']].append((record['weight'] / record['area'], record['weight'] / record['volume']))
+    rows = []
+    for name, densities in samples.items():
+        densities = np.array(densities)
+        medians = np.median(densities, axis=0)
+        mads = np.median(np.abs(densities - medians), axis=0)
+        rows.append((
+            get_group(name),
+            name,
+            float(medians[0]),
+            float(medians[1]),
+            len(densities),
+            float(mads[0]),
+            float(mads[1])
+        ))
+    return sorted(rows)
+
+
+def write_library(path, rows):
+    """ Write the rows of `OUTPUT_COLUMNS` as a density library file, a SQLite
+        database if the extension of `path` is `.sqlite3`, or a CSV file
+        otherwise. The file is replaced atomically, so that servers reloading
+        it never read a partial file.
+    """
+    temp_path = path + '.tmp'
+    if os.path.splitext(path)[1] == '.sqlite3':
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        connection = sqlite3.connect(temp_path)
+        with connection:
+            connection.execute('CREATE TABLE density_library ({})'.format(
+                ', '.join('"{}"'.format(column) for column in OUTPUT_COLUMNS)
+            ))
+            connection.executemany(
+                'INSERT INTO density_library VALUES ({})'.format(', '.join('?' * len(OUTPUT_COLUMNS))),
+                rows
+            )
+        connection.close()
+    else:
+        with open(temp_path, 'w', newline='', encoding='utf8') as out_file:
+            writer = csv.writer(out_file)
+            writer.writerow(OUTPUT_COLUMNS)
+            writer.writerows(rows)
+    os.replace(temp_path, path)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Building the food density library from the collection sessions. '
+            'Sessions recorded in the manifest are skipped unless they are changed.'
+    )
+    arg_parser.add_argument(
+        '-o',
+        help='Output path of the density library, in .csv or .sqlite3 format.',
+        type=str,
+        required=True
+    )
+    arg_parser.add_argument(
+        '--sessions',
+        help='Root directory of the collection sessions.',
+        type=str,
+        default=config.COLLECTION_STORAGE_DIR
+    )
+    arg_parser.add_argument(
+        '--manifest',
+        help='Path of the manifest of processed sessions, defaults to the output path '
+            'followed by .manifest.json.',
+        type=str,
+        default=None
+    )
+    arg_parser.add_argument(
+        '--base',
+        help='Path of a density library whose entries are kept unless they are '
+            'collected. Also used to find the groups of collected foods.',
+        type=str,
+        default=None
+    )
+    arg_parser.add_argument(
+        '--groups',
+        help='Path of a CSV file with the columns name and group, which gives the '
+            'groups of collected foods. Foods without a group are their own group.',
+        type=str,
+        default=None
+    )
+    arg_parser.add_argument(
+        '-j',
+        help='Number of estimation processes.',
+        type=int,
+        default=os.cpu_count()
+    )
+    arg_parser.add_argument(
+        '--rebuild',
+        help='Process all the sessions regardless of the manifest.',
+        action='store_true'
+    )
+    args = arg_parser.parse_args()
+
+    manifest_path = args.o + '.manifest.json' if args.manifest is None else args.manifest
+    records = load_manifest(manifest_path)
+    stats = process_sessions(args.sessions, records, manifest_path, args.j, args.rebuild)
+    base_entries = fdensitylib.library.load_entries(args.base) if args.base is not None else []
+    collected_rows = aggregate_densities(records, load_groups(args.groups, base_entries))
+    collected_keys = {(row[0], row[1]) for row in collected_rows}
+    base_rows = [
+        (*entry, None, None, None) for entry in base_entries if (entry[0], entry[1]) not in collected_keys
+    ]
+    write_library(args.o, base_rows + collected_rows)
+    stats['foods'] = len(collected_rows)
+    stats['entries'] = len(base_rows) + len(collected_rows)
+    print(json.dumps(stats, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,35 @@
+import os
+
 RECOGNITION_STORAGE_DIR = '/Users/Frost/Desktop/insulin_calculator_data/recognition_session_data/'
 
 COLLECTION_STORAGE_DIR = '/Users/Frost/Desktop/insulin_calculator_data/collection_session_data/'
+
+# The maximum number of pending file writes of the background archive writer. 
+# Requests block when the queue is full.
+ARCHIVE_QUEUE_SIZE = 64
+
+# The number of estimation jobs of the asynchronous job API that run at the same 
+# time in each worker process.
+JOB_WORKER_COUNT = 2
+
+# The maximum number of queued or running estimation jobs in each worker process, 
+# further submissions are rejected with 429.
+JOB_QUEUE_SIZE = 16
+
+# The time to keep the results of finished jobs for polling, in seconds.
+JOB_RESULT_TTL = 600
+
+# The maximum time a job status request waits for the job to finish, in seconds.
+JOB_MAX_WAIT = 30
+
+# The path of the SQLite database of the job states and results, which is shared 
+# by the worker processes, so that a job can be polled from any of them. It is 
+# kept in the data directory next to `RECOGNITION_STORAGE_DIR`, out of the source tree.
+JOB_STORE_PATH = os.path.join(
+    os.path.dirname(os.path.normpath(RECOGNITION_STORAGE_DIR)), 
+    *['cache', 'jobs.sqlite3']
+)
+
+# The number of processes that run the CPU bound volume estimation stage. The 
+# stage runs in the request thread if it is `0`.
+ESTIMATION_PROCESS_COUNT = 2
@@ -1,40 +1,170 @@
 import os
+import io
 import datetime
-import json
+import time
+import queue
+import threading
+import atexit
+import logging
 import numpy as np
 from PIL import Image
 
 import config
+import peripheral_format
+
+
+# The file names of the stored peripheral data in the legacy JSON format and the 
+# binary format.
+PERIPHERAL_JSON_FILE_NAME = 'peripheral.json'
+PERIPHERAL_BINARY_FILE_NAME = 'peripheral.bin'
+
+
+class ArchiveWriter(object):
+    """ A background writer that persists session files off the request path.
+
+    Write jobs are queued in a bounded queue and written by a single daemon 
+        thread. When the queue is full, `submit` blocks until there is room, 
+        the blocking is recorded in the statistics as back-pressure. The thread 
+        is started lazily, and restarted in forked processes, so that the writer 
+        works with gunicorn workers forked from a preloaded app.
+
+    Attributes:
+        max_queue_size: The maximum number of pending write jobs.
+    """
+    def __init__(self, max_queue_size):
+        self.max_queue_size = max_queue_size
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'written': 0,
+            'failed': 0,
+            'blocked': 0,
+            'blocked_seconds': 0.0,
+            'max_depth': 0
+        }
+    
+    def _ensure_started(self):
+        """ Start the writer thread if it is not running in this process.
+        """
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='archive_writer', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        """ The loop of the writer thread.
+        """
+        while True:
+            path, content = self._queue.get()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb' if isinstance(content, bytes) else 'w') as out_file:
+                    out_file.write(content)
+                with self._lock:
+                    self._stats['written'] += 1
+            except Exception:
+                # Any failure only drops this file, the thread keeps serving the 
+                # queue so that `submit` and `flush` never block forever.
+                logging.exception('Failed to archive %s.', path)
+                with self._lock:
+                    self._stats['failed'] += 1
+            finally:
+                self._queue.task_done()
+    
+    def submit(self, path, content):
+        """ Queue a file to be written. The parent directories are created if 
+            they do not exist.
+
+        Args:
+            path: The path of the file.
+            content: The content of the file, either `bytes` or `str`.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((path, content))
+        except queue.Full:
+            start_time = time.perf_counter()
+            self._queue.put((path, content))
+            with self._lock:
+                self._stats['blocked'] += 1
+                self._stats['blocked_seconds'] += time.perf_counter() - start_time
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+    
+    def flush(self):
+        """ Block until all the queued files of this process are written.
+        """
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+    
+    def get_stats(self):
+        """ Get the statistics of the writer.
+
+        Returns:
+            A dictionary with the counts of `submitted`, `written`, `failed` and 
+                `blocked` jobs, the total `blocked_seconds`, the current `depth` 
+                and `max_depth` of the queue, as well as `max_queue_size`.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['depth'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        stats['max_queue_size'] = self.max_queue_size
+        return stats
+
+
+archive_writer = ArchiveWriter(config.ARCHIVE_QUEUE_SIZE)
+atexit.register(archive_writer.flush)
+
 
 class SessionDataManager(object):
     """ The manager that handles file I/O for a session.
 
+    Uploads are decoded in memory, the files are persisted asynchronously by 
+        `archive_writer`.
+
     Attributes:
         session_id: The id of the session. This value is supposed to be of type 
             `str`.
-        session_dir: The storage directory path of this session.
+        session_dir: The storage directory path of this session. The directory 
+            is reserved when this attribute is first read, which is when the 
+            first file is archived, so that a rejected upload leaves nothing 
+            behind.
         image: The color image input of the corresponding session, represented 
             as a numpy array.
         peripheral: The peripheral data input of the corresponding session, 
-            represented as a json object.
+            represented as a json object. The `depth_data` is a numpy array.
     """
     def __init__(self, session_id, collection_session=False):
         self.session_id = session_id
-        self.session_dir = self._make_session_dir(
-            config.COLLECTION_STORAGE_DIR if collection_session else config.RECOGNITION_STORAGE_DIR
-        )
+        self._root_dir = config.COLLECTION_STORAGE_DIR if collection_session else config.RECOGNITION_STORAGE_DIR
         self.image = None
         self.peripheral = None
+        self._session_dir = None
+    
+    @property
+    def session_dir(self):
+        if self._session_dir is None:
+            self._session_dir = self._make_session_dir(self._root_dir)
+        return self._session_dir
     
     def _make_session_dir(self, root_dir):
         """ Create the session directory of this session. The directory is 
-            `/root_dir/month/time/session_id`.
+            `/root_dir/month/time/session_id`, and a `_1`, `_2`, ... suffix is 
+            appended when it exists, such as for concurrent sessions with the 
+            same id.
         
         Args:
             root_dir: The root directory of the stored data.
         
         Returns:
-            The created session directory path.
+            The session directory path.
         """
         now = datetime.datetime.now()
         session_dir = os.path.join(root_dir, *[
@@ -42,31 +172,47 @@ class SessionDataManager(object):
             str(now.day),
             '{}_{}_{}_{}'.format(*map(str, (now.hour, now.minute, now.second, self.session_id)))
         ])
-        os.makedirs(session_dir)
-        return session_dir
+        suffix = 0
+        while True:
+            suffixed_session_dir = session_dir if suffix == 0 else '{}_{}'.format(session_dir, suffix)
+            try:
+                os.makedirs(suffixed_session_dir, exist_ok=False)
+                return suffixed_session_dir
+            except FileExistsError:
+                suffix += 1
     
     def register_image_file(self, image):
-        """ Save the image to the session directory, then load it to memory as 
-            a numpy array.
+        """ Load the image to memory as a numpy array, and archive it to the 
+            session directory.
         
         Args:
             image: A `werkzeug.datastructures.FileStorage` object.
         """
-        save_path = os.path.join(self.session_dir, 'image.jpg')
-        image.save(save_path)
-        self.image = np.array(Image.open(save_path))
+        content = image.read()
+        self.image = np.array(Image.open(io.BytesIO(content)))
+        archive_writer.submit(os.path.join(self.session_dir, 'image.jpg'), content)
     
     def register_peripheral_file(self, peripheral):
-        """ Save the peripheral json to the session directory, then load it to 
-            memory as a json object.
+        """ Load the peripheral data to memory as a json object, and archive it 
+            to the session directory.
+
+        Both the legacy JSON format and the binary format are accepted, see 
+            `peripheral_format.parse_peripheral`. JSON payloads are saved as 
+            `peripheral.json`, binary payloads as `peripheral.bin`.
         
         Args:
             peripheral: A `werkzeug.datastructures.FileStorage` object.
+        
+        Raises:
+            ValueError: If the peripheral data is malformed.
         """
-        save_path = os.path.join(self.session_dir, 'peripheral.json')
-        peripheral.save(save_path)
-        with open(save_path) as in_file:
-            self.peripheral = json.loads(in_file.read())
+        content = peripheral.read()
+        self.peripheral = peripheral_format.parse_peripheral(content)
+        if peripheral_format.is_binary_peripheral(content):
+            save_path = os.path.join(self.session_dir, PERIPHERAL_BINARY_FILE_NAME)
+        else:
+            save_path = os.path.join(self.session_dir, PERIPHERAL_JSON_FILE_NAME)
+        archive_writer.submit(save_path, content)
     
     def save_recognition_file(self, recognition_json):
         """ Store the recognition result for the session, which is represented 
@@ -76,8 +222,7 @@ class SessionDataManager(object):
             recognition_json: The recognition result to save. A json string.
         """
         save_path = os.path.join(self.session_dir, '{}.{}'.format('recognition', 'json'))
-        with open(save_path, 'w') as out_file:
-            out_file.write(recognition_json)
+        archive_writer.submit(save_path, recognition_json)
     
     def register_collection_additional_image(self, image):
         """ Save the image to the session directory.
@@ -88,7 +233,7 @@ class SessionDataManager(object):
             image: A `werkzeug.datastructures.FileStorage` object.
         """
         save_path = os.path.join(self.session_dir, 'additional.jpg')
-        image.save(save_path)
+        archive_writer.submit(save_path, image.read())
     
     def register_collection_label(self, name, weight):
         """ Save a file to record the collection label, which includes the name 
@@ -101,5 +246,71 @@ class SessionDataManager(object):
             weight: A string stand for the weight of the food, measured in pound.
         """
         save_path = os.path.join(self.session_dir, 'collection_label.txt')
-        with open(save_path, 'w') as in_file:
-            in_file.write('{}: {}\n{}: {}\n'.format('name', name, 'weight', weight))
+        archive_writer.submit(save_path, '{}: {}\n{}: {}\n'.format('name', name, 'weight', weight))
+
+
+def find_session_dirs(root_dir, required_file_names=('image.jpg',)):
+    """ Find the stored session directories under a directory.
+
+    Args:
+        root_dir: The root directory to search, such as `config.RECOGNITION_STORAGE_DIR`, 
+            or any of its subdirectories.
+        required_file_names: The names of the files a session directory should 
+            contain, besides a peripheral file in either format.
+
+    Returns:
+        A sorted list of the session directories.
+    """
+    session_dirs = []
+    for dir_path, _, file_names in os.walk(root_dir):
+        if all(file_name in file_names for file_name in required_file_names) and (
+            PERIPHERAL_JSON_FILE_NAME in file_names or PERIPHERAL_BINARY_FILE_NAME in file_names
+        ):
+            session_dirs.append(dir_path)
+    return sorted(session_dirs)
+
+
+def get_peripheral_path(session_dir):
+    """ Get the path of the stored peripheral file of a session, the binary 
+        format is preferred if both exist.
+
+    Args:
+        session_dir: The directory of the session.
+    """
+    peripheral_path = os.path.join(session_dir, PERIPHERAL_BINARY_FILE_NAME)
+    if not os.path.exists(peripheral_path):
+        peripheral_path = os.path.join(session_dir, PERIPHERAL_JSON_FILE_NAME)
+    return peripheral_path
+
+
+def load_session_dir(session_dir):
+    """ Load the image and the peripheral data of a stored session.
+
+    Args:
+        session_dir: The directory of the session.
+
+    Returns:
+        `(image, peripheral)`, the same as `SessionDataManager.image` and 
+            `SessionDataManager.peripheral`.
+    """
+    image = np.array(Image.open(os.path.join(session_dir, 'image.jpg')))
+    return image, peripheral_format.load_peripheral_file(get_peripheral_path(session_dir))
+
+
+def load_collection_label(session_dir):
+    """ Load the collection label of a stored collection session, see 
+        `SessionDataManager.register_collection_label`.
+
+    Args:
+        session_dir: The directory of the collection session.
+
+    Returns:
+        A dictionary with the `name` and `weight` strings.
+    """
+    label = {}
+    with open(os.path.join(session_dir, 'collection_label.txt'), encoding='utf8') as in_file:
+        for line in in_file:
+            key, separator, value = line.rstrip('\n').partition(': ')
+            if separator:
+                label[key] = value
+    return label
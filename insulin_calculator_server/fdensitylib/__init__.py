@@ -1 +1,3 @@
+from . import config
 from . import density
+from . import library
@@ -0,0 +1,26 @@
+import os
+
+# The root path of this package.
+PACKAGE_ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# The path of the density library file, either a `.csv` file or a `.sqlite3` 
+# SQLite database, see `library.load_entries`.
+DENSITY_LIBRARY_PATH = os.path.join(PACKAGE_ROOT_PATH, 'density_library.csv')
+
+# The minimum interval between checks for changes of the density library file, in 
+# seconds. A changed file is reloaded on the next lookup after the check, without 
+# restarting the server.
+DENSITY_LIBRARY_RELOAD_INTERVAL = 5
+
+# The minimum similarity between a normalized food name and a library name for 
+# them to be taken as a fuzzy match, between 0 and 1.
+FUZZY_MATCH_THRESHOLD = 0.85
+
+# The maximum number of library names compared with a food name in a fuzzy 
+# lookup, picked by the number of shared words. It bounds the time of the lookups 
+# of common words in a large library, `None` to compare all the names sharing a 
+# word.
+FUZZY_MATCH_MAX_CANDIDATES = 256
+
+# The maximum number of cached fuzzy lookups.
+FUZZY_MATCH_CACHE_SIZE = 4096
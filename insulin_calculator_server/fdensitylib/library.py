@@ -1,18 +1,240 @@
-density_library = {
-    'Bagel': {
-        'Plain Bagel': [0.0, 424.4507]
-    },
-    'Burger': {
-        'Beef Burger': [0.0, 391.7372]
-    },
-    'French Fries': {
-        'French Fries': [0.0, 328.3566]
-    },
-    'Fried Chicken': {
-        'Chicken Nugget': [0.0, 538.0302]
-    },
-    'Donut': {
-        'Glazed Donut': [0.0, 328.1879],
-        'Chocolate Donut': [0.0, 308.5272]
-    }
-}
+import collections
+import csv
+import difflib
+import heapq
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from . import config
+
+# The columns of a density library file.
+LIBRARY_COLUMNS = ('group', 'name', 'area_density', 'volume_density')
+
+_library = None
+_library_signature = None
+_library_checked_at = float('-inf')
+_library_reloading = False
+_library_lock = threading.Lock()
+
+
+def normalize_name(name):
+    """ Normalize a food name for fuzzy lookup, so that names differing only in
+        case, punctuation, word order or plural suffixes are the same.
+
+    Args:
+        name: The food name.
+    """
+    tokens = re.sub(r'[^0-9a-z]+', ' ', name.lower()).split()
+    tokens = [
+        token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token
+        for token in tokens
+    ]
+    return ' '.join(sorted(tokens))
+
+
+def load_entries(path):
+    """ Load the entries of a density library file.
+
+    A `.csv` file has a header row with at least the columns in
+        `LIBRARY_COLUMNS`. A SQLite database has a `density_library` table with
+        these columns. Other columns, such as sample counts, are ignored.
+
+    Args:
+        path: The path of the density library file.
+
+    Returns:
+        A list of `(group, name, area_density, volume_density)` in the order of
+            the file.
+    """
+    if os.path.splitext(path)[1] == '.csv':
+        with open(path, newline='', encoding='utf8') as in_file:
+            return [
+                (row['group'], row['name'], float(row['area_density']), float(row['volume_density']))
+                for row in csv.DictReader(in_file)
+            ]
+    connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+    try:
+        return [
+            (group, name, float(area_density), float(volume_density))
+            for group, name, area_density, volume_density in connection.execute(
+                'SELECT "group", name, area_density, volume_density FROM density_library ORDER BY rowid'
+            )
+        ]
+    finally:
+        connection.close()
+
+
+class DensityLibrary(object):
+    """ An indexed food density library.
+
+    Exact lookups and group fallbacks are dictionary lookups. Names without an
+        exact match are looked up by their normalized names, then by fuzzy
+        matching against the normalized names sharing a word with them, first in
+        the same group, then in the whole library. The fuzzy lookups are cached.
+
+    Attributes:
+        size: The number of entries.
+    """
+    def __init__(self, entries):
+        self.size = len(entries)
+        self._exact = {}
+        self._group_fallbacks = {}
+        self._normalized = collections.defaultdict(dict)
+        self._token_index = collections.defaultdict(lambda: collections.defaultdict(set))
+        self._fuzzy_cache = collections.OrderedDict()
+        self._fuzzy_cache_lock = threading.Lock()
+        for group, name, area_density, volume_density in entries:
+            densities = (area_density, volume_density)
+            self._exact.setdefault((group, name), densities)
+            # The first entry of a group is its fallback, the same as the
+            # previous dictionary literal library.
+            self._group_fallbacks.setdefault(group, densities)
+            normalized_name = normalize_name(name)
+            self._normalized[group].setdefault(normalized_name, densities)
+            self._normalized[None].setdefault(normalized_name, densities)
+            for token in normalized_name.split():
+                self._token_index[group][token].add(normalized_name)
+                self._token_index[None][token].add(normalized_name)
+
+    def _get_fuzzy_match(self, group, normalized_name):
+        """ Returning the densities of the most similar normalized name in
+            `group`, `None` for the whole library. `None` if no name is similar
+            enough. Only the `config.FUZZY_MATCH_MAX_CANDIDATES` names sharing
+            the most words with `normalized_name` are compared.
+        """
+        token_index = self._token_index.get(group)
+        if token_index is None:
+            return None
+        postings = [token_index[token] for token in sorted(set(normalized_name.split())) if token in token_index]
+        max_candidates = config.FUZZY_MATCH_MAX_CANDIDATES
+        candidates = set()
+        # Take the names sharing the most words first, as they are the most
+        # likely to be similar enough. The names of the last level taken are
+        # picked by their closeness in length.
+        for shared_count in range(len(postings), 0, -1):
+            level = set().union(*(
+                set.intersection(*combination) for combination in itertools.combinations(postings, shared_count)
+            )) - candidates
+            if max_candidates is not None and len(candidates) + len(level) > max_candidates:
+                candidates.update(heapq.nsmallest(
+                    max_candidates - len(candidates),
+                    level,
+                    key=lambda candidate: (abs(len(candidate) - len(normalized_name)), candidate)
+                ))
+                break
+            candidates.update(level)
+        matches = difflib.get_close_matches(normalized_name, candidates, n=1, cutoff=config.FUZZY_MATCH_THRESHOLD)
+        return self._normalized[group][matches[0]] if matches else None
+
+    def _get_fuzzy_density(self, group, name):
+        """ Returning the densities of a name without an exact match, `None` if
+            there is no match.
+        """
+        key = (group, name)
+        with self._fuzzy_cache_lock:
+            if key in self._fuzzy_cache:
+                self._fuzzy_cache.move_to_end(key)
+                return self._fuzzy_cache[key]
+        normalized_name = normalize_name(name)
+        densities = self._normalized.get(group, {}).get(normalized_name)
+        if densities is None:
+            densities = self._get_fuzzy_match(group, normalized_name)
+        if densities is None:
+            densities = self._normalized[None].get(normalized_name)
+        if densities is None:
+            densities = self._get_fuzzy_match(None, normalized_name)
+        with self._fuzzy_cache_lock:
+            self._fuzzy_cache[key] = densities
+            if len(self._fuzzy_cache) > config.FUZZY_MATCH_CACHE_SIZE:
+                self._fuzzy_cache.popitem(last=False)
+        return densities
+
+    def get_density(self, group, name):
+        """ Get the area and volume density of a food.
+
+        Args:
+            group: The food group given by the classifier.
+            name: The food name given by the classifier.
+
+        Returns:
+            `(area_density, volume_density)`. The exact match if there is one,
+                otherwise the normalized or fuzzy match, otherwise the fallback
+                of the group. `(0.0, 0.0)` if none of them is found.
+        """
+        densities = self._exact.get((group, name))
+        if densities is None:
+            densities = self._get_fuzzy_density(group, name)
+        if densities is None:
+            densities = self._group_fallbacks.get(group, (0.0, 0.0))
+        return densities
+
+
+def _get_file_signature(path):
+    """ Returning the modification time and size of a file, which changes when
+        the file is replaced or modified.
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _reload_library(path, signature):
+    """ Load the library from `path` and swap it in, which runs in a background
+        thread. The loaded library is kept if the loading fails.
+    """
+    global _library, _library_signature, _library_reloading
+    try:
+        library = DensityLibrary(load_entries(path))
+        with _library_lock:
+            _library, _library_signature = library, signature
+    except (OSError, ValueError, KeyError, sqlite3.Error):
+        logging.exception('Failed to reload the density library %s.', path)
+        # Not retried until the file is changed again.
+        with _library_lock:
+            _library_signature = signature
+    finally:
+        with _library_lock:
+            _library_reloading = False
+
+
+def get_library():
+    """ Get the density library loaded from `config.DENSITY_LIBRARY_PATH`.
+
+    The library is loaded on the first call. Afterwards, the file is checked for
+        changes at most every `config.DENSITY_LIBRARY_RELOAD_INTERVAL` seconds.
+        A changed file is loaded in a background thread, the loaded library is
+        returned until the new one is ready, and kept if the new one fails to
+        load, until the file is changed again. Replace the file by renaming a complete file over it to avoid
+        partial reads.
+    """
+    global _library, _library_signature, _library_checked_at, _library_reloading
+    now = time.monotonic()
+    if now - _library_checked_at < config.DENSITY_LIBRARY_RELOAD_INTERVAL:
+        return _library
+    with _library_lock:
+        if now - _library_checked_at < config.DENSITY_LIBRARY_RELOAD_INTERVAL:
+            return _library
+        path = config.DENSITY_LIBRARY_PATH
+        if _library is None:
+            signature = _get_file_signature(path)
+            _library, _library_signature = DensityLibrary(load_entries(path)), signature
+        elif not _library_reloading:
+            try:
+                signature = _get_file_signature(path)
+            except OSError:
+                logging.exception('Failed to check the density library %s.', path)
+                signature = _library_signature
+            if signature != _library_signature:
+                _library_reloading = True
+                threading.Thread(
+                    target=_reload_library,
+                    args=(path, signature),
+                    name='density_library_reload',
+                    daemon=True
+                ).start()
+        _library_checked_at = now
+        return _library
@@ -1,4 +1,8 @@
+from . import batching
 from . import classification
+from . import classification_cache
 from . import estimation
+from . import model_registry
 from . import recognition
+from . import segmentation_backend
 from . import utils
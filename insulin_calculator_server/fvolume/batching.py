@@ -0,0 +1,157 @@
+import collections
+import concurrent.futures
+import contextlib
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+
+class BatchScheduler(object):
+    """ A scheduler that gathers concurrent single item predictions into dynamic
+        batches.
+
+    Submitted items are queued, a worker thread takes them out and runs
+        `predict` on a batch once `max_batch_size` items are gathered, or
+        `max_wait_ms` milliseconds have passed since the first item of the batch
+        is taken. The worker only waits for more items while they are queued or
+        expected, that is while other callers are inside `expecting` and have
+        not submitted yet, so that a lone request does not wait for a batch.
+        Each caller gets its own result through a future. The worker thread is
+        started lazily, and restarted in forked processes.
+
+    Attributes:
+        predict: The batch prediction function. It takes a numpy array of stacked
+            items and returns a sequence of results with the same length.
+        max_batch_size: The maximum number of items in a batch.
+        max_wait_ms: The maximum time to wait for a batch to be filled, in
+            milliseconds.
+    """
+    def __init__(self, predict, max_batch_size, max_wait_ms, stats_window=1024):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._expected_count = 0
+        self._local = threading.local()
+        self._batch_sizes = collections.deque(maxlen=stats_window)
+        self._queue_latencies = collections.deque(maxlen=stats_window)
+        self._stats = {'items': 0, 'batches': 0, 'failed_batches': 0}
+
+    def _ensure_started(self):
+        """ Start the worker thread if it is not running in this process.
+        """
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._expected_count = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='batch_scheduler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """ The loop of the worker thread.
+        """
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+            # Only wait for a batch to be filled when other items are queued or
+            # expected.
+            while len(batch) < self.max_batch_size and (not self._queue.empty() or self._expected_count > 0):
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            start_time = time.perf_counter()
+            futures = [future for _, future, _ in batch]
+            try:
+                results = self.predict(np.stack([item for item, _, _ in batch]))
+                if len(results) != len(futures):
+                    raise ValueError('Got {} results for a batch of {} items.'.format(len(results), len(futures)))
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as error:
+                for future in futures:
+                    future.set_exception(error)
+                with self._lock:
+                    self._stats['failed_batches'] += 1
+            with self._lock:
+                self._stats['items'] += len(batch)
+                self._stats['batches'] += 1
+                self._batch_sizes.append(len(batch))
+                self._queue_latencies.extend(start_time - submit_time for _, _, submit_time in batch)
+
+    @contextlib.contextmanager
+    def expecting(self):
+        """ A context in which the calling thread is going to submit an item,
+            such as a request before its image is preprocessed. The worker
+            waits up to `max_wait_ms` for the expected items to fill a batch.
+        """
+        self._ensure_started()
+        with self._lock:
+            self._expected_count += 1
+        self._local.expecting = True
+        try:
+            yield
+        finally:
+            self._unexpect()
+
+    def _unexpect(self):
+        """ Stop expecting an item from the calling thread.
+        """
+        if getattr(self._local, 'expecting', False):
+            self._local.expecting = False
+            with self._lock:
+                if self._pid == os.getpid():
+                    self._expected_count -= 1
+
+    def submit(self, item):
+        """ Queue an item for prediction.
+
+        Args:
+            item: The input of a single prediction, a numpy array. All items
+                should have the same shape.
+
+        Returns:
+            A `concurrent.futures.Future` of the prediction result.
+        """
+        self._ensure_started()
+        future = concurrent.futures.Future()
+        self._queue.put((item, future, time.perf_counter()))
+        self._unexpect()
+        return future
+
+    def get_stats(self):
+        """ Get the statistics of the scheduler.
+
+        The batch size and queue latency statistics are computed over the most
+            recent batches and items. The queue latency is the time from an item
+            being submitted to its batch being run, in milliseconds.
+
+        Returns:
+            A dictionary with the counts of `items`, `batches` and
+                `failed_batches`, `mean_batch_size`, a `batch_size_histogram`,
+                the `queue_latency_ms` percentiles and the current queue `depth`.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            batch_sizes = np.array(self._batch_sizes)
+            queue_latencies = np.array(self._queue_latencies) * 1000.0
+        stats['mean_batch_size'] = float(np.mean(batch_sizes)) if len(batch_sizes) > 0 else 0.0
+        stats['batch_size_histogram'] = {
+            int(size): int(count) for size, count in zip(*np.unique(batch_sizes, return_counts=True))
+        }
+        stats['queue_latency_ms'] = {
+            name: float(np.percentile(queue_latencies, percentile)) if len(queue_latencies) > 0 else 0.0
+            for name, percentile in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+        }
+        stats['depth'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        return stats
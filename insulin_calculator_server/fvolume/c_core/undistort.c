@@ -2,26 +2,31 @@
 #include <stdlib.h>
 #include <math.h>
 #include <string.h>
+#include <pthread.h>
 
-double* get_lens_distortion_point(
-    int* point, 
-    double* lookup_table, 
-    int lookup_table_len, 
-    double* distortion_center, 
-    int* image_size
-) {
+static double get_radius_max(const double* distortion_center, int width, int height) {
     double radius_max_x = distortion_center[0];
     double radius_max_y = distortion_center[1];
-    if (image_size[0] - radius_max_x > radius_max_x) {
-        radius_max_x = image_size[0] - radius_max_x;
+    if (width - radius_max_x > radius_max_x) {
+        radius_max_x = width - radius_max_x;
     }
-    if (image_size[1] - radius_max_y > radius_max_y) {
-        radius_max_y = image_size[1] - radius_max_y;
+    if (height - radius_max_y > radius_max_y) {
+        radius_max_y = height - radius_max_y;
     }
-    double radius_max = sqrt(pow(radius_max_x, 2) + pow(radius_max_y, 2));
+    return sqrt(pow(radius_max_x, 2) + pow(radius_max_y, 2));
+}
 
-    double radius_point_x = point[0] - distortion_center[0];
-    double radius_point_y = point[1] - distortion_center[1];
+static void map_lens_distortion_point(
+    int x,
+    int y,
+    const double* lookup_table,
+    int lookup_table_len,
+    const double* distortion_center,
+    double radius_max,
+    double* mapped_point
+) {
+    double radius_point_x = x - distortion_center[0];
+    double radius_point_y = y - distortion_center[1];
     double radius_point = sqrt(pow(radius_point_x, 2) + pow(radius_point_y, 2));
 
     double magnification = lookup_table[lookup_table_len - 1];
@@ -32,45 +37,159 @@ double* get_lens_distortion_point(
         double upper_lookup = lookup_table[(int)ceil(relative_position)];
         magnification = lower_lookup * (1.0 - frac) + upper_lookup * frac;
     }
-    double* mapped_point = (double*)malloc(sizeof(double) * 2);
     mapped_point[0] = distortion_center[0] + radius_point_x * (1.0 + magnification);
     mapped_point[1] = distortion_center[1] + radius_point_y * (1.0 + magnification);
-    return mapped_point;
 }
 
-double* rectify_image(
-    double* image, 
-    int width, 
-    int height, 
-    int channel, 
-    double* lookup_table, 
-    int lookup_table_len, 
-    double* distortion_center
+double* get_lens_distortion_point(
+    int* point,
+    double* lookup_table,
+    int lookup_table_len,
+    double* distortion_center,
+    int* image_size
 ) {
-    int image_size[2] = {width, height};
-    double* rectified_image = (double*)malloc(sizeof(double) * width * height * channel);
-    for (int i = 0; i < width; i ++) {
-        for (int j = 0; j < height; j ++) {
-            int rectified_index[2] = {i, j};
-            double* original_index = get_lens_distortion_point(
-                rectified_index,
-                lookup_table,
-                lookup_table_len,
-                distortion_center,
-                image_size
+    double* mapped_point = (double*)malloc(sizeof(double) * 2);
+    map_lens_distortion_point(
+        point[0],
+        point[1],
+        lookup_table,
+        lookup_table_len,
+        distortion_center,
+        get_radius_max(distortion_center, image_size[0], image_size[1]),
+        mapped_point
+    );
+    return mapped_point;
+}
+
+typedef struct {
+    const unsigned char* image;
+    unsigned char* output;
+    int width;
+    int height;
+    size_t pixel_size;
+    const double* lookup_table;
+    int lookup_table_len;
+    const double* distortion_center;
+    double radius_max;
+    int row_begin;
+    int row_end;
+} rectify_task;
+
+static void* rectify_rows(void* arg) {
+    const rectify_task* task = (const rectify_task*)arg;
+    double original_index[2];
+    for (int i = task->row_begin; i < task->row_end; i ++) {
+        for (int j = 0; j < task->height; j ++) {
+            unsigned char* target = task->output + ((size_t)i * task->height + j) * task->pixel_size;
+            map_lens_distortion_point(
+                i,
+                j,
+                task->lookup_table,
+                task->lookup_table_len,
+                task->distortion_center,
+                task->radius_max,
+                original_index
             );
-            if ((int)original_index[0] < 0 || (int)original_index[0] >= width ||
-                (int)original_index[1] < 0 || (int)original_index[1] >= height) {
+            int original_i = (int)original_index[0];
+            int original_j = (int)original_index[1];
+            if (original_i < 0 || original_i >= task->width ||
+                original_j < 0 || original_j >= task->height) {
+                memset(target, 0, task->pixel_size);
                 continue;
             }
             memcpy(
-                rectified_image + (i * height + j) * channel, 
-                image + ((int)original_index[0] * height + (int)original_index[1]) * channel,
-                channel * sizeof(double)
+                target,
+                task->image + ((size_t)original_i * task->height + original_j) * task->pixel_size,
+                task->pixel_size
             );
-            free(original_index);
         }
     }
+    return NULL;
+}
+
+int rectify_image_into(
+    const unsigned char* image,
+    unsigned char* output,
+    int width,
+    int height,
+    int channel,
+    int element_size,
+    const double* lookup_table,
+    int lookup_table_len,
+    const double* distortion_center,
+    int thread_count
+) {
+    if (thread_count < 1) {
+        thread_count = 1;
+    }
+    if (thread_count > width) {
+        thread_count = width > 0 ? width : 1;
+    }
+    rectify_task* tasks = (rectify_task*)malloc(sizeof(rectify_task) * thread_count);
+    pthread_t* threads = (pthread_t*)malloc(sizeof(pthread_t) * thread_count);
+    int* started = (int*)calloc(thread_count, sizeof(int));
+    if (tasks == NULL || threads == NULL || started == NULL) {
+        free(tasks);
+        free(threads);
+        free(started);
+        return -1;
+    }
+    double radius_max = get_radius_max(distortion_center, width, height);
+    int rows_per_thread = (width + thread_count - 1) / thread_count;
+    for (int t = 0; t < thread_count; t ++) {
+        tasks[t].image = image;
+        tasks[t].output = output;
+        tasks[t].width = width;
+        tasks[t].height = height;
+        tasks[t].pixel_size = (size_t)channel * element_size;
+        tasks[t].lookup_table = lookup_table;
+        tasks[t].lookup_table_len = lookup_table_len;
+        tasks[t].distortion_center = distortion_center;
+        tasks[t].radius_max = radius_max;
+        tasks[t].row_begin = t * rows_per_thread < width ? t * rows_per_thread : width;
+        tasks[t].row_end = (t + 1) * rows_per_thread < width ? (t + 1) * rows_per_thread : width;
+    }
+    // The first slice runs on the calling thread, slices whose thread fails to
+    // start fall back to the calling thread as well.
+    for (int t = 1; t < thread_count; t ++) {
+        started[t] = pthread_create(&threads[t], NULL, rectify_rows, &tasks[t]) == 0;
+    }
+    rectify_rows(&tasks[0]);
+    for (int t = 1; t < thread_count; t ++) {
+        if (started[t]) {
+            pthread_join(threads[t], NULL);
+        } else {
+            rectify_rows(&tasks[t]);
+        }
+    }
+    free(tasks);
+    free(threads);
+    free(started);
+    return 0;
+}
+
+double* rectify_image(
+    double* image,
+    int width,
+    int height,
+    int channel,
+    double* lookup_table,
+    int lookup_table_len,
+    double* distortion_center
+) {
+    double* rectified_image = (double*)malloc(sizeof(double) * width * height * channel);
+    rectify_image_into(
+        (const unsigned char*)image,
+        (unsigned char*)rectified_image,
+        width,
+        height,
+        channel,
+        sizeof(double),
+        lookup_table,
+        lookup_table_len,
+        distortion_center,
+        1
+    );
     return rectified_image;
 }
 
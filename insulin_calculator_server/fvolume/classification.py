@@ -1,44 +1,159 @@
 import requests
+import requests.adapters
+import urllib3.util.retry
+import concurrent.futures
+import threading
+import os
 import io
 import json
 
 from . import config
 from . import config_secure
+from . import classification_cache
 
-def _get_raw_classification_result(buffers):
+_classifier_session = None
+_classifier_executor = None
+_classifier_pid = None
+_classifier_lock = threading.Lock()
+_classification_cache = None
+
+
+def get_classification_cache():
+    """ Returning the classification result cache specified by 
+        `config.CLASSIFICATION_CACHE_BACKEND`, or `None` if caching is disabled.
+    """
+    global _classification_cache
+    with _classifier_lock:
+        if _classification_cache is None:
+            if config.CLASSIFICATION_CACHE_BACKEND == 'memory':
+                _classification_cache = classification_cache.MemoryCache(
+                    config.CLASSIFICATION_CACHE_SIZE, 
+                    config.CLASSIFICATION_CACHE_TTL
+                )
+            elif config.CLASSIFICATION_CACHE_BACKEND == 'sqlite':
+                _classification_cache = classification_cache.SqliteCache(
+                    config.CLASSIFICATION_CACHE_PATH, 
+                    config.CLASSIFICATION_CACHE_SIZE, 
+                    config.CLASSIFICATION_CACHE_TTL
+                )
+        return _classification_cache
+
+
+def _get_cache_key(buffer):
+    """ Returning the classification cache key of an image buffer, specified by 
+        `config.CLASSIFICATION_CACHE_KEY`.
+
+    Args:
+        buffer: The image buffer to be classified.
+    """
+    if config.CLASSIFICATION_CACHE_KEY == 'perceptual':
+        return classification_cache.get_perceptual_key(buffer)
+    return classification_cache.get_content_key(buffer)
+
+
+def _get_classifier_client():
+    """ Returning the pooled keep-alive session and the thread pool for calling 
+        the classifier. They are created lazily, and recreated in forked processes.
+    """
+    global _classifier_session, _classifier_executor, _classifier_pid
+    with _classifier_lock:
+        if _classifier_pid != os.getpid():
+            retry = urllib3.util.retry.Retry(
+                total=config.CLASSIFIER_MAX_RETRIES,
+                backoff_factor=0.1,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['POST']),
+                raise_on_status=False
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=config.MAX_ENTITIES_THRESHOLD,
+                max_retries=retry
+            )
+            _classifier_session = requests.Session()
+            _classifier_session.mount('http://', adapter)
+            _classifier_session.mount('https://', adapter)
+            _classifier_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.MAX_ENTITIES_THRESHOLD
+            )
+            _classifier_pid = os.getpid()
+        return _classifier_session, _classifier_executor
+
+
+def _post_classification_request(session, url, buffer, cache=None, cache_key=None):
+    """ Sending one image buffer to the classifier.
+
+    Args:
+        session: The `requests.Session` to send the request with.
+        url: The URL of the classifier.
+        buffer: The image buffer to be classified.
+        cache: The cache to store a successful response in, or `None`.
+        cache_key: The key of `buffer` in `cache`.
+    
+    Returns:
+        The raw content of the response.
+    """
+    response = session.post(
+        url=url,
+        headers={'Content-type': 'image/jpeg'},
+        data=buffer.getvalue(),
+        timeout=config.CLASSIFIER_TIMEOUT
+    )
+    if cache is not None and response.status_code == 200:
+        cache.put(cache_key, response.content)
+    return response.content
+
+
+def _get_raw_classification_result(buffers, url=None):
     """ Fetching the response of the image classification from the classifier.
 
+    The buffers are sent concurrently over a pooled keep-alive session, so the 
+        latency is about one round-trip instead of one per buffer. Buffers found 
+        in the classification cache are not sent.
+
     Args:
         buffers: The image buffers to be classified.
+        url: The URL of the classifier, defaults to `config_secure.CLASSIFIER_URL`.
     
     Returns:
-        The list of responses from the classifier of the `buffer`.
+        The list of raw response contents from the classifier of the `buffer`.
     """
-    responses = [requests.post(
-        url=config_secure.CLASSIFIER_URL,
-        headers={'Content-type': 'image/jpeg'},
-        data=buffer.getvalue()
-    ) for buffer in buffers[:config.MAX_ENTITIES_THRESHOLD]]
+    url = config_secure.CLASSIFIER_URL if url is None else url
+    session, executor = _get_classifier_client()
+    cache = get_classification_cache()
+    futures = []
+    for buffer in buffers[:config.MAX_ENTITIES_THRESHOLD]:
+        cache_key = _get_cache_key(buffer) if cache is not None else None
+        cached_response = cache.get(cache_key) if cache is not None else None
+        if cached_response is not None:
+            futures.append(concurrent.futures.Future())
+            futures[-1].set_result(cached_response)
+        else:
+            futures.append(executor.submit(
+                _post_classification_request, session, url, buffer, cache, cache_key
+            ))
+    responses = [future.result() for future in futures]
     if len(buffers) > config.MAX_ENTITIES_THRESHOLD:
-        placeholders = ['{"is_food": false}' for _ in range(len(buffers) - config.MAX_ENTITIES_THRESHOLD)]
+        placeholders = [b'{"is_food": false}' for _ in range(len(buffers) - config.MAX_ENTITIES_THRESHOLD)]
         return responses + placeholders
     else:
         return responses
 
 
-def get_classification_result(buffers):
+def get_classification_result(buffers, url=None):
     """ Get the food classification results for a list of image buffers.
 
     Args:
         buffers: The image buffers to be classified.
+        url: The URL of the classifier, defaults to `config_secure.CLASSIFIER_URL`.
     
     Returns:
         The list of classification results. Each classification result is a list 
         of candidates (represented as json format) if the object is food in the 
         corresponding image, or `None` if not.
     """
-    responses = _get_raw_classification_result(buffers)
-    json_contents = [json.loads(response.content.decode('utf8')) for response in responses]
+    responses = _get_raw_classification_result(buffers, url)
+    json_contents = [json.loads(response.decode('utf8')) for response in responses]
     food_items = [
         [item for result in content['results'] for item in sorted(
             result['items'], 
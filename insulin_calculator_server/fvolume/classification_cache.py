@@ -0,0 +1,199 @@
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import cv2
+
+
+def get_content_key(buffer):
+    """ Returning the content key of an image buffer, which is the SHA-256
+        digest of the encoded bytes.
+
+    Args:
+        buffer: The image buffer, a `io.BytesIO` object.
+    """
+    return 'sha256:' + hashlib.sha256(buffer.getvalue()).hexdigest()
+
+
+def get_perceptual_key(buffer):
+    """ Returning the perceptual key of an image buffer, so that crops which
+        look nearly identical share the same key.
+
+    The key is a 64 bit difference hash, computed on the grayscale image resized
+        to 9x8, where each bit stands for whether a pixel is brighter than its
+        right neighbor. Buffers that can't be decoded fall back to the content key.
+
+    Args:
+        buffer: The image buffer, a `io.BytesIO` object.
+    """
+    image = cv2.imdecode(np.frombuffer(buffer.getvalue(), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return get_content_key(buffer)
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return 'dhash:{:016x}'.format(int(np.packbits(bits).view('>u8')[0]))
+
+
+class MemoryCache(object):
+    """ A thread safe LRU cache with TTL, living in the memory of the process.
+
+    Attributes:
+        max_size: The maximum number of entries.
+        ttl: The time to live of the entries in seconds, `None` for no expiration.
+    """
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key):
+        """ Get the value of `key`, or `None` if it is missing or expired.
+
+        Args:
+            key: The key of the entry, a string.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """ Set the value of `key`, the least recently used entries are evicted
+            if the cache is full.
+
+        Args:
+            key: The key of the entry, a string.
+            value: The value of the entry, `bytes`.
+        """
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_stats(self):
+        """ Get the statistics of the cache.
+
+        Returns:
+            A dictionary with the counts of `hits`, `misses`, `evictions` and
+                `expirations`, as well as `hit_rate`, `size` and `max_size`.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+        stats['max_size'] = self.max_size
+        return stats
+
+
+class SqliteCache(object):
+    """ A LRU cache with TTL, persisted in a SQLite database. The database can be
+        shared by multiple processes and survives restarts.
+
+    The hit and miss statistics are counted per process.
+
+    Attributes:
+        path: The path of the database file.
+        max_size: The maximum number of entries.
+        ttl: The time to live of the entries in seconds, `None` for no expiration.
+    """
+    def __init__(self, path, max_size, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._get_connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    def _get_connection(self):
+        """ Returning the database connection of the current thread and process.
+        """
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=5.0)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _count(self, name, value=1):
+        """ Increase the statistics counter `name` by `value`.
+        """
+        with self._lock:
+            self._stats[name] += value
+
+    def get(self, key):
+        """ Get the value of `key`, or `None` if it is missing or expired.
+
+        Args:
+            key: The key of the entry, a string.
+        """
+        now = time.time()
+        with self._get_connection() as connection:
+            row = connection.execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self._count('expirations')
+                row = None
+            if row is None:
+                self._count('misses')
+                return None
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        return bytes(row[0])
+
+    def put(self, key, value):
+        """ Set the value of `key`, the least recently used entries are evicted
+            if the cache is full.
+
+        Args:
+            key: The key of the entry, a string.
+            value: The value of the entry, `bytes`.
+        """
+        now = time.time()
+        with self._get_connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, sqlite3.Binary(value), now, now)
+            )
+            evicted = connection.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_size,)
+            ).rowcount
+        if evicted > 0:
+            self._count('evictions', evicted)
+
+    def get_stats(self):
+        """ Get the statistics of the cache.
+
+        Returns:
+            A dictionary with the counts of `hits`, `misses`, `evictions` and
+                `expirations`, as well as `hit_rate`, `size` and `max_size`.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self._get_connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+        stats['max_size'] = self.max_size
+        return stats
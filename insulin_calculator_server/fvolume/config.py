@@ -3,6 +3,20 @@ import os
 # The image size used for colored image, depth map and segmentation mask.
 UNIFIED_IMAGE_SIZE = (512, 512)
 
+# Whether to gather the segmentation of concurrent requests into batches. Only 
+# helps when a worker process serves multiple requests at once, such as gunicorn 
+# `gthread` workers. Off by default, until it is measured on the deployed worker 
+# model.
+SEGMENTATION_BATCHING = False
+
+# The maximum number of images in a segmentation batch.
+SEGMENTATION_MAX_BATCH_SIZE = 8
+
+# The maximum time to wait for a segmentation batch to be filled by the images of 
+# concurrent requests that are being regulated, in milliseconds. A lone request 
+# does not wait.
+SEGMENTATION_MAX_BATCH_WAIT_MS = 10
+
 # The probability threshold for identifying food in the segmentation mask. If a 
 # pixel's corresponding probability is above this threshold, it will be take as 
 # food.
@@ -18,16 +32,93 @@ CLASSIFIER_IMAGE_SIZE = (544, 544)
 # The offset added to the cropped image for the commercial classifier.
 CLASSIFIER_IMAGE_OFFSET = 16
 
+# The JPEG quality of the cropped images sent to the commercial classifier, from 0 
+# to 100.
+CLASSIFIER_JPEG_QUALITY = 90
+
 # The maximum entities for classification.
 MAX_ENTITIES_THRESHOLD = 5
 
+# The timeout of each classifier request, `(connect timeout, read timeout)` in 
+# seconds.
+CLASSIFIER_TIMEOUT = (3.05, 30)
+
+# The number of retries of each classifier request on connection errors and 
+# gateway errors.
+CLASSIFIER_MAX_RETRIES = 2
+
+# The backend of the classification result cache, `'memory'` for a cache in each 
+# process, `'sqlite'` for a cache persisted at `CLASSIFICATION_CACHE_PATH` and shared 
+# by processes, or `None` to disable caching.
+CLASSIFICATION_CACHE_BACKEND = 'memory'
+
+# The key of the classification result cache. `'content'` matches crops with 
+# identical JPEG bytes, `'perceptual'` also matches nearly identical crops.
+CLASSIFICATION_CACHE_KEY = 'content'
+
+# The maximum number of cached classification results.
+CLASSIFICATION_CACHE_SIZE = 1024
+
+# The time to live of cached classification results in seconds, `None` for no 
+# expiration.
+CLASSIFICATION_CACHE_TTL = 7 * 24 * 3600
+
 # The number of candidates to return. For each food entity, this amount of candidate 
 # classifications will be returned.
 CLASSIFICATION_CANDIDATES = 15
 
-# The threshold for RANSAC for plane detection. See https://scikit-learn.org/stable/modules/generated/sklearn.linear_model.RANSACRegressor.html.
+# The threshold for RANSAC for plane detection. A point whose vertical distance to 
+# the plane is within this threshold is taken as an inlier. In meters.
 RANSAC_THRESHOLD = 0.002
 
+# The number of plane hypotheses drawn by RANSAC for plane detection.
+RANSAC_MAX_TRIALS = 100
+
+# The number of points sampled from the point cloud for scoring the RANSAC 
+# hypotheses. The final plane is still refined and classified on the full point 
+# cloud.
+RANSAC_SCORE_SAMPLE_SIZE = 4096
+
+# The random seed of RANSAC for plane detection, which makes the plane detection 
+# reproducible. Set to `None` for a different sampling on each run.
+RANSAC_SEED = 0
+
+# The approximate number of pixels of the depth map to fit the plane on. The plane
+# is fitted on a strided grid of the background pixels, skipping the pixels labeled
+# as food, then the plane inliers are classified on the full point cloud. Set to
+# `None` to fit on the full point cloud.
+PLANE_FIT_SAMPLE_SIZE = 16384
+
+# The method to reject the depth outliers of each food entity. `'lof'` for 
+# `sklearn.neighbors.LocalOutlierFactor`, `'sorted_lof'` for the same local outlier 
+# factor computed on the sorted depths, which is much faster, `'mad'` for clipping 
+# by the median absolute deviation, `'quantile'` for clipping by quantiles, or 
+# `'none'` to keep all the points. `'sorted_lof'` matches `'lof'` on distinct 
+# depths, but breaks the ties of quantized depths, such as `float16` depth maps, 
+# differently, so `'lof'` stays the default until `benchmarks.outlier_rejection` 
+# shows the volume differences on stored sessions.
+OUTLIER_REJECTION_METHOD = 'lof'
+
+# The number of neighbors of the `'sorted_lof'` outlier rejection, the same as the 
+# default of `LocalOutlierFactor`.
+OUTLIER_LOF_NEIGHBORS = 20
+
+# The maximum distance to the median of the `'mad'` outlier rejection, in standard 
+# deviations estimated by the median absolute deviation.
+OUTLIER_MAD_THRESHOLD = 3.5
+
+# The fraction of points clipped on each side of the `'quantile'` outlier rejection.
+OUTLIER_QUANTILE = 0.01
+
+# The number of workers that filter the points of the food entities in parallel 
+# during volume estimation, `0` to filter them one by one.
+ENTITY_WORKER_COUNT = 0
+
+# The executor of the entity workers. `'process'` runs them in a process pool, 
+# sharing the point cloud through shared memory. `'thread'` runs them in a thread 
+# pool, which only overlaps the parts releasing the GIL.
+ENTITY_EXECUTOR = 'process'
+
 # The edge length of the grid when calculating the volume of food entity. In meters.
 GRID_LEN = 2e-3
 
@@ -37,11 +128,42 @@ GRID_LEN = 2e-3
 INTERPOLATION_POINT_FILTER_DISTANCE = 2e-3
 INTERPOLATION_POINT_FILTER_COUNT = 5
 
+# The maximum number of undistortion maps to cache. Each map is keyed by the lens 
+# distortion lookup table, the distortion center and the image size.
+UNDISTORT_MAP_CACHE_SIZE = 16
+
+# The maximum number of cached ray grids of the regulated depth map, each is keyed 
+# by the remapping intrinsics derived from the calibration.
+RAY_GRID_CACHE_SIZE = 16
+
+# The number of threads used by the C implementation of image rectifying. Keep it 
+# small when running multiple server workers on the same machine.
+UNDISTORT_THREAD_COUNT = 1
+
 # The root path of this package.
 PACKAGE_ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
 
 # The path of the food segmentation model.
 SEG_MODEL_PATH = os.path.join(PACKAGE_ROOT_PATH, *['ml_model', 'unet.hdf5'])
 
+# The paths of the food segmentation model converted by `food_segmentation_model/convert_lite.py`.
+SEG_TFLITE_MODEL_PATH = os.path.join(PACKAGE_ROOT_PATH, *['ml_model', 'unet.tflite'])
+SEG_ONNX_MODEL_PATH = os.path.join(PACKAGE_ROOT_PATH, *['ml_model', 'unet.onnx'])
+
+# The inference backend of the food segmentation model, `'keras'` for the original 
+# model at `SEG_MODEL_PATH`, `'tflite'` or `'onnx'` for the converted model, which 
+# does not import TensorFlow. The converted backends are experimental until their 
+# mask parity, startup time and memory are measured by 
+# `benchmarks.segmentation_backends` against the deployed model.
+SEG_MODEL_BACKEND = 'keras'
+
+# The number of threads of the `'tflite'` and `'onnx'` backends, `None` for the 
+# runtime default.
+SEG_MODEL_THREADS = None
+
+# The path of the SQLite database of the classification result cache. The `cache` 
+# directory is ignored by git.
+CLASSIFICATION_CACHE_PATH = os.path.join(PACKAGE_ROOT_PATH, *['cache', 'classification.sqlite3'])
+
 # The path of the shared object for image undistorting.
 UNDISTORT_DLL_PATH = os.path.join(PACKAGE_ROOT_PATH, *['c_core', 'undistort.so'])
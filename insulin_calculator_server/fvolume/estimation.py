@@ -1,14 +1,25 @@
 import numpy as np
 import cv2
 import math
+import functools
+import concurrent.futures
+import multiprocessing
+import multiprocessing.shared_memory
+import threading
+import os
+import atexit
 import skimage.measure
 import sklearn.neighbors
-from sklearn import linear_model
+import scipy.spatial
 from scipy.spatial.transform import Rotation
 
 from . import config
 from . import utils
 
+_entity_executor = None
+_entity_executor_pid = None
+_entity_executor_lock = threading.Lock()
+
 def _get_remapping_intrinsics(depth_map, calibration):
     """ Returning the focal length, horizontal optical center, and vertical optical 
         center of the given depth map.
@@ -27,12 +38,104 @@ def _get_remapping_intrinsics(depth_map, calibration):
     return fl, oc_x, oc_y
 
 
-def _get_plane_recognition(point_cloud):
+def _get_plane_residuals(point_cloud, coefficients):
+    """ Returning the vertical distances from the points to the planes.
+
+    Args:
+        point_cloud: A point cloud represented as an numpy array with shape `(n, 3)`.
+        coefficients: The coefficients `(a, b, c)` of the planes `z = a * x + b * y + c`, 
+            represented as a numpy array with shape `(3,)` or `(m, 3)`.
+    
+    Returns:
+        The absolute residuals with shape `(n,)` if a single plane is given, 
+            `(m, n)` otherwise.
+    """
+    coefficients = np.asarray(coefficients)
+    predictions = np.dot(coefficients[..., :2], point_cloud[:, :2].T) + coefficients[..., 2:3]
+    return np.abs(point_cloud[:, 2] - predictions)
+
+
+def _fit_plane_ransac(point_cloud, residual_threshold, max_trials, score_sample_size, seed):
+    """ Fitting the dominant plane `z = a * x + b * y + c` in `point_cloud` with 
+        RANSAC.
+
+    All hypotheses are computed at once from minimal samples of 3 points, then 
+        scored by their inlier count on a random subsample of `point_cloud`. 
+        The best hypothesis is refined with least squares over its inliers in 
+        the full point cloud.
+
+    Args:
+        point_cloud: A point cloud represented as an numpy array with shape `(n, 3)`.
+        residual_threshold: The maximum vertical distance from an inlier to the 
+            plane.
+        max_trials: The number of hypotheses to draw.
+        score_sample_size: The number of points for scoring the hypotheses.
+        seed: The seed of the random generator, or `None`.
+    
+    Returns:
+        (coefficients, inlier_mask)
+        `coefficients` is a numpy array `(a, b, c)` of the fitted plane.
+        `inlier_mask` is the boolean mask of the points lying in the plane.
+
+    Raises:
+        ValueError: If the point cloud has less than 3 points, or no hypothesis 
+            is a valid plane, such as when all the points are collinear.
+    """
+    if len(point_cloud) < 3:
+        raise ValueError('At least 3 points are required to fit a plane, got {}.'.format(len(point_cloud)))
+    rng = np.random.default_rng(seed)
+    samples = point_cloud[rng.integers(len(point_cloud), size=(max_trials, 3))]
+    normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+    # Collinear samples and planes parallel to z-axis can't be represented.
+    valid_trials = np.abs(normals[:, 2]) > np.finfo(point_cloud.dtype).eps
+    if not np.any(valid_trials):
+        raise ValueError('No valid plane hypothesis is found in the point cloud.')
+    normals, samples = normals[valid_trials], samples[valid_trials]
+    coefs_a, coefs_b = - normals[:, 0] / normals[:, 2], - normals[:, 1] / normals[:, 2]
+    coefs_c = samples[:, 0, 2] - coefs_a * samples[:, 0, 0] - coefs_b * samples[:, 0, 1]
+    hypotheses = np.stack([coefs_a, coefs_b, coefs_c], axis=1)
+    score_points = point_cloud[rng.choice(
+        len(point_cloud), 
+        size=min(score_sample_size, len(point_cloud)), 
+        replace=False
+    )]
+    scores = np.sum(_get_plane_residuals(score_points, hypotheses) <= residual_threshold, axis=1)
+    inlier_mask = _get_plane_residuals(point_cloud, hypotheses[np.argmax(scores)]) <= residual_threshold
+    coefficients, *_ = np.linalg.lstsq(
+        np.column_stack([point_cloud[inlier_mask, :2], np.ones(np.sum(inlier_mask))]),
+        point_cloud[inlier_mask, 2],
+        rcond=None
+    )
+    inlier_mask = _get_plane_residuals(point_cloud, coefficients) <= residual_threshold
+    return coefficients, inlier_mask
+
+
+def _get_plane_fit_mask(label_mask, sample_size):
+    """ Returning the mask of the pixels to fit the base plane on, which is a 
+        strided grid of about `sample_size` pixels, excluding the pixels 
+        labeled as food in `label_mask`. `None` if `sample_size` is `None`, 
+        which fits on all the pixels.
+    """
+    if sample_size is None:
+        return None
+    stride = max(1, int(np.sqrt(label_mask.size / sample_size)))
+    fit_mask = np.zeros(label_mask.shape, dtype=bool)
+    fit_mask[::stride, ::stride] = label_mask[::stride, ::stride] == 0
+    return fit_mask
+
+
+def _get_plane_recognition(point_cloud, fit_mask=None):
     """ Recognize the base plane in `point_cloud`. The plane mask and the 
         rotation to make the plane parallel to xOy surface is provided.
+
+    The plane is fitted on the points selected by `fit_mask`, then the inliers 
+        are classified on the full point cloud.
     
     Args:
         point_cloud: A point cloud represented as an numpy array with shape `(n, 3)`.
+        fit_mask: The boolean mask of the points to fit the plane on, `None` to 
+            fit on all the points. All the points are used if less than 3 
+            points are selected.
     
     Returns:
         (inlier_mask, rotation)
@@ -42,12 +145,18 @@ def _get_plane_recognition(point_cloud):
         `rotation` can help to rotate the plane parallel to xOy surface in the 
             coordinate system of `point_cloud`.
     """
-    ransac = linear_model.RANSACRegressor(
-        linear_model.LinearRegression(),
-        residual_threshold=config.RANSAC_THRESHOLD
+    if fit_mask is not None and np.count_nonzero(fit_mask) < 3:
+        fit_mask = None
+    coefficients, inlier_mask = _fit_plane_ransac(
+        point_cloud if fit_mask is None else point_cloud[fit_mask],
+        config.RANSAC_THRESHOLD,
+        config.RANSAC_MAX_TRIALS,
+        config.RANSAC_SCORE_SAMPLE_SIZE,
+        config.RANSAC_SEED
     )
-    ransac.fit(point_cloud[:,:2], point_cloud[:,2])
-    coef_a, coef_b = ransac.estimator_.coef_
+    if fit_mask is not None:
+        inlier_mask = _get_plane_residuals(point_cloud, coefficients) <= config.RANSAC_THRESHOLD
+    coef_a, coef_b, _ = coefficients
     normal_len_square = coef_a ** 2 + coef_b ** 2 + 1
     normal_len = np.sqrt(normal_len_square)
     regularizer = np.arccos(1.0 / normal_len) / np.sqrt((coef_b ** 2 + coef_a ** 2) * normal_len_square)
@@ -57,41 +166,63 @@ def _get_plane_recognition(point_cloud):
         0
     ])
     rotation = Rotation.from_rotvec(rotvec)
-    return ransac.inlier_mask_, rotation
+    return inlier_mask, rotation
 
 
-def _get_xoy_grid_lookup(point_cloud, grid_len):
-    """ Returning the grid lookup of a point cloud.
+def _get_xoy_grid_area_volume(point_clouds, background_depth, grid_len):
+    """ Returning the top surface area and volume of each point cloud by 
+        integrating over the XOY grid.
 
-    A grid lookup is a dictionary for looking up the points fall in a specific 
-        grid. When querying points in a grid with index `x_index, y_index`, 
-        `lookup[x_index][y_index]` is the list containing points in this grid. Each 
-        point is represented as a numpy array with shape `(3,)`.
-    In this method, the coordinate of the grid is built by projecting all points 
-        in `point_cloud` to XOY surface, the axis parallels to x-axis and y-axis of 
-        the world coordinate.
+    Each point is binned into a grid by projecting it to XOY surface, the grid 
+        coordinate is relative to the minimum x and y value of its own point 
+        cloud. The area of a point cloud is the total area of the grids 
+        containing at least one point, the volume is the sum of each grid's area 
+        multiplied by the mean height of its points above `background_depth`. 
+        All point clouds are binned in one vectorized pass.
 
     Args:
-        point_cloud: The point cloud to build a grid lookup upon, represented as 
-            a numpy array with shape `(n, 3)`.
+        point_clouds: A list of point clouds, each represented as a numpy array 
+            with shape `(n, 3)`.
+        background_depth: The depth of the base plane.
         grid_len: The length of the grid.
+    
+    Returns:
+        A list of `(area, volume)` tuples having the same order with 
+            `point_clouds`, measured in square meter and cube meter.
     """
-    xoy_grid_lookup = {}
-    x_min, y_min = np.min(point_cloud[:,0]), np.min(point_cloud[:,1])
-    for point in point_cloud:
-        x_index = utils.get_relative_index(point[0], x_min, grid_len)
-        y_index = utils.get_relative_index(point[1], y_min, grid_len)
-        if x_index not in xoy_grid_lookup:
-            xoy_grid_lookup[x_index] = {}
-        if y_index not in xoy_grid_lookup[x_index]:
-            xoy_grid_lookup[x_index][y_index] = []
-        xoy_grid_lookup[x_index][y_index].append(point)
-    return xoy_grid_lookup
+    point_clouds = [np.reshape(pc, (-1, 3)) for pc in point_clouds]
+    sizes = np.array([len(pc) for pc in point_clouds], dtype=np.int64)
+    if np.sum(sizes) == 0:
+        return [(0.0, 0.0) for _ in point_clouds]
+    entity_indices = np.repeat(np.arange(len(point_clouds)), sizes)
+    points = np.concatenate(point_clouds)
+    xy_min = np.array([
+        np.min(pc[:, :2], axis=0) if len(pc) > 0 else np.zeros(2) for pc in point_clouds
+    ])
+    grid_indices = np.floor((points[:, :2] - xy_min[entity_indices]) / grid_len).astype(np.int64)
+    grid_span = np.max(grid_indices, axis=0) + 1
+    grid_keys = (entity_indices * grid_span[0] + grid_indices[:, 0]) * grid_span[1] + grid_indices[:, 1]
+    _, cell_indices = np.unique(grid_keys, return_inverse=True)
+    cell_indices = np.reshape(cell_indices, -1)
+    cell_counts = np.bincount(cell_indices)
+    cell_heights = background_depth - np.bincount(cell_indices, weights=points[:, 2]) / cell_counts
+    cell_entities = np.zeros(len(cell_counts), dtype=np.int64)
+    cell_entities[cell_indices] = entity_indices
+    areas = np.bincount(cell_entities, minlength=len(point_clouds)) * grid_len ** 2
+    volumes = np.bincount(cell_entities, weights=cell_heights, minlength=len(point_clouds)) * grid_len ** 2
+    return [(float(area), float(volume)) for area, volume in zip(areas, volumes)]
 
 
 def _filter_interpolation_points(point_cloud):
     """ Filtering the interpolation points that lays on depth incontinuous regions.
 
+    A point is kept if more than `config.INTERPOLATION_POINT_FILTER_COUNT` points 
+        (itself included) lie within `config.INTERPOLATION_POINT_FILTER_DISTANCE` 
+        of it. The neighbors of all points are counted in bulk with a KD-tree.
+
+    The filter is not applied by `get_area_volume`, which relies on the outlier 
+        rejection of `_get_food_point_mask` instead.
+
     Args:
         point_cloud: A point cloud, represented by a numpy array with shape `(N, 3)`.
     
@@ -100,90 +231,374 @@ def _filter_interpolation_points(point_cloud):
     """
     # TODO(canchen.lee@gmail.com): The `INTERPOLATION_POINT_FILTER_COUNT` should 
     # depends on distance from the camera to the table surface.
-    filtered_point_cloud = np.zeros(point_cloud.shape)
-    filtered_count = 0
-    point_x_min, point_y_min = np.min(point_cloud[:,0]), np.min(point_cloud[:,1])
-    grid_lookup = _get_xoy_grid_lookup(point_cloud, config.INTERPOLATION_POINT_FILTER_DISTANCE)
-    def get_possible_points(lookup, center_coordinate):
-        c = center_coordinate
-        possible_coordinates = [
-            (c[0] - 1, c[1] - 1), (c[0], c[1] - 1), (c[0] + 1, c[1] - 1),
-            (c[0] - 1, c[1]), c, (c[0] + 1, c[1]),
-            (c[0] - 1, c[1] + 1), (c[0], c[1] + 1), (c[0] + 1, c[1] + 1)
+    if len(point_cloud) == 0:
+        return point_cloud
+    tree = scipy.spatial.cKDTree(point_cloud)
+    # Neighbors are counted with a strict distance threshold, while the KD-tree 
+    # query radius is inclusive.
+    close_points_counts = tree.query_ball_point(
+        point_cloud, 
+        np.nextafter(config.INTERPOLATION_POINT_FILTER_DISTANCE, 0), 
+        return_length=True
+    )
+    return point_cloud[close_points_counts > config.INTERPOLATION_POINT_FILTER_COUNT]
+
+
+def _sort_point_cloud_by_label(point_cloud, point_labels, labels):
+    """ Sorting the food points of a point cloud by their labels.
+
+    The points are grouped with one stable sort over their labels, so the 
+        points of each label keep their order in `point_cloud`.
+
+    Args:
+        point_cloud: A point cloud, represented by a numpy array with shape `(N, 3)`.
+        point_labels: The label of each point in `point_cloud`, represented by a 
+            numpy array with shape `(N,)`.
+        labels: The labels to extract the point clouds for. Label 0 stands for 
+            the background and should not be included.
+    
+    Returns:
+        `(sorted_point_cloud, bounds)`
+        `sorted_point_cloud` is a contiguous copy of the food points in 
+            `point_cloud`, sorted by label.
+        `bounds` is a list of `(start, end)` having the same order with 
+            `labels`, the point cloud of a label is 
+            `sorted_point_cloud[start:end]`.
+    """
+    food_point_mask = point_labels > 0
+    food_point_labels = point_labels[food_point_mask]
+    order = np.argsort(food_point_labels, kind='stable')
+    sorted_labels = food_point_labels[order]
+    sorted_point_cloud = np.ascontiguousarray(point_cloud[food_point_mask][order])
+    starts = np.searchsorted(sorted_labels, labels, side='left')
+    ends = np.searchsorted(sorted_labels, labels, side='right')
+    return sorted_point_cloud, [(int(start), int(end)) for start, end in zip(starts, ends)]
+
+
+def _get_lof_inlier_mask(depths):
+    """ Returning the inlier mask of the depths by `LocalOutlierFactor`.
+
+    Args:
+        depths: The depths of the points, represented by a numpy array with 
+            shape `(N,)`.
+    """
+    return sklearn.neighbors.LocalOutlierFactor().fit_predict(depths.reshape(-1, 1)) == 1
+
+
+def _get_sorted_lof_inlier_mask(depths, n_neighbors):
+    """ Returning the inlier mask of the depths by the local outlier factor, 
+        computed on the sorted depths.
+
+    In one dimension, the `k` nearest neighbors of a point are the other points 
+        of a window of `k + 1` consecutive sorted points. The tightest window 
+        around each point is picked among the `k + 1` candidates, and the local 
+        reachability densities and the outlier factors are computed on the 
+        windows, the same way as `LocalOutlierFactor` with its default 
+        `contamination='auto'`. This takes `O(N * k)` after sorting, without 
+        building a neighbor model. Points with tied distances may pick different 
+        neighbors than the KD-tree of `LocalOutlierFactor`, so the masks differ 
+        on quantized depths, such as those of `float16` depth maps.
+
+    Args:
+        depths: The depths of the points, represented by a numpy array with 
+            shape `(N,)`.
+        n_neighbors: The number of neighbors `k`, reduced to `N - 1` for 
+            smaller inputs.
+    """
+    k = min(n_neighbors, len(depths) - 1)
+    order = np.argsort(depths, kind='stable')
+    sorted_depths = depths[order]
+    indices = np.arange(len(depths))
+    window_starts = np.clip(indices[:, np.newaxis] - np.arange(k + 1), 0, len(depths) - k - 1)
+    window_costs = np.maximum(
+        sorted_depths[:, np.newaxis] - sorted_depths[window_starts], 
+        sorted_depths[window_starts + k] - sorted_depths[:, np.newaxis]
+    )
+    best_windows = np.argmin(window_costs, axis=1)
+    window_starts = window_starts[indices, best_windows]
+    k_distances = window_costs[indices, best_windows]
+    window_indices = window_starts[:, np.newaxis] + np.arange(k + 1)
+    neighbors = np.reshape(window_indices[window_indices != indices[:, np.newaxis]], (-1, k))
+    reach_distances = np.maximum(
+        k_distances[neighbors], 
+        np.abs(sorted_depths[neighbors] - sorted_depths[:, np.newaxis])
+    )
+    # The same regularization as `LocalOutlierFactor` for duplicated points.
+    local_reachability_densities = 1.0 / (np.mean(reach_distances, axis=1) + 1e-10)
+    outlier_factors = np.mean(local_reachability_densities[neighbors], axis=1) / local_reachability_densities
+    inlier_mask = np.empty(len(depths), dtype=bool)
+    inlier_mask[order] = outlier_factors <= 1.5
+    return inlier_mask
+
+
+def _get_mad_inlier_mask(depths, threshold):
+    """ Returning the inlier mask of the depths, whose distance to the median 
+        is within `threshold` times the scaled median absolute deviation.
+
+    Args:
+        depths: The depths of the points, represented by a numpy array with 
+            shape `(N,)`.
+        threshold: The maximum distance to the median, in standard deviations.
+    """
+    median = np.median(depths)
+    deviations = np.abs(depths - median)
+    # 1.4826 scales the median absolute deviation to the standard deviation of 
+    # normally distributed data.
+    scale = 1.4826 * np.median(deviations)
+    if scale == 0:
+        return np.ones(len(depths), dtype=bool)
+    return deviations <= threshold * scale
+
+
+def _get_quantile_inlier_mask(depths, quantile):
+    """ Returning the inlier mask of the depths within the `[quantile, 1 - quantile]` 
+        quantile range.
+
+    Args:
+        depths: The depths of the points, represented by a numpy array with 
+            shape `(N,)`.
+        quantile: The fraction of points to clip on each side.
+    """
+    lower, upper = np.quantile(depths, [quantile, 1 - quantile])
+    return (depths >= lower) & (depths <= upper)
+
+
+def _get_depth_inlier_mask(depths, method=None):
+    """ Returning the inlier mask of the depths of a food entity.
+
+    Args:
+        depths: The depths of the points, represented by a numpy array with 
+            shape `(N,)`, `N` should be larger than 1.
+        method: The outlier rejection method, `None` for 
+            `config.OUTLIER_REJECTION_METHOD`. `'lof'` for `LocalOutlierFactor`, 
+            `'sorted_lof'` for `_get_sorted_lof_inlier_mask`, `'mad'` for 
+            `_get_mad_inlier_mask`, `'quantile'` for `_get_quantile_inlier_mask`, 
+            or `'none'` to keep all the points.
+    """
+    method = config.OUTLIER_REJECTION_METHOD if method is None else method
+    if method == 'lof':
+        return _get_lof_inlier_mask(depths)
+    elif method == 'sorted_lof':
+        return _get_sorted_lof_inlier_mask(depths, config.OUTLIER_LOF_NEIGHBORS)
+    elif method == 'mad':
+        return _get_mad_inlier_mask(depths, config.OUTLIER_MAD_THRESHOLD)
+    elif method == 'quantile':
+        return _get_quantile_inlier_mask(depths, config.OUTLIER_QUANTILE)
+    elif method == 'none':
+        return np.ones(len(depths), dtype=bool)
+    else:
+        raise ValueError('Unknown outlier rejection method: {}.'.format(method))
+
+
+def _get_food_point_mask(point_cloud, background_depth):
+    """ Returning the mask of the points of a food entity that are kept for 
+        volume estimation.
+
+    The points below the base plane, or too close to the camera, are removed. 
+        Then the depth outliers are removed, see `_get_depth_inlier_mask`.
+
+    Args:
+        point_cloud: The point cloud of a food entity, represented by a numpy 
+            array with shape `(N, 3)`.
+        background_depth: The depth of the base plane.
+    
+    Returns:
+        A boolean numpy array with shape `(N,)`.
+    """
+    # 0.15 is the approximate minimum distance that TrueDepth camera could give
+    # reasonable depth estimation
+    point_mask = (point_cloud[:, 2] < background_depth) & (point_cloud[:, 2] > 0.15)
+    if np.count_nonzero(point_mask) > 1:
+        point_mask[point_mask] = _get_depth_inlier_mask(point_cloud[point_mask][:, 2])
+    return point_mask
+
+
+def _get_shared_food_point_mask(shared_memory_name, shape, start, end, background_depth):
+    """ `_get_food_point_mask` on the points `[start:end]` of a point cloud in 
+        shared memory, which runs in the entity worker processes.
+
+    Args:
+        shared_memory_name: The name of the shared memory block holding the 
+            point cloud, a `float64` array with shape `shape`.
+        shape: The shape of the point cloud.
+        start: The index of the first point of the entity.
+        end: The index after the last point of the entity.
+        background_depth: The depth of the base plane.
+    """
+    shared_memory = multiprocessing.shared_memory.SharedMemory(name=shared_memory_name)
+    point_cloud = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+    try:
+        return _get_food_point_mask(point_cloud[start:end], background_depth)
+    finally:
+        del point_cloud
+        shared_memory.close()
+
+
+def _get_entity_executor():
+    """ Returning the executor for the per entity work of volume estimation, 
+        `None` if `config.ENTITY_WORKER_COUNT` is `0`. It is created lazily, and 
+        recreated in forked processes.
+    """
+    global _entity_executor, _entity_executor_pid
+    if config.ENTITY_WORKER_COUNT <= 0:
+        return None
+    with _entity_executor_lock:
+        if _entity_executor_pid != os.getpid():
+            if config.ENTITY_EXECUTOR == 'process':
+                _entity_executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=config.ENTITY_WORKER_COUNT,
+                    mp_context=multiprocessing.get_context('forkserver')
+                )
+            elif config.ENTITY_EXECUTOR == 'thread':
+                _entity_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=config.ENTITY_WORKER_COUNT
+                )
+            else:
+                raise ValueError('Unknown entity executor: {}.'.format(config.ENTITY_EXECUTOR))
+            _entity_executor_pid = os.getpid()
+        return _entity_executor
+
+
+def _shutdown_entity_executor():
+    """ Shut down the entity executor of this process, so that its worker 
+        processes and their semaphores are released before the interpreter exits.
+    """
+    with _entity_executor_lock:
+        if _entity_executor is not None and _entity_executor_pid == os.getpid():
+            _entity_executor.shutdown()
+
+
+atexit.register(_shutdown_entity_executor)
+
+
+def _filter_food_point_clouds(sorted_point_cloud, bounds, background_depth):
+    """ Filtering the points of each food entity, see `_get_food_point_mask`.
+
+    The entities are filtered one by one without an entity executor. With a 
+        thread executor, they are filtered in threads on views of 
+        `sorted_point_cloud`. With a process executor, `sorted_point_cloud` is 
+        copied to shared memory once, so each worker process reads its entity 
+        without receiving a pickled copy, and returns only a mask.
+
+    Args:
+        sorted_point_cloud: The food points sorted by label, see 
+            `_sort_point_cloud_by_label`.
+        bounds: The `(start, end)` of each food entity in `sorted_point_cloud`.
+        background_depth: The depth of the base plane.
+    
+    Returns:
+        A list of the filtered point clouds having the same order with `bounds`.
+    """
+    executor = _get_entity_executor() if len(bounds) > 1 else None
+    if executor is None:
+        point_masks = [
+            _get_food_point_mask(sorted_point_cloud[start:end], background_depth) for start, end in bounds
         ]
-        possible_coordinates = filter(lambda x: x[0] >= 0 and x[1] >= 0, possible_coordinates)
-        points = []
-        for coordinate in possible_coordinates:
-            if coordinate[0] in lookup and coordinate[1] in lookup[coordinate[0]]:
-                points += lookup[coordinate[0]][coordinate[1]]
-        return np.array(points)
-    for point in point_cloud:
-        possible_close_points = get_possible_points(
-            grid_lookup, (
-                utils.get_relative_index(point[0], point_x_min, config.INTERPOLATION_POINT_FILTER_DISTANCE),
-                utils.get_relative_index(point[1], point_y_min, config.INTERPOLATION_POINT_FILTER_DISTANCE)
-            )
+    elif isinstance(executor, concurrent.futures.ThreadPoolExecutor):
+        point_masks = list(executor.map(
+            lambda bound: _get_food_point_mask(sorted_point_cloud[bound[0]:bound[1]], background_depth),
+            bounds
+        ))
+    else:
+        shared_memory = multiprocessing.shared_memory.SharedMemory(
+            create=True, 
+            size=max(sorted_point_cloud.nbytes, 1)
         )
-        distance_squares = np.sum(np.square(possible_close_points - point), axis=1)
-        close_points_count = len(np.where(distance_squares < config.INTERPOLATION_POINT_FILTER_DISTANCE ** 2)[0])
-        if close_points_count > config.INTERPOLATION_POINT_FILTER_COUNT:
-            filtered_point_cloud[filtered_count] = point
-            filtered_count += 1
-    return filtered_point_cloud[:filtered_count]
+        try:
+            shared_point_cloud = np.ndarray(
+                sorted_point_cloud.shape, 
+                dtype=np.float64, 
+                buffer=shared_memory.buf
+            )
+            shared_point_cloud[:] = sorted_point_cloud
+            del shared_point_cloud
+            futures = [
+                executor.submit(
+                    _get_shared_food_point_mask, 
+                    shared_memory.name, 
+                    sorted_point_cloud.shape, 
+                    start, 
+                    end, 
+                    background_depth
+                ) for start, end in bounds
+            ]
+            point_masks = [future.result() for future in futures]
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+    return [
+        sorted_point_cloud[start:end][point_mask] for (start, end), point_mask in zip(bounds, point_masks)
+    ]
+
+
+@functools.lru_cache(maxsize=config.RAY_GRID_CACHE_SIZE)
+def _get_ray_grids(fl, oc_x, oc_y):
+    """ Returning the ray grids of the regulated depth map for the remapping 
+        intrinsics, which are cached since they only depend on the calibration.
+
+    A pixel `(i, j)` with depth `d` is at `(x_rays[i, j] * d, y_rays[i, j] * d, d)` 
+        in the camera coordinate system.
+
+    Args:
+        fl: The focal length.
+        oc_x: The horizontal optical center.
+        oc_y: The vertical optical center.
+    
+    Returns:
+        `(x_rays, y_rays)`, two read only numpy arrays with shape 
+            `config.UNIFIED_IMAGE_SIZE`, which are `(i - oc_x) / fl` and 
+            `(j - oc_y) / fl`.
+    """
+    x_rays = np.fromfunction(lambda i, j: (i - oc_x) / fl, config.UNIFIED_IMAGE_SIZE)
+    y_rays = np.fromfunction(lambda i, j: (j - oc_y) / fl, config.UNIFIED_IMAGE_SIZE)
+    x_rays.flags.writeable = False
+    y_rays.flags.writeable = False
+    return x_rays, y_rays
 
 
-def get_area_volume(depth_map, calibration, attitude, label_mask):
+def get_area_volume(depth_map, calibration, attitude, label_mask, regulated_depth_map=None):
     """ Get the estimated top surface area and volume of each object specified by 
         `label_mask`.
     
     Args:
         depth_map: The depth map captured by device, represented as a numpy array.
+            It is not used if `regulated_depth_map` is given.
         calibration: The camera calibration data when capturing the depth map.
         attitude: The device attitude data when capturing the image.
         label_mask: The entity label mask of the depth map, it should be of shape 
             `config.UNIFIED_IMAGE_SIZE`. Within these labels, 0 stands for the 
             background, and other positive integers stands for different objects.
+        regulated_depth_map: The depth map already regulated by 
+            `utils.regulate_image`, such as by `utils.regulate_session_images`.
     
     Returns:
         A area volume list. The values stands for `(area, volume)`, measured in 
             square meter and cube meter.
     """
-    regulated_depth_map = utils.regulate_image(depth_map, calibration)
-    intrinsics = _get_remapping_intrinsics(regulated_depth_map, calibration)
-    x_axis_matrix = np.fromfunction(
-        lambda i, j: (i - intrinsics[1]) / intrinsics[0], 
-        config.UNIFIED_IMAGE_SIZE
-    ) * regulated_depth_map
-    y_axis_matrix = np.fromfunction(
-        lambda i, j: (j - intrinsics[2]) / intrinsics[0], 
-        config.UNIFIED_IMAGE_SIZE
-    ) * regulated_depth_map
-    full_point_cloud = np.swapaxes(np.array([
-        x_axis_matrix.flatten(), 
-        y_axis_matrix.flatten(), 
-        regulated_depth_map.flatten()
-    ]), 0, 1)
-    full_point_cloud = full_point_cloud[full_point_cloud[:, 2] > 0]
-    plane_inlier_mask, rotation = _get_plane_recognition(full_point_cloud)
+    if regulated_depth_map is None:
+        regulated_depth_map = utils.regulate_image(depth_map, calibration)
+    x_rays, y_rays = _get_ray_grids(*_get_remapping_intrinsics(regulated_depth_map, calibration))
+    depths = regulated_depth_map.flatten()
+    valid_point_mask = depths > 0
+    depths = depths[valid_point_mask]
+    full_point_cloud = np.stack([
+        x_rays.flatten()[valid_point_mask] * depths, 
+        y_rays.flatten()[valid_point_mask] * depths, 
+        depths
+    ], axis=1)
+    point_labels = label_mask.flatten()[valid_point_mask]
+    plane_fit_mask = _get_plane_fit_mask(label_mask, config.PLANE_FIT_SAMPLE_SIZE)
+    plane_inlier_mask, rotation = _get_plane_recognition(
+        full_point_cloud,
+        None if plane_fit_mask is None else plane_fit_mask.flatten()[valid_point_mask]
+    )
     full_point_cloud = rotation.apply(full_point_cloud)
     background_depth = np.mean(full_point_cloud[plane_inlier_mask][:,2])
-    food_point_clouds = [np.swapaxes(np.array([
-        np.array([x_axis_matrix[row, col] for row, col in zip(*np.where(label_mask == food_id))]),
-        np.array([y_axis_matrix[row, col] for row, col in zip(*np.where(label_mask == food_id))]),
-        np.array([regulated_depth_map[row, col] for row, col in zip(*np.where(label_mask == food_id))])
-    ]), 0, 1) for food_id in np.unique(label_mask)[1:]]
-    food_point_clouds = [rotation.apply(pc) for pc in food_point_clouds]
-    # 0.15 is the approximate minimum distance that TrueDepth camera could give
-    # reasonable depth estimation
-    food_point_clouds = [pc[(pc[:,2] < background_depth) & (pc[:,2] > 0.15)] for pc in food_point_clouds]
-    food_point_clouds = [pc[np.where(sklearn.neighbors.LocalOutlierFactor().fit_predict(pc[:, 2].reshape(-1, 1)) == 1)] for pc in food_point_clouds]
-    food_grid_lookups = [_get_xoy_grid_lookup(pc, config.GRID_LEN) for pc in food_point_clouds]
-    area_volume_list = [(
-        sum([sum([
-            config.GRID_LEN ** 2 for y_value in x_value.values()
-        ]) for x_value in lookup.values()]),
-        sum([sum([
-            (np.mean(background_depth - np.array(y_value), axis=0)[2]) * config.GRID_LEN ** 2 for y_value in x_value.values()
-        ]) for x_value in lookup.values()])
-    ) for lookup in food_grid_lookups]
+    sorted_point_cloud, bounds = _sort_point_cloud_by_label(
+        full_point_cloud, 
+        point_labels, 
+        np.unique(label_mask)[1:]
+    )
+    food_point_clouds = _filter_food_point_clouds(sorted_point_cloud, bounds, background_depth)
+    area_volume_list = _get_xoy_grid_area_volume(food_point_clouds, background_depth, config.GRID_LEN)
     return area_volume_list
@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+class ModelRegistry(object):
+    """ A registry of the models and native libraries used by this package.
+
+    Each entry is loaded lazily on its first `get`, or eagerly by `load_all`.
+        Loading eagerly in each gunicorn worker, such as in the
+        `post_worker_init` hook, keeps the loading time off the first user
+        request. The runtimes own thread pools, which do not survive a fork, so
+        they should not be loaded in the gunicorn master process. Only the
+        eager entries, which serving uses, are loaded by `load_all` and counted
+        by `is_ready`.
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._warm_ups = {}
+        self._eager = {}
+        self._entries = {}
+        self._status = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warm_up=None, eager=True):
+        """ Register an entry.
+
+        Args:
+            name: The name of the entry.
+            loader: A function without arguments that returns the loaded entry.
+            warm_up: An optional function that takes the loaded entry and runs it
+                once, so that lazy initializations of the runtime happen.
+            eager: Whether the entry is used for serving, so that it is loaded
+                by `load_all` and required by `is_ready`. Other entries are
+                only loaded on their first `get`.
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._warm_ups[name] = warm_up
+            self._eager[name] = eager
+            self._locks[name] = threading.Lock()
+            self._status[name] = {'state': 'unloaded'}
+
+    def get(self, name, warm_up=False):
+        """ Get an entry, load it if it is not loaded yet.
+
+        Args:
+            name: The name of the entry.
+            warm_up: Whether to warm up the entry after loading it.
+        """
+        entry = self._entries.get(name)
+        if entry is not None:
+            return entry
+        with self._locks[name]:
+            if name in self._entries:
+                return self._entries[name]
+            self._status[name] = {'state': 'loading'}
+            start_time = time.perf_counter()
+            try:
+                entry = self._loaders[name]()
+                status = {'state': 'ready', 'load_seconds': time.perf_counter() - start_time}
+                if warm_up and self._warm_ups[name] is not None:
+                    start_time = time.perf_counter()
+                    self._warm_ups[name](entry)
+                    status['warm_up_seconds'] = time.perf_counter() - start_time
+            except Exception as error:
+                self._status[name] = {'state': 'failed', 'error': repr(error)}
+                raise
+            self._entries[name] = entry
+            self._status[name] = status
+            return entry
+
+    def load_all(self, warm_up=True):
+        """ Load all the eager entries.
+
+        Args:
+            warm_up: Whether to warm up the entries after loading them.
+        """
+        for name in [name for name, eager in self._eager.items() if eager]:
+            self.get(name, warm_up=warm_up)
+
+    def is_ready(self):
+        """ Whether all the eager entries are loaded.
+        """
+        return all(
+            status['state'] == 'ready'
+            for name, status in self.get_status().items() if self._eager[name]
+        )
+
+    def get_status(self):
+        """ Get the loading status of the entries.
+
+        Returns:
+            A dictionary from the entry names to their status. Each status has a
+                `state` of `'unloaded'`, `'loading'`, `'ready'` or `'failed'`, and
+                `load_seconds`, `warm_up_seconds` or `error` when available.
+        """
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+
+registry = ModelRegistry()
@@ -1,23 +1,74 @@
 import skimage.measure
+import scipy.ndimage
 import numpy as np
 import cv2
+import contextlib
 import io
-import matplotlib.pyplot as plt
-import keras
-import tensorflow as tf
 
 from . import config
 from . import utils
+from . import batching
+from . import segmentation_backend
+from . import model_registry
 
-segmentation_model = tf.keras.models.load_model(
-    config.SEG_MODEL_PATH, 
-    custom_objects={'lovasz_hinge': keras.losses.binary_crossentropy}
+
+def _warm_up_segmentation_model(segmentation_model):
+    """ Running the segmentation model once, so that the runtime finishes its 
+        lazy initialization before serving requests.
+
+    Args:
+        segmentation_model: The segmentation backend to warm up.
+    """
+    segmentation_model.predict(np.zeros((1, *config.UNIFIED_IMAGE_SIZE, 3), dtype=np.float32))
+
+
+model_registry.registry.register(
+    'segmentation_model',
+    segmentation_backend.load_segmentation_backend,
+    warm_up=_warm_up_segmentation_model
+)
+
+
+def _predict_segmentation_batch(images):
+    """ Returning the raw segmentation masks for a batch of normalized images.
+
+    Args:
+        images: The normalized images to predict, represented as a numpy array 
+            with shape `(n, *config.UNIFIED_IMAGE_SIZE, 3)`.
+    
+    Returns:
+        The segmentation masks with shape `(n, *config.UNIFIED_IMAGE_SIZE)`.
+    """
+    segmentation_model = model_registry.registry.get('segmentation_model')
+    predicted_result = segmentation_model.predict(images.astype(np.float32))
+    return np.reshape(predicted_result, (len(images), *config.UNIFIED_IMAGE_SIZE))
+
+
+segmentation_scheduler = batching.BatchScheduler(
+    _predict_segmentation_batch,
+    config.SEGMENTATION_MAX_BATCH_SIZE,
+    config.SEGMENTATION_MAX_BATCH_WAIT_MS
 )
 
+
+def expecting_segmentation():
+    """ Returning a context in which the calling thread is going to segment an 
+        image, such as while its images are being regulated. With 
+        `config.SEGMENTATION_BATCHING`, `segmentation_scheduler` waits for the 
+        images of these threads to fill a batch, see `BatchScheduler.expecting`.
+    """
+    if config.SEGMENTATION_BATCHING:
+        return segmentation_scheduler.expecting()
+    return contextlib.nullcontext()
+
+
 def _get_segmentation(image):
     """ Returning the raw segmentation mask for the image. Each pixel's value 
         stands for the probability of this pixel being food.
 
+    If `config.SEGMENTATION_BATCHING` is set, the image is predicted along with 
+        the images of concurrent requests in a batch by `segmentation_scheduler`.
+
     Args:
         image: The image to predict, represented as a numpy array with shape
             `(*configure.UNIFIED_IMAGE_SIZE, 3)`.
@@ -27,19 +78,19 @@ def _get_segmentation(image):
     """
     # TODO(canchen.lee@gmail.com): Try to figure out why transposing the image 
     # will impact the model's performance.
-    global segmentation_model
     def center_normalize(image):
         mean = np.mean(cv2.resize(image, (512, 512)), axis=(0, 1))
         std = np.std(cv2.resize(image, (512, 512)), axis=(0, 1))
         return (image - mean) / std
-    image = np.swapaxes(image, 0, 1)
-    predicted_result = segmentation_model.predict(
-        np.reshape(center_normalize(image), (1, *config.UNIFIED_IMAGE_SIZE, 3))
-    )[0]
-    return np.swapaxes(np.reshape(
-        predicted_result,
-        config.UNIFIED_IMAGE_SIZE
-    ), 0, 1)
+    image = np.reshape(
+        center_normalize(np.swapaxes(image, 0, 1)), 
+        (*config.UNIFIED_IMAGE_SIZE, 3)
+    )
+    if config.SEGMENTATION_BATCHING:
+        predicted_result = segmentation_scheduler.submit(image).result()
+    else:
+        predicted_result = _predict_segmentation_batch(image[np.newaxis])[0]
+    return np.swapaxes(predicted_result, 0, 1)
 
 
 def _get_entity_labeling(image, mask):
@@ -66,21 +117,21 @@ def _get_entity_labeling(image, mask):
     # TODO(canchen.lee@gmail.com): Consider using the colored image along with 
     # the mask to generate entity boxes, which separate enties within one connected 
     # component.
-    bin_func = np.vectorize(lambda x: 0 if x < config.FOOD_PROB_THRESHOLD else 1)
-    binary_mask = bin_func(mask)
+    binary_mask = mask >= config.FOOD_PROB_THRESHOLD
     label_mask = skimage.measure.label(binary_mask, connectivity=2, background=0)
-    boxes = [[
-            *map(lambda x: (min(x), max(x) + 1), np.where(label_mask == entity))
-        ] for entity in np.unique(label_mask)
-    ]
-    invalid_entity_indices = [
-        index 
-        for index, box in enumerate(boxes) 
+    boxes = {
+        entity: [(entity_slice[0].start, entity_slice[0].stop), (entity_slice[1].start, entity_slice[1].stop)]
+        for entity, entity_slice in enumerate(scipy.ndimage.find_objects(label_mask), start=1)
+        if entity_slice is not None
+    }
+    invalid_entities = {
+        entity 
+        for entity, box in boxes.items() 
         if min(box[0][1] - box[0][0], box[1][1] - box[1][0]) < config.FOOD_MIN_SIZE_THRESHOLD
-    ]
-    label_mask[np.isin(label_mask, invalid_entity_indices)] = 0
-    boxes = [box for index, box in enumerate(boxes) if index not in invalid_entity_indices]
-    return label_mask, boxes[1:]
+    }
+    label_mask[np.isin(label_mask, list(invalid_entities))] = 0
+    boxes = [box for entity, box in boxes.items() if entity not in invalid_entities]
+    return label_mask, boxes
 
 
 def _index_crop(array, i, multiplier):
@@ -132,7 +183,28 @@ def _index_crop(array, i, multiplier):
         ]
 
 
-def get_recognition_results(image, calibration):
+def _encode_jpeg(image):
+    """ Encoding an RGB image to a JPEG image buffer with 
+        `config.CLASSIFIER_JPEG_QUALITY`.
+
+    Args:
+        image: The RGB image, represented as a `uint8` numpy array with shape 
+            `(rows, columns, 3)`.
+    
+    Returns:
+        The encoded image buffer, a `io.BytesIO` object.
+    """
+    success, encoded_image = cv2.imencode(
+        '.jpg', 
+        cv2.cvtColor(image, cv2.COLOR_RGB2BGR), 
+        [cv2.IMWRITE_JPEG_QUALITY, config.CLASSIFIER_JPEG_QUALITY]
+    )
+    if not success:
+        raise ValueError('Failed to encode the image to JPEG.')
+    return io.BytesIO(encoded_image.tobytes())
+
+
+def get_recognition_results(image, calibration, regulated_image=None):
     """ Get the recognition result of the color image with corresponding mask.
 
     Get a list of image buffers with the cropped food image in `image`. Images 
@@ -141,6 +213,8 @@ def get_recognition_results(image, calibration):
     Args:
         image: The raw resolution colored square image, represented as a numpy array.
         calibration: The camera calibration data when capturing the image.
+        regulated_image: The image already regulated by `utils.regulate_image`, 
+            such as by `utils.regulate_session_images`.
     
     Returns:
         A tuple `(label_mask, boxes, buffers)`.
@@ -155,14 +229,17 @@ def get_recognition_results(image, calibration):
         `buffers` is a list of image buffers, each image is the cropped food 
             image in `image`, and are all resized to `config.CLASSIFIER_IMAGE_SIZE`.
     """
-    regulated_image = utils.regulate_image(image, calibration)
+    if regulated_image is None:
+        regulated_image = utils.regulate_image(image, calibration)
     mask = _get_segmentation(regulated_image)
     label_mask, boxes = _get_entity_labeling(regulated_image, mask)
     multiplier = image.shape[0] / config.UNIFIED_IMAGE_SIZE[0]
+    # The center crop is a view, which is computed once and shared by the crops.
+    square_image = utils.center_crop(np.swapaxes(image, 0, 1))
     images = [
         cv2.resize(
             _index_crop(
-                utils.center_crop(np.swapaxes(image, 0, 1)), [
+                square_image, [
                     [max(0, box[0][0] - config.CLASSIFIER_IMAGE_OFFSET), min(config.UNIFIED_IMAGE_SIZE[0] - 1, box[0][1] + config.CLASSIFIER_IMAGE_OFFSET)], 
                     [max(0, box[1][0] - config.CLASSIFIER_IMAGE_OFFSET), min(config.UNIFIED_IMAGE_SIZE[0] - 1, box[1][1] + config.CLASSIFIER_IMAGE_OFFSET)]
                 ], multiplier
@@ -172,6 +249,5 @@ def get_recognition_results(image, calibration):
     ]
     # TODO(canchen.lee@gmail.com): Map the boxes back to match the undistorted coordinate.
     remapped_boxes = [[float(item / label_mask.shape[0]) for tp in box for item in tp] for box in boxes]
-    buffers = [io.BytesIO() for _ in range(len(images))]
-    [plt.imsave(buffer, image, format='jpeg') for buffer, image in zip(buffers, images)]
+    buffers = [_encode_jpeg(image) for image in images]
     return label_mask, remapped_boxes, buffers
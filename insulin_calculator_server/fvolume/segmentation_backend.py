@@ -0,0 +1,129 @@
+import threading
+import numpy as np
+
+from . import config
+
+
+class KerasSegmentationBackend(object):
+    """ The segmentation backend running the original Keras model. TensorFlow
+        and Keras are imported only when this backend is created.
+
+    Attributes:
+        model_path: The path of the `.hdf5` model.
+    """
+    def __init__(self, model_path):
+        import keras
+        import tensorflow as tf
+        self.model_path = model_path
+        self._model = tf.keras.models.load_model(
+            model_path,
+            custom_objects={'lovasz_hinge': keras.losses.binary_crossentropy}
+        )
+
+    def predict(self, images):
+        """ Predict the segmentation masks of a batch of normalized images.
+
+        Args:
+            images: A `float32` numpy array with shape `(n, height, width, 3)`.
+
+        Returns:
+            The raw model output with shape `(n, height, width, 1)`.
+        """
+        return self._model.predict(images)
+
+
+class TFLiteSegmentationBackend(object):
+    """ The segmentation backend running a TFLite model converted by
+        `food_segmentation_model/convert_lite.py`. `tflite_runtime` is used if
+        installed, otherwise the interpreter of TensorFlow. Float models run
+        with the XNNPACK delegate by default.
+
+    Attributes:
+        model_path: The path of the `.tflite` model.
+        num_threads: The number of threads of the interpreter.
+    """
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self._interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        self._input_shape = None
+        self._lock = threading.Lock()
+
+    def predict(self, images):
+        """ Predict the segmentation masks of a batch of normalized images.
+
+        Args:
+            images: A `float32` numpy array with shape `(n, height, width, 3)`.
+
+        Returns:
+            The raw model output with shape `(n, height, width, 1)`.
+        """
+        with self._lock:
+            if self._input_shape != images.shape:
+                self._interpreter.resize_tensor_input(self._input_index, images.shape)
+                self._interpreter.allocate_tensors()
+                self._input_shape = images.shape
+            self._interpreter.set_tensor(self._input_index, images)
+            self._interpreter.invoke()
+            return np.copy(self._interpreter.get_tensor(self._output_index))
+
+
+class OnnxSegmentationBackend(object):
+    """ The segmentation backend running an ONNX model converted by
+        `food_segmentation_model/convert_lite.py` with ONNX Runtime on CPU.
+
+    Attributes:
+        model_path: The path of the `.onnx` model.
+        num_threads: The number of intra operation threads of the session.
+    """
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime
+        self.model_path = model_path
+        self.num_threads = num_threads
+        session_options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            session_options.intra_op_num_threads = num_threads
+        self._session = onnxruntime.InferenceSession(
+            model_path,
+            sess_options=session_options,
+            providers=['CPUExecutionProvider']
+        )
+        self._input_name = self._session.get_inputs()[0].name
+
+    def predict(self, images):
+        """ Predict the segmentation masks of a batch of normalized images.
+
+        Args:
+            images: A `float32` numpy array with shape `(n, height, width, 3)`.
+
+        Returns:
+            The raw model output with shape `(n, height, width, 1)`.
+        """
+        return self._session.run(None, {self._input_name: images})[0]
+
+
+def load_segmentation_backend(backend=None):
+    """ Load the segmentation backend.
+
+    Args:
+        backend: `'keras'`, `'tflite'` or `'onnx'`, defaults to
+            `config.SEG_MODEL_BACKEND`.
+
+    Returns:
+        The backend object, which provides a `predict` method.
+    """
+    backend = config.SEG_MODEL_BACKEND if backend is None else backend
+    if backend == 'keras':
+        return KerasSegmentationBackend(config.SEG_MODEL_PATH)
+    elif backend == 'tflite':
+        return TFLiteSegmentationBackend(config.SEG_TFLITE_MODEL_PATH, config.SEG_MODEL_THREADS)
+    elif backend == 'onnx':
+        return OnnxSegmentationBackend(config.SEG_ONNX_MODEL_PATH, config.SEG_MODEL_THREADS)
+    else:
+        raise ValueError('Unknown segmentation backend: {}.'.format(backend))
@@ -3,8 +3,12 @@ import math
 import cv2
 import ctypes
 import functools
+import collections
+import hashlib
+import threading
 
 from . import config
+from . import model_registry
 
 
 def center_crop(array):
@@ -28,13 +32,71 @@ def center_crop(array):
         return array[:, offset:array.shape[0] + offset]
 
 
+def _get_center_crop_slices(shape):
+    """ Returning the slices of the first two axes that `center_crop` takes.
+
+    Args:
+        shape: The shape of the array to crop.
+    """
+    offset = abs(shape[0] - shape[1]) // 2
+    if shape[0] > shape[1]:
+        return slice(offset, shape[1] + offset), slice(0, shape[1])
+    else:
+        return slice(0, shape[0]), slice(offset, shape[0] + offset)
+
+
+def _get_regulation_maps(image_shape, calibration):
+    """ Returning the size to resize an image of `image_shape` to before it is 
+        transposed, and the center cropped undistortion maps of the resized 
+        and transposed image, which `regulate_image` uses.
+
+    Args:
+        image_shape: The shape of the image, `(height, width, ...)`.
+        calibration: The camera calibration data when capturing the image.
+
+    Returns:
+        `(resized_size, maps)`, `resized_size` is the `cv2.resize` size 
+            `(width, height)` and `maps` is from `get_undistort_maps`.
+    """
+    scale = min(config.UNIFIED_IMAGE_SIZE) / min(image_shape[:2])
+    resized_size = (int(image_shape[1] * scale), int(image_shape[0] * scale))
+    reference_scale = min(resized_size) / min(calibration['intrinsic_matrix_reference_dimensions'])
+    maps = get_undistort_maps(
+        np.array(calibration['lens_distortion_lookup_table']),
+        np.array(calibration['lens_distortion_center']) * reference_scale,
+        resized_size,
+        center_cropped=True
+    )
+    return resized_size, maps
+
+
+def _apply_regulation(image, resized_size, maps):
+    """ Regulate the image with the values from `_get_regulation_maps`.
+    """
+    # Resizing before transposing avoids a transposed copy of the full resolution 
+    # image, only the resized image is transposed.
+    resized_image = np.swapaxes(cv2.resize(image, resized_size), 0, 1)
+    center_cropped_image = cv2.remap(
+        resized_image, 
+        *maps, 
+        cv2.INTER_NEAREST, 
+        borderMode=cv2.BORDER_CONSTANT, 
+        borderValue=0
+    )
+    if center_cropped_image.shape[:2] == tuple(config.UNIFIED_IMAGE_SIZE):
+        return center_cropped_image
+    return cv2.resize(center_cropped_image, config.UNIFIED_IMAGE_SIZE)
+
+
 def regulate_image(image, calibration):
     """ Transpose, rectify, center crop and resize the image to a square of 
         shape `config.UNIFIED_IMAGE_SIZE`.
     
     Since PIL image and extracted depth map uses a transposed coordinate system, 
         they are supposed to be transposed back in order to match the camera 
-        intrinsics.
+        intrinsics. The image is resized before being transposed, the 
+        rectification only remaps the center cropped region, and the final 
+        resize is skipped when the crop already has the regulated size.
     Args:
         image: The image to be regulated. Represented as a numpy array with shape 
             `(height, width, channel)`.
@@ -44,59 +106,267 @@ def regulate_image(image, calibration):
         The regulated image with shape specified by `config.UNIFIED_IMAGE_SIZE`,
             the shape stands for `(width, height, channel)`.
     """
-    transposed_image = np.swapaxes(image, 0, 1)
-    image_shape = transposed_image.shape
-    scale = min(config.UNIFIED_IMAGE_SIZE) / min(image_shape[:2])
-    resized_image = cv2.resize(
-        transposed_image, 
-        (int(image_shape[1] * scale), int(image_shape[0] * scale))
+    image = np.asarray(image)
+    return _apply_regulation(image, *_get_regulation_maps(image.shape, calibration))
+
+
+def regulate_session_images(image, depth_map, calibration):
+    """ Regulate the color image and the depth map of a session, see 
+        `regulate_image`.
+
+    The color image and the depth map usually share the same aspect ratio, in 
+        which case they are resized to the same size and rectified with the 
+        same undistortion maps, which are only looked up once. The results are 
+        meant to be passed on to `recognition.get_recognition_results` and 
+        `estimation.get_area_volume`, so that neither regulates its input 
+        again.
+
+    Args:
+        image: The color image, represented as a numpy array with shape 
+            `(height, width, 3)`.
+        depth_map: The depth map, represented as a numpy array with shape 
+            `(height, width)`.
+        calibration: The camera calibration data when capturing the image.
+
+    Returns:
+        `(regulated_image, regulated_depth_map)`
+    """
+    image, depth_map = np.asarray(image), np.asarray(depth_map)
+    resized_size, maps = _get_regulation_maps(image.shape, calibration)
+    depth_scale = min(config.UNIFIED_IMAGE_SIZE) / min(depth_map.shape[:2])
+    if resized_size == (int(depth_map.shape[1] * depth_scale), int(depth_map.shape[0] * depth_scale)):
+        return _apply_regulation(image, resized_size, maps), _apply_regulation(depth_map, resized_size, maps)
+    return _apply_regulation(image, resized_size, maps), regulate_image(depth_map, calibration)
+
+
+_undistort_map_cache = collections.OrderedDict()
+_undistort_map_cache_lock = threading.Lock()
+_undistort_map_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_lens_distortion_maps(lookup_table, distortion_center, image_size):
+    """ Get the position of every point after distortion specified by 
+        `lookup_table`, vectorized over the whole image.
+
+    The mapping is the same as `get_lens_distortion_point`. Points mapped out of 
+        the image are marked as `-1`.
+
+    Args:
+        lookup_table: The lookuptable to rectify the image, represented as a one 
+            dimensional array.
+        distortion_center: The distortion center of the image, numpy array with shape 
+            `(2,)`.
+        image_size: The size of the image, `(width, height)`.
+    
+    Returns:
+        `(width_map, height_map)`, two int numpy arrays with shape `image_size`. 
+            The point `(i, j)` is mapped to `(width_map[i, j], height_map[i, j])`.
+    """
+    lookup_table = np.asarray(lookup_table, dtype=np.float64)
+    distortion_center = np.asarray(distortion_center, dtype=np.float64)
+    image_size = np.asarray(image_size)
+    radius_max = np.sqrt(np.sum(np.maximum(distortion_center, image_size - distortion_center) ** 2))
+    offset_i, offset_j = np.meshgrid(
+        np.arange(image_size[0]) - distortion_center[0],
+        np.arange(image_size[1]) - distortion_center[1],
+        indexing='ij'
     )
-    reference_scale = min(resized_image.shape[:2]) / min(calibration['intrinsic_matrix_reference_dimensions'])
-    rectified_image = rectify_image_c(
-        resized_image,
-        np.array(calibration['lens_distortion_lookup_table']),
-        np.array(calibration['lens_distortion_center']) * reference_scale
+    radius_point = np.sqrt(offset_i ** 2 + offset_j ** 2)
+    relative_position = radius_point / radius_max * (len(lookup_table) - 1)
+    lower_index = np.minimum(np.floor(relative_position), len(lookup_table) - 1).astype(np.int64)
+    upper_index = np.minimum(np.ceil(relative_position), len(lookup_table) - 1).astype(np.int64)
+    frac = relative_position - np.floor(relative_position)
+    magnification = np.where(
+        radius_point < radius_max,
+        lookup_table[lower_index] * (1.0 - frac) + lookup_table[upper_index] * frac,
+        lookup_table[-1]
     )
-    center_cropped_image = center_crop(rectified_image)
-    return cv2.resize(center_cropped_image, config.UNIFIED_IMAGE_SIZE)
+    width_map = np.trunc(distortion_center[0] + offset_i * (1.0 + magnification)).astype(np.int64)
+    height_map = np.trunc(distortion_center[1] + offset_j * (1.0 + magnification)).astype(np.int64)
+    out_of_bound = (width_map < 0) | (width_map >= image_size[0]) | (height_map < 0) | (height_map >= image_size[1])
+    width_map[out_of_bound] = -1
+    height_map[out_of_bound] = -1
+    return width_map, height_map
+
+
+def get_undistort_maps(lookup_table, distortion_center, image_size, center_cropped=False):
+    """ Get the `cv2.remap` maps for rectifying images of `image_size`.
+
+    The maps are cached in a LRU cache with at most `config.UNDISTORT_MAP_CACHE_SIZE` 
+        entries, keyed by a hash of `lookup_table`, `distortion_center`, 
+        `image_size` and `center_cropped`. The color image and depth map of a 
+        session, as well as the sessions of the same device, usually share the 
+        same maps.
+
+    Args:
+        lookup_table: The lookuptable to rectify the image, represented as a one 
+            dimensional array.
+        distortion_center: The distortion center of the image, numpy array with shape 
+            `(2,)`.
+        image_size: The size of the image, `(width, height)`.
+        center_cropped: Whether to only map the region that `center_crop` takes, 
+            so that the remapped image is the center crop of the rectified image.
+    
+    Returns:
+        `(map_1, map_2)`, the fixed point maps to pass to `cv2.remap` with 
+            `cv2.INTER_NEAREST` interpolation.
+    """
+    key_hash = hashlib.sha1()
+    key_hash.update(np.ascontiguousarray(lookup_table, dtype=np.float64).tobytes())
+    key_hash.update(np.ascontiguousarray(distortion_center, dtype=np.float64).tobytes())
+    key_hash.update(np.ascontiguousarray(image_size[:2], dtype=np.int64).tobytes())
+    key_hash.update(b'center_cropped' if center_cropped else b'')
+    key = key_hash.hexdigest()
+    with _undistort_map_cache_lock:
+        if key in _undistort_map_cache:
+            _undistort_map_cache.move_to_end(key)
+            _undistort_map_cache_stats['hits'] += 1
+            return _undistort_map_cache[key]
+        _undistort_map_cache_stats['misses'] += 1
+    width_map, height_map = get_lens_distortion_maps(lookup_table, distortion_center, image_size[:2])
+    if center_cropped:
+        crop_slices = _get_center_crop_slices(image_size)
+        width_map, height_map = width_map[crop_slices], height_map[crop_slices]
+    maps = cv2.convertMaps(
+        height_map.astype(np.float32),
+        width_map.astype(np.float32),
+        cv2.CV_16SC2,
+        nninterpolation=True
+    )
+    with _undistort_map_cache_lock:
+        _undistort_map_cache[key] = maps
+        while len(_undistort_map_cache) > config.UNDISTORT_MAP_CACHE_SIZE:
+            _undistort_map_cache.popitem(last=False)
+    return maps
+
+
+def get_undistort_map_cache_info():
+    """ Get the statistics of the undistortion map cache.
+
+    Returns:
+        A dictionary with keys `hits`, `misses`, `size` and `max_size`.
+    """
+    with _undistort_map_cache_lock:
+        return {
+            **_undistort_map_cache_stats, 
+            'size': len(_undistort_map_cache), 
+            'max_size': config.UNDISTORT_MAP_CACHE_SIZE
+        }
+
+
+def clear_undistort_map_cache():
+    """ Remove all cached undistortion maps and reset the cache statistics.
+    """
+    with _undistort_map_cache_lock:
+        _undistort_map_cache.clear()
+        _undistort_map_cache_stats['hits'] = 0
+        _undistort_map_cache_stats['misses'] = 0
 
 
-undistort_dll = ctypes.CDLL(config.UNDISTORT_DLL_PATH)
+def rectify_image_remap(image, lookup_table, distortion_center):
+    """ Get the rectified image with `cv2.remap` and cached undistortion maps.
 
+    Args:
+        image: The image to be rectified. Represented as a numpy array with shape 
+            `(width, height, channel)`.
+        lookup_table: The lookuptable to rectify the image, represented as a one 
+            dimensional array.
+        distortion_center: The distortion center of the image, numpy array with shape 
+            `(2,)`.
+    
+    Returns:
+        The rectified image as numpy array with shape `(width, height, channel)`. 
+            Pixels mapped from outside of `image` are set to 0.
+    """
+    map_1, map_2 = get_undistort_maps(lookup_table, distortion_center, image.shape[:2])
+    # `cv2.remap` drops the channel axis of single channel images.
+    return cv2.remap(
+        image, 
+        map_1, 
+        map_2, 
+        cv2.INTER_NEAREST, 
+        borderMode=cv2.BORDER_CONSTANT, 
+        borderValue=0
+    ).reshape(image.shape)
+
+
+# Serving rectifies the images with `rectify_image_remap`, so the library is only 
+# loaded when the C implementations are called.
+model_registry.registry.register(
+    'undistort_dll', 
+    lambda: ctypes.CDLL(config.UNDISTORT_DLL_PATH),
+    eager=False
+)
 
-def rectify_image_c(image, lookup_table, distortion_center):
+
+def rectify_image_c(image, lookup_table, distortion_center, thread_count=None, out=None):
     """ Get the rectified image, implemented in C.
 
+    The image is rectified in its native dtype and written by the C code into 
+        `out`, or into a newly allocated numpy array, without intermediate copies.
+
     Args:
         image: The image to be rectified. Represented as a numpy array with shape 
-            `(width, height, channel)`. The dtype is `uint_8`.
+            `(width, height, channel)`. Any fixed size dtype, such as `uint8` or 
+            `float32`, is supported.
         lookup_table: The lookuptable to rectify the image, represented as a one 
             dimensional array. The dtype is `c_double` equivalent.
         distortion_center: The distortion center of the image, numpy array with shape 
             `(2,)`. The dtype is `c_double` equivalent.
+        thread_count: The number of threads to split the rows across. Defaults to 
+            `config.UNDISTORT_THREAD_COUNT`.
+        out: The C contiguous numpy array to write the rectified image into, 
+            with the same shape and dtype as `image`, and not overlapping it. 
+            A new array is allocated if it is `None`.
     
     Returns:
-        The rectified image as numpy array with shape `(width, height, channel)`.
+        The rectified image as numpy array with shape `(width, height, channel)`, 
+            having the same dtype with `image`, which is `out` if it is given.
+
+    Raises:
+        ValueError: If `out` has another shape or dtype, is not C contiguous, or 
+            overlaps `image`.
     """
-    c_rectify_image = undistort_dll.rectify_image
-    c_rectify_image.restype = ctypes.POINTER(ctypes.c_double * functools.reduce(lambda x, y: x * y, image.shape))
-    c_free_double_pointer = undistort_dll.free_double_pointer
-    c_free_double_pointer.restype = None
+    undistort_dll = model_registry.registry.get('undistort_dll')
+    c_rectify_image_into = undistort_dll.rectify_image_into
+    c_rectify_image_into.restype = ctypes.c_int
+    c_rectify_image_into.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, 
+        ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_double), ctypes.c_int, 
+        ctypes.POINTER(ctypes.c_double), ctypes.c_int
+    ]
+    image = np.ascontiguousarray(image)
+    lookup_table = np.ascontiguousarray(lookup_table, dtype=np.float64)
+    distortion_center = np.ascontiguousarray(distortion_center, dtype=np.float64)
+    if out is None:
+        rectified_image = np.empty_like(image)
+    elif out.shape != image.shape or out.dtype != image.dtype:
+        raise ValueError('The output array of shape {} and dtype {} does not match the image of shape {} and dtype {}.'.format(
+            out.shape, out.dtype, image.shape, image.dtype
+        ))
+    elif not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError('The output array should be C contiguous and writeable.')
+    elif np.shares_memory(out, image):
+        raise ValueError('The output array should not overlap the image.')
+    else:
+        rectified_image = out
     channel = 1 if len(image.shape) < 3 else image.shape[2]
-    original_datatype = image.dtype
-    image = np.ascontiguousarray(image, dtype='double')
-    raw_result = c_rectify_image(
-        image.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+    status = c_rectify_image_into(
+        image.ctypes.data,
+        rectified_image.ctypes.data,
         image.shape[0],
         image.shape[1],
         channel,
-        (ctypes.c_double * len(lookup_table))(*lookup_table),
+        image.dtype.itemsize,
+        lookup_table.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
         len(lookup_table),
-        (ctypes.c_double * 2)(*distortion_center)
-    ).contents
-    reshaped_result = np.reshape(raw_result, image.shape).astype(original_datatype)
-    c_free_double_pointer(raw_result)
-    return reshaped_result
+        distortion_center.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+        config.UNDISTORT_THREAD_COUNT if thread_count is None else thread_count
+    )
+    if status != 0:
+        raise MemoryError('Failed to allocate memory for rectifying the image.')
+    return rectified_image
 
 
 def get_lens_distortion_point_c(point, lookup_table, distortion_center, image_size):
@@ -111,7 +381,7 @@ def get_lens_distortion_point_c(point, lookup_table, distortion_center, image_si
             `(2,)`. The dtype is `c_double` equivalent.
         image_size: The size of the image, `(width, height)`. The dtype is `int`.
     """
-    global undistort_dll
+    undistort_dll = model_registry.registry.get('undistort_dll')
     c_get_lens_distortion_point = undistort_dll.get_lens_distortion_point
     c_get_lens_distortion_point.restype = ctypes.POINTER(ctypes.c_double * 2)
     c_free_double_pointer = undistort_dll.free_double_pointer
@@ -0,0 +1,29 @@
+import fvolume
+
+import pipeline
+
+bind = '0.0.0.0:5000'
+
+timeout = 300
+
+# The worker model, which can be overridden on the command line, such as 
+# `-w 4 -k gthread --threads 8`. The job states are shared by the workers through 
+# `JOB_STORE_PATH`, so a job can be polled from any worker. Long-polling job 
+# status requests hold a thread of the worker, so threaded workers suit them best.
+workers = 2
+
+worker_class = 'gthread'
+
+threads = 4
+
+
+def post_worker_init(worker):
+    """ Load and warm up the models, and start the volume estimation
+        processes in each worker, before it accepts any request. The app is not
+        preloaded, since the thread pools of the model runtimes, and TensorFlow
+        itself, do not survive being forked from the master process.
+    """
+    fvolume.model_registry.registry.load_all(warm_up=True)
+    worker.log.info('Models loaded: {}'.format(fvolume.model_registry.registry.get_status()))
+    process_pids = pipeline.nutrition_estimation_pipeline.warm_up()
+    worker.log.info('Volume estimation processes started: {}'.format(process_pids))
@@ -0,0 +1,309 @@
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+import config
+
+
+class JobQueueFullError(Exception):
+    """ Raised when a job is submitted while the job queue is full.
+    """
+    pass
+
+
+def _is_process_alive(pid):
+    """ Whether the process `pid` of this host is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore(object):
+    """ The states and results of jobs, persisted in a SQLite database. The
+        database is shared by the worker processes, so a job can be polled from
+        any worker, not only the one running it.
+
+    The results are stored as JSON, so they should be JSON serializable.
+
+    Attributes:
+        path: The path of the database file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._get_connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, state TEXT, pid INTEGER, submitted_at REAL, '
+                'started_at REAL, finished_at REAL, result TEXT, error TEXT)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)')
+
+    def _get_connection(self):
+        """ Returning the database connection of the current thread and process.
+        """
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=5.0)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def add(self, job_id, pid):
+        """ Add a pending job run by the process `pid`.
+        """
+        with self._get_connection() as connection:
+            connection.execute(
+                'INSERT INTO jobs (job_id, state, pid, submitted_at) VALUES (?, ?, ?, ?)',
+                (job_id, 'pending', pid, time.time())
+            )
+
+    def set_running(self, job_id):
+        """ Mark a job as running.
+        """
+        with self._get_connection() as connection:
+            connection.execute(
+                'UPDATE jobs SET state = ?, started_at = ? WHERE job_id = ?',
+                ('running', time.time(), job_id)
+            )
+
+    def set_finished(self, job_id, result=None, error=None):
+        """ Mark a job as `'done'` with its `result`, or as `'failed'` with its
+            `error` if it is not `None`.
+        """
+        with self._get_connection() as connection:
+            connection.execute(
+                'UPDATE jobs SET state = ?, finished_at = ?, result = ?, error = ? WHERE job_id = ?',
+                (
+                    'done' if error is None else 'failed',
+                    time.time(),
+                    json.dumps(result) if error is None else None,
+                    error,
+                    job_id
+                )
+            )
+
+    def get(self, job_id):
+        """ Get the status of a job, `None` if it does not exist.
+        """
+        connection = self._get_connection()
+        row = connection.execute(
+            'SELECT state, submitted_at, started_at, finished_at, result, error '
+            'FROM jobs WHERE job_id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state, submitted_at, started_at, finished_at, result, error = row
+        return {
+            'job_id': job_id,
+            'state': state,
+            'submitted_at': submitted_at,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'result': json.loads(result) if result is not None else None,
+            'error': error
+        }
+
+    def fail_orphaned(self):
+        """ Mark the unfinished jobs of the processes that are no longer running
+            as failed, such as those of a restarted worker. Returning the number
+            of marked jobs.
+        """
+        connection = self._get_connection()
+        pids = [row[0] for row in connection.execute('SELECT DISTINCT pid FROM jobs WHERE finished_at IS NULL')]
+        dead_pids = [pid for pid in pids if not _is_process_alive(pid)]
+        with connection:
+            return sum(connection.execute(
+                'UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE pid = ? AND finished_at IS NULL',
+                ('failed', time.time(), 'The worker process running the job exited.', pid)
+            ).rowcount for pid in dead_pids)
+
+    def expire(self, ttl):
+        """ Delete the jobs finished more than `ttl` seconds ago, returning the
+            number of deleted jobs.
+        """
+        with self._get_connection() as connection:
+            return connection.execute(
+                'DELETE FROM jobs WHERE finished_at < ?',
+                (time.time() - ttl,)
+            ).rowcount
+
+    def count_states(self):
+        """ Returning the numbers of jobs by their states.
+        """
+        return dict(self._get_connection().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+
+class JobManager(object):
+    """ A manager that runs jobs in a bounded thread pool and keeps their
+        results for polling.
+
+    Each job gets an id once it is submitted, its status and result can then be
+        polled with `get_status`, or long-polled with `wait`. At most
+        `max_pending` jobs are queued or running at the same time in each
+        process, and the finished jobs are expired `result_ttl` seconds after
+        they are finished. The jobs run in the process that accepts them, while
+        their states and results are kept in a `JobStore` shared by all the
+        processes. The pool and the store are created lazily, and recreated in
+        forked processes.
+
+    Attributes:
+        max_workers: The maximum number of jobs running at the same time.
+        max_pending: The maximum number of jobs queued or running.
+        result_ttl: The time to keep the finished jobs, in seconds.
+        store_path: The path of the `JobStore` database.
+        poll_interval: The interval to poll the store for jobs run by other
+            processes in `wait`, in seconds.
+    """
+    def __init__(self, max_workers, max_pending, result_ttl, store_path, poll_interval=0.1):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.store_path = store_path
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._store = None
+        self._pid = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'expired': 0}
+
+    def _get_executor(self):
+        """ Returning the thread pool and the job store of this process, the
+            jobs of the parent process are dropped in forked processes. The lock
+            should be held by the caller.
+        """
+        if self._pid != os.getpid():
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='job'
+            )
+            self._store = JobStore(self.store_path)
+            self._futures = {}
+            self._pid = os.getpid()
+        return self._executor, self._store
+
+    def _clean_up(self, store):
+        """ Fail the orphaned jobs and drop the finished jobs that are older
+            than `result_ttl`, the lock should be held by the caller.
+        """
+        store.fail_orphaned()
+        self._stats['expired'] += store.expire(self.result_ttl)
+
+    def _run(self, job_id, function, args):
+        """ Run a job and record its result.
+        """
+        try:
+            self._store.set_running(job_id)
+            result = function(*args)
+            self._store.set_finished(job_id, result=result)
+            with self._lock:
+                self._stats['done'] += 1
+        except Exception as error:
+            logging.exception('Job %s failed.', job_id)
+            self._store.set_finished(job_id, error=repr(error))
+            with self._lock:
+                self._stats['failed'] += 1
+        finally:
+            with self._lock:
+                del self._futures[job_id]
+
+    def submit(self, function, *args):
+        """ Submit a job.
+
+        Args:
+            function: The function to run, which returns a JSON serializable
+                result.
+            args: The arguments of the function.
+
+        Returns:
+            The id of the job, a `str`.
+
+        Raises:
+            JobQueueFullError: If `max_pending` jobs are already queued or
+                running in this process.
+        """
+        with self._lock:
+            executor, store = self._get_executor()
+            self._clean_up(store)
+            if len(self._futures) >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise JobQueueFullError('{} jobs are pending.'.format(len(self._futures)))
+            job_id = uuid.uuid4().hex
+            store.add(job_id, os.getpid())
+            self._futures[job_id] = executor.submit(self._run, job_id, function, args)
+            self._stats['submitted'] += 1
+        return job_id
+
+    def get_status(self, job_id):
+        """ Get the status of a job.
+
+        Args:
+            job_id: The id of the job.
+
+        Returns:
+            `None` if the job does not exist or is expired, otherwise a
+                dictionary with the `job_id`, the `state` of `'pending'`,
+                `'running'`, `'done'` or `'failed'`, the `submitted_at`,
+                `started_at` and `finished_at` timestamps, and the `result` or
+                `error` of the job.
+        """
+        with self._lock:
+            _, store = self._get_executor()
+            self._clean_up(store)
+        return store.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """ Wait for a job to finish, and get its status. The jobs run by other
+            processes are polled every `poll_interval` seconds.
+
+        Args:
+            job_id: The id of the job.
+            timeout: The maximum time to wait, in seconds.
+
+        Returns:
+            The status of the job like `get_status`, which is returned when
+                `timeout` is reached even if the job is not finished.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._lock:
+            self._get_executor()
+            future = self._futures.get(job_id)
+        if future is not None:
+            concurrent.futures.wait([future], timeout=timeout)
+        status = self.get_status(job_id)
+        while status is not None and status['finished_at'] is None and time.perf_counter() < deadline:
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.perf_counter())))
+            status = self.get_status(job_id)
+        return status
+
+    def get_stats(self):
+        """ Get the statistics of the manager.
+
+        Returns:
+            A dictionary with the counts of `submitted`, `rejected`, `done`,
+                `failed` and `expired` jobs of this process, the current numbers
+                of `pending` and `running` jobs of all the processes, as well as
+                `max_pending`.
+        """
+        with self._lock:
+            _, store = self._get_executor()
+            stats = dict(self._stats)
+        states = store.count_states()
+        stats['pending'] = states.get('pending', 0)
+        stats['running'] = states.get('running', 0)
+        stats['max_pending'] = self.max_pending
+        return stats
+
+
+job_manager = JobManager(config.JOB_WORKER_COUNT, config.JOB_QUEUE_SIZE, config.JOB_RESULT_TTL, config.JOB_STORE_PATH)
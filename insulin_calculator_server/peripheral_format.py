@@ -0,0 +1,205 @@
+import json
+import math
+import struct
+import zlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The magic bytes at the beginning of a binary peripheral payload.
+BINARY_MAGIC = b'FVPD'
+
+# The version of the binary peripheral payload format.
+BINARY_VERSION = 1
+
+# The fixed size prefix of a binary peripheral payload, stands for magic bytes,
+# format version, 3 padding bytes, and the byte length of the JSON header.
+_BINARY_PREFIX = struct.Struct('<4sBxxxI')
+
+# The supported depth data types of the binary payload. All of them are little
+# endian.
+_BINARY_DTYPES = {'float16': '<f2', 'float32': '<f4'}
+
+# The maximum number of depth values of a binary payload, which bounds the memory
+# of decompressing it.
+MAX_DEPTH_DATA_SIZE = 4096 * 4096
+
+
+def is_binary_peripheral(content):
+    """ Check whether a peripheral payload is in the binary format.
+
+    Args:
+        content: The raw bytes of the peripheral payload.
+    """
+    return content[:len(BINARY_MAGIC)] == BINARY_MAGIC
+
+
+def _decompress(payload, compression, max_size):
+    """ Decompress the depth data payload.
+
+    Args:
+        payload: The compressed bytes.
+        compression: `None`, `'zlib'` or `'zstd'`.
+        max_size: The maximum size of the decompressed bytes, the payload is 
+            rejected without decompressing further once it is exceeded.
+
+    Raises:
+        ValueError: If the payload is corrupted, or larger than `max_size` once 
+            decompressed.
+    """
+    if compression is None:
+        return payload
+    elif compression == 'zlib':
+        decompressor = zlib.decompressobj()
+        try:
+            decompressed = decompressor.decompress(payload, max_size)
+        except zlib.error as error:
+            raise ValueError('Corrupted zlib depth data.') from error
+        if decompressor.unconsumed_tail or not decompressor.eof or decompressor.unused_data:
+            raise ValueError('The zlib depth data is corrupted or larger than {} bytes.'.format(max_size))
+        return decompressed
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compressed peripheral requires the `zstandard` package.')
+        try:
+            # The content size in the frame header is trusted by `decompress`, so 
+            # it is checked before any allocation.
+            if zstandard.frame_content_size(payload) > max_size:
+                raise ValueError('The zstd depth data is larger than {} bytes.'.format(max_size))
+            return zstandard.ZstdDecompressor().decompress(payload, max_output_size=max_size)
+        except zstandard.ZstdError as error:
+            raise ValueError('Corrupted zstd depth data.') from error
+    else:
+        raise ValueError('Unsupported peripheral compression: {}.'.format(compression))
+
+
+def _compress(payload, compression):
+    """ Compress the depth data payload.
+
+    Args:
+        payload: The raw bytes.
+        compression: `None`, `'zlib'` or `'zstd'`.
+    """
+    if compression is None:
+        return payload
+    elif compression == 'zlib':
+        return zlib.compress(payload)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compressed peripheral requires the `zstandard` package.')
+        return zstandard.ZstdCompressor().compress(payload)
+    else:
+        raise ValueError('Unsupported peripheral compression: {}.'.format(compression))
+
+
+def _parse_binary_peripheral(content):
+    """ Parse a binary peripheral payload.
+
+    The payload is a fixed size prefix, followed by a UTF-8 JSON header and the
+        depth data. The header holds every field of the JSON peripheral except
+        `depth_data`, plus a `depth_data_format` object with `dtype`, `shape`
+        and `compression` of the depth data.
+
+    Args:
+        content: The raw bytes of the peripheral payload.
+    """
+    if len(content) < _BINARY_PREFIX.size:
+        raise ValueError('Truncated binary peripheral.')
+    magic, version, header_len = _BINARY_PREFIX.unpack_from(content)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('Unsupported binary peripheral version: {}.'.format(version))
+    header_end = _BINARY_PREFIX.size + header_len
+    if header_end > len(content):
+        raise ValueError('Truncated binary peripheral header.')
+    peripheral = json.loads(bytes(content[_BINARY_PREFIX.size:header_end]).decode('utf8'))
+    if not isinstance(peripheral, dict):
+        raise ValueError('The binary peripheral header is not a json object.')
+    depth_format = peripheral.pop('depth_data_format', None)
+    if not isinstance(depth_format, dict) or depth_format.get('dtype') not in _BINARY_DTYPES:
+        raise ValueError('Missing or unsupported depth data format.')
+    shape = depth_format.get('shape')
+    if not isinstance(shape, list) or len(shape) != 2 or not all(
+        isinstance(length, int) and not isinstance(length, bool) and length >= 0 for length in shape
+    ):
+        raise ValueError('Invalid depth data shape: {}.'.format(shape))
+    size = math.prod(shape)
+    if size > MAX_DEPTH_DATA_SIZE:
+        raise ValueError('The depth data of shape {} has more than {} values.'.format(shape, MAX_DEPTH_DATA_SIZE))
+    dtype = np.dtype(_BINARY_DTYPES[depth_format['dtype']])
+    payload = _decompress(memoryview(content)[header_end:], depth_format.get('compression'), size * dtype.itemsize)
+    if len(payload) != size * dtype.itemsize:
+        raise ValueError('Depth data does not match shape {}.'.format(shape))
+    peripheral['depth_data'] = np.frombuffer(payload, dtype=dtype).reshape(shape).astype(np.float32)
+    return peripheral
+
+
+def parse_peripheral(content):
+    """ Parse a peripheral payload submitted by the client, either in the
+        legacy JSON format or the binary format.
+
+    Args:
+        content: The raw bytes of the peripheral payload.
+
+    Returns:
+        The peripheral data as a json object, with `depth_data` converted to a
+            `float32` numpy array.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if is_binary_peripheral(content):
+        return _parse_binary_peripheral(content)
+    peripheral = json.loads(bytes(content).decode('utf8'))
+    if not isinstance(peripheral, dict) or 'depth_data' not in peripheral:
+        raise ValueError('Depth data not found in peripheral.')
+    try:
+        depth_data = np.array(peripheral['depth_data'], dtype=np.float32)
+    except TypeError as error:
+        raise ValueError('Invalid depth data: {}.'.format(error)) from error
+    if depth_data.ndim != 2:
+        raise ValueError('The depth data has {} dimensions instead of 2.'.format(depth_data.ndim))
+    if depth_data.size > MAX_DEPTH_DATA_SIZE:
+        raise ValueError('The depth data has more than {} values.'.format(MAX_DEPTH_DATA_SIZE))
+    peripheral['depth_data'] = depth_data
+    return peripheral
+
+
+def encode_binary_peripheral(peripheral, dtype='float16', compression='zlib'):
+    """ Encode a peripheral json object to the binary format.
+
+    Args:
+        peripheral: The peripheral data as a json object, `depth_data` is either
+            a nested list or a numpy array.
+        dtype: The depth data type, `'float16'` or `'float32'`.
+        compression: `None`, `'zlib'` or `'zstd'`.
+
+    Returns:
+        The encoded bytes.
+    """
+    depth_data = np.asarray(peripheral['depth_data'], dtype=_BINARY_DTYPES[dtype])
+    header = {key: value for key, value in peripheral.items() if key != 'depth_data'}
+    header['depth_data_format'] = {
+        'dtype': dtype,
+        'shape': list(depth_data.shape),
+        'compression': compression
+    }
+    header_bytes = json.dumps(header).encode('utf8')
+    return b''.join([
+        _BINARY_PREFIX.pack(BINARY_MAGIC, BINARY_VERSION, len(header_bytes)),
+        header_bytes,
+        _compress(depth_data.tobytes(), compression)
+    ])
+
+
+def load_peripheral_file(path):
+    """ Load a stored peripheral file in either format.
+
+    Args:
+        path: The path of the peripheral file.
+    """
+    with open(path, 'rb') as in_file:
+        return parse_peripheral(in_file.read())
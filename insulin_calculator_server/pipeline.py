@@ -0,0 +1,304 @@
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+
+import fvolume
+import fdensitylib
+
+import config
+
+
+class PipelineMetrics(object):
+    """ The aggregated wall time of the pipeline stages.
+
+    Attributes:
+        window: The number of the most recent runs to compute the percentiles on.
+    """
+    def __init__(self, window=1024):
+        self.window = window
+        self._durations = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        """ Record the stage timings of a pipeline run.
+
+        Args:
+            timings: A dictionary from stage names to wall times in seconds.
+        """
+        with self._lock:
+            for stage, duration in timings.items():
+                self._durations[stage].append(duration)
+                self._counts[stage] += 1
+
+    def get_stats(self):
+        """ Get the statistics of the stage timings.
+
+        Returns:
+            A dictionary from stage names to the `count` of runs, and the `mean`,
+                `p50`, `p95`, `p99` and `max` wall time in milliseconds.
+        """
+        with self._lock:
+            durations = {stage: np.array(values) * 1000.0 for stage, values in self._durations.items()}
+            counts = dict(self._counts)
+        return {
+            stage: {
+                'count': counts[stage],
+                'mean': float(np.mean(values)),
+                **{
+                    name: float(np.percentile(values, percentile))
+                    for name, percentile in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+                }
+            } for stage, values in durations.items() if len(values) > 0
+        }
+
+
+def format_server_timing(timings):
+    """ Format the stage timings as the value of a `Server-Timing` header.
+
+    Args:
+        timings: A dictionary from stage names to wall times in seconds.
+    """
+    return ', '.join('{};dur={:.1f}'.format(stage, duration * 1000.0) for stage, duration in timings.items())
+
+
+class NutritionEstimationPipeline(object):
+    """ The pipeline that estimates the nutrition of a recognition session.
+
+    The stages are regulation, recognition, classification, volume estimation
+        and density lookup. The color image and the depth map are regulated
+        once, and shared by the later stages. Classification is network bound, so it runs on a background
+        thread while the volume is estimated.
+
+    The CPU bound volume estimation runs in a pool of `process_count`
+        processes, so that it neither holds the GIL of the serving process nor
+        competes with the other requests for it. The processes are started by a
+        fork server, which keeps them clear of the threads of the serving
+        process. The pool is replaced when one of its processes dies. The
+        processes are started on the first request, or ahead of it by
+        `warm_up`.
+
+    Attributes:
+        metrics: The `PipelineMetrics` that the stage timings are recorded to.
+        process_count: The number of volume estimation processes, the volume is
+            estimated in the calling thread if it is `0`.
+    """
+    def __init__(self, metrics=None, process_count=0):
+        self.metrics = PipelineMetrics() if metrics is None else metrics
+        self.process_count = process_count
+        self._executor = None
+        self._process_pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """ Returning the thread pool for the overlapped stages, recreated in
+            forked processes.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+                self._process_pool = None
+                self._pid = os.getpid()
+            return self._executor
+
+    def _get_process_pool(self):
+        """ Returning the volume estimation process pool, recreated in forked
+            processes. `None` if `process_count` is `0`.
+        """
+        self._get_executor()
+        with self._lock:
+            if self._process_pool is None and self.process_count > 0:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['fvolume'])
+                self._process_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.process_count,
+                    mp_context=context
+                )
+            return self._process_pool
+
+    def _discard_process_pool(self, process_pool):
+        """ Drop a broken process pool, so that `_get_process_pool` creates a new
+            one. Nothing is done if the pool is already replaced.
+        """
+        with self._lock:
+            if self._process_pool is not process_pool:
+                return
+            self._process_pool = None
+        process_pool.shutdown(wait=False)
+
+    def _run_in_process_pool(self, function, *args):
+        """ Run `function` in the process pool, or in the calling thread if there
+            is none. A pool is broken once any of its processes dies, such as
+            being killed for memory, then the pool is replaced and the call is
+            retried once.
+        """
+        for attempt in range(2):
+            process_pool = self._get_process_pool()
+            if process_pool is None:
+                return function(*args)
+            try:
+                return process_pool.submit(function, *args).result()
+            except concurrent.futures.process.BrokenProcessPool:
+                self._discard_process_pool(process_pool)
+                if attempt > 0:
+                    raise
+
+    def _estimate_area_volume(self, regulated_depth_map, calibration, attitude, label_mask):
+        """ Run `fvolume.estimation.get_area_volume` on the regulated depth map,
+            in the process pool if there is one.
+        """
+        return self._run_in_process_pool(
+            fvolume.estimation.get_area_volume,
+            None, calibration, attitude, label_mask, regulated_depth_map
+        )
+
+    def warm_up(self):
+        """ Start the fork server and the volume estimation processes of this
+            process, which otherwise start on the first request. Nothing is
+            done if `process_count` is `0`.
+
+        Returns:
+            The pids of the volume estimation processes.
+        """
+        process_pool = self._get_process_pool()
+        if process_pool is not None:
+            # The processes are started on demand, one for each task submitted
+            # while none of them is idle.
+            futures = [process_pool.submit(os.getpid) for _ in range(self.process_count)]
+            concurrent.futures.wait(futures)
+        return self.get_process_pids()
+
+    def get_process_pids(self):
+        """ Returning the pids of the running volume estimation processes of this
+            process.
+        """
+        with self._lock:
+            if self._pid != os.getpid() or self._process_pool is None:
+                return []
+            return sorted(self._process_pool._processes or {})
+
+    def shutdown(self):
+        """ Shut down the thread pool and the process pool of this process,
+            they are recreated on the next use.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                self._executor.shutdown()
+                if self._process_pool is not None:
+                    self._process_pool.shutdown()
+            self._executor = None
+            self._process_pool = None
+            self._pid = None
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _timed(timings, stage):
+        """ A context that records the wall time of `stage` to `timings`.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[stage] = time.perf_counter() - start_time
+
+    def _classify(self, buffers, timings):
+        """ Run the classification stage, recording its wall time to `timings`.
+        """
+        with self._timed(timings, 'classification'):
+            return fvolume.classification.get_classification_result(buffers)
+
+    def estimate(self, image, peripheral):
+        """ Estimate the nutrition related results of a session.
+
+        Args:
+            image: The color image, represented as a numpy array.
+            peripheral: The peripheral data as a json object, with `depth_data`,
+                `calibration_data` and `device_attitude`.
+
+        Returns:
+            `(results, timings)`
+            `results` is a list of the recognized food entities, each entity is a
+                json object with `bounding_box`, `area`, `volume` and `candidates`.
+                `bounding_box` stands for `(origin_x, origin_y, width, height)`,
+                relative to the edge length of the image. Entities not
+                classified as food are not included.
+            `timings` is a dictionary from stage names to wall times in seconds.
+        """
+        timings = collections.OrderedDict()
+        calibration = peripheral['calibration_data']
+        start_time = time.perf_counter()
+        with fvolume.recognition.expecting_segmentation():
+            with self._timed(timings, 'regulation'):
+                regulated_image, regulated_depth_map = fvolume.utils.regulate_session_images(
+                    image,
+                    peripheral['depth_data'],
+                    calibration
+                )
+            with self._timed(timings, 'recognition'):
+                label_mask, boxes, buffers = fvolume.recognition.get_recognition_results(
+                    image,
+                    calibration,
+                    regulated_image=regulated_image
+                )
+        classification_future = self._get_executor().submit(self._classify, buffers, timings)
+        with self._timed(timings, 'estimation'):
+            area_volumes = self._estimate_area_volume(
+                regulated_depth_map,
+                calibration,
+                peripheral.get('device_attitude'),
+                label_mask
+            )
+        classifications = classification_future.result()
+        with self._timed(timings, 'density'):
+            results = []
+            for box, (area, volume), candidates in zip(boxes, area_volumes, classifications):
+                if candidates is None:
+                    continue
+                results.append({
+                    'bounding_box': [box[0], box[2], box[1] - box[0], box[3] - box[2]],
+                    'area': area,
+                    'volume': volume,
+                    'candidates': [self._get_candidate(item) for item in candidates]
+                })
+        timings['total'] = time.perf_counter() - start_time
+        self.metrics.record(timings)
+        return results, timings
+
+    @staticmethod
+    def _get_candidate(item):
+        """ Returning a classification candidate with its densities attached.
+
+        Args:
+            item: A classification candidate from the classifier.
+        """
+        area_density, volume_density = fdensitylib.density.get_density(item)
+        return {**item, 'area_density': float(area_density), 'volume_density': float(volume_density)}
+
+    def run(self, session_data_manager):
+        """ Estimate a session and persist the result.
+
+        Args:
+            session_data_manager: The `SessionDataManager` of the session, with
+                its image and peripheral data registered.
+
+        Returns:
+            `(response, timings)`
+            `response` is the result json string, which is also saved by
+                `session_data_manager.save_recognition_file`.
+            `timings` is a dictionary from stage names to wall times in seconds.
+        """
+        results, timings = self.estimate(session_data_manager.image, session_data_manager.peripheral)
+        response = json.dumps({'results': results})
+        session_data_manager.save_recognition_file(response)
+        return response, timings
+
+
+nutrition_estimation_pipeline = NutritionEstimationPipeline(process_count=config.ESTIMATION_PROCESS_COUNT)
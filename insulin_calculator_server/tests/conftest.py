@@ -0,0 +1,135 @@
+import http.server
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pytest
+
+SERVER_ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, SERVER_ROOT_PATH)
+
+# `fvolume.classification` imports the deployment specific `config_secure`, the
+# example configuration is used in its place when it is not deployed.
+if not os.path.exists(os.path.join(SERVER_ROOT_PATH, 'fvolume', 'config_secure.py')):
+    spec = importlib.util.spec_from_file_location(
+        'fvolume.config_secure',
+        os.path.join(SERVER_ROOT_PATH, 'fvolume', 'config_secure.example.py')
+    )
+    sys.modules['fvolume.config_secure'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['fvolume.config_secure'])
+
+
+CLASSIFICATION_RESPONSE = {
+    'is_food': True,
+    'results': [{'items': [{'group': 'Bread', 'name': 'Bagel', 'score': 0.2}, {'group': 'Bread', 'name': 'Donut', 'score': 0.7}]}]
+}
+
+
+class StubClassifierHandler(http.server.BaseHTTPRequestHandler):
+    """ A local classifier which fails the first `failures` requests with
+        `failure_status`, and waits `delay` seconds before answering.
+    """
+    failures = 0
+    failure_status = 503
+    delay = 0.0
+    request_count = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.lock:
+            type(self).request_count += 1
+            failed = type(self).request_count <= self.failures
+        time.sleep(self.delay)
+        content = b'{}' if failed else json.dumps(CLASSIFICATION_RESPONSE).encode('utf8')
+        try:
+            self.send_response(self.failure_status if failed else 200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_classifier(monkeypatch):
+    """ Start a stub classifier as the default classifier, and reset the
+        classifier client and cache so that every request reaches it.
+    """
+    from fvolume import classification
+    from fvolume import config
+    from fvolume import config_secure
+    monkeypatch.setattr(config, 'CLASSIFICATION_CACHE_BACKEND', None)
+    monkeypatch.setattr(classification, '_classification_cache', None)
+    monkeypatch.setattr(classification, '_classifier_pid', None)
+    handler = type('Handler', (StubClassifierHandler,), {})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    monkeypatch.setattr(config_secure, 'CLASSIFIER_URL', url)
+    yield handler, url
+    server.shutdown()
+    server.server_close()
+
+
+class StubSegmentationModel(object):
+    """ A segmentation model which marks the same `food_regions` as food in
+        every image, each region is a pair of row and column slices of the
+        model input, which has the rows and columns of the color image.
+    """
+    food_regions = [(slice(180, 330), slice(200, 370)), (slice(40, 100), slice(420, 490))]
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, images):
+        from fvolume import config
+        assert images.shape[1:] == (*config.UNIFIED_IMAGE_SIZE, 3)
+        assert images.dtype == np.float32
+        self.batch_sizes.append(len(images))
+        masks = np.zeros((len(images), *config.UNIFIED_IMAGE_SIZE, 1), dtype=np.float32)
+        for rows, columns in self.food_regions:
+            masks[:, rows, columns] = 1.0
+        return masks
+
+
+@pytest.fixture
+def stub_segmentation_model(monkeypatch):
+    """ Serve `StubSegmentationModel` as the segmentation model.
+    """
+    from fvolume import model_registry
+    model = StubSegmentationModel()
+    monkeypatch.setitem(model_registry.registry._entries, 'segmentation_model', model)
+    yield model
+
+
+@pytest.fixture
+def session_inputs():
+    """ A color image in the PIL layout `(height, width, 3)`, and its
+        peripheral data with a lower resolution depth map of a tilted table and
+        a box on it, which is under the first food region of
+        `StubSegmentationModel`.
+    """
+    rng = np.random.default_rng(0)
+    image = (rng.random((600, 800, 3)) * 255).astype(np.uint8)
+    rows, columns = np.mgrid[0:96, 0:128]
+    depth_map = 0.5 + 1e-4 * rows + 2e-4 * columns + rng.normal(0.0, 1e-4, (96, 128))
+    depth_map[30:66, 50:90] -= 0.03
+    peripheral = {
+        'calibration_data': {
+            'intrinsic_matrix': [[120.0, 0.0, 0.0], [0.0, 120.0, 0.0], [64.0, 48.0, 1.0]],
+            'intrinsic_matrix_reference_dimensions': [128, 96],
+            'lens_distortion_lookup_table': list(np.linspace(0.0, 0.01, 42)),
+            'lens_distortion_center': [64.0, 48.0]
+        },
+        'device_attitude': [0.0, 0.0, 0.0],
+        'depth_data': depth_map.astype(np.float32)
+    }
+    return image, peripheral
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import re
+import pytest
+from PIL import Image
+
+import fvolume
+import app
+import config
+import data_manager
+import peripheral_format
+import pipeline
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """ A test client of the app, which archives the sessions to `tmp_path` and
+        estimates the volume in the serving process.
+    """
+    monkeypatch.setattr(config, 'RECOGNITION_STORAGE_DIR', str(tmp_path))
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=0)
+    monkeypatch.setattr(pipeline, 'nutrition_estimation_pipeline', estimation_pipeline)
+    yield app.application.test_client()
+    data_manager.archive_writer.flush()
+    estimation_pipeline.shutdown()
+
+
+def make_form(image, peripheral):
+    image_buffer = io.BytesIO()
+    Image.fromarray(image).save(image_buffer, format='JPEG', quality=95)
+    return {
+        'session_id': 'session',
+        'token': 'token',
+        'image': (io.BytesIO(image_buffer.getvalue()), 'image.jpg'),
+        'peripheral': (io.BytesIO(peripheral_format.encode_binary_peripheral(peripheral)), 'peripheral.bin')
+    }
+
+
+def test_nutrition_estimation(client, stub_segmentation_model, stub_classifier, session_inputs, tmp_path):
+    response = client.post('/nutritionestimation', data=make_form(*session_inputs))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    results = response.get_json()['results']
+    edge_length = fvolume.config.UNIFIED_IMAGE_SIZE[0]
+    assert [result['bounding_box'] for result in results] == [
+        [columns.start / edge_length, rows.start / edge_length, (columns.stop - columns.start) / edge_length, (rows.stop - rows.start) / edge_length]
+        for rows, columns in stub_segmentation_model.food_regions
+    ]
+    assert all(
+        set(result) == {'bounding_box', 'area', 'volume', 'candidates'} and result['candidates'][0]['name'] == 'Donut'
+        for result in results
+    )
+    stages = re.findall(r'(\w+);dur=(\d+\.\d)(?:, |$)', response.headers['Server-Timing'])
+    assert [stage for stage, _ in stages] == ['regulation', 'recognition', 'classification', 'estimation', 'density', 'total']
+    assert ', '.join('{};dur={}'.format(*stage) for stage in stages) == response.headers['Server-Timing']
+    data_manager.archive_writer.flush()
+    session_dirs = data_manager.find_session_dirs(str(tmp_path), required_file_names=('image.jpg', 'recognition.json'))
+    assert len(session_dirs) == 1
+    with open(os.path.join(session_dirs[0], 'recognition.json')) as recognition_file:
+        assert json.load(recognition_file) == {'results': results}
+
+
+def test_nutrition_estimation_rejects_malformed_peripheral(client, session_inputs):
+    form = make_form(*session_inputs)
+    form['peripheral'] = (io.BytesIO(b'{"depth_data": null}'), 'peripheral.json')
+    assert client.post('/nutritionestimation', data=form).status_code == 400
+
+
+def test_rejected_peripheral_archives_nothing(client, session_inputs, tmp_path):
+    form = make_form(*session_inputs)
+    form['peripheral'] = (io.BytesIO(b'{}'), 'peripheral.json')
+    assert client.post('/nutritionestimation', data=form).status_code == 400
+    data_manager.archive_writer.flush()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,84 @@
+import threading
+import time
+import numpy as np
+import pytest
+
+from fvolume import batching
+
+
+def test_lone_item_is_not_delayed():
+    scheduler = batching.BatchScheduler(lambda items: items * 2, max_batch_size=8, max_wait_ms=2000)
+    start_time = time.perf_counter()
+    assert scheduler.submit(np.array(3)).result(timeout=5) == 6
+    assert time.perf_counter() - start_time < 1.0
+    assert scheduler.get_stats()['batch_size_histogram'] == {1: 1}
+
+
+def test_queued_items_are_batched():
+    predict_started, release = threading.Event(), threading.Event()
+    def predict(items):
+        predict_started.set()
+        release.wait(5)
+        return items * 2
+    scheduler = batching.BatchScheduler(predict, max_batch_size=4, max_wait_ms=50)
+    # The items queued while the first batch runs are gathered into batches.
+    first_future = scheduler.submit(np.array(0))
+    assert predict_started.wait(5)
+    futures = [scheduler.submit(np.array(value)) for value in range(1, 7)]
+    release.set()
+    assert first_future.result(timeout=5) == 0
+    assert [future.result(timeout=5) for future in futures] == [2, 4, 6, 8, 10, 12]
+    assert scheduler.get_stats()['batch_size_histogram'] == {1: 1, 2: 1, 4: 1}
+
+
+def test_expected_item_joins_the_batch():
+    scheduler = batching.BatchScheduler(lambda items: items * 2, max_batch_size=8, max_wait_ms=2000)
+    entered, submitted = threading.Event(), threading.Event()
+    def submit_later(futures):
+        with scheduler.expecting():
+            entered.set()
+            submitted.wait(5)
+            time.sleep(0.05)
+            futures.append(scheduler.submit(np.array(2)))
+    futures = []
+    thread = threading.Thread(target=submit_later, args=(futures,))
+    thread.start()
+    assert entered.wait(5)
+    # The first item waits for the item expected within the wait window.
+    first_future = scheduler.submit(np.array(1))
+    submitted.set()
+    thread.join(5)
+    assert first_future.result(timeout=5) == 2
+    assert futures[0].result(timeout=5) == 4
+    assert scheduler.get_stats()['batch_size_histogram'] == {2: 1}
+
+
+def test_expected_item_is_waited_at_most_max_wait():
+    scheduler = batching.BatchScheduler(lambda items: items * 2, max_batch_size=8, max_wait_ms=100)
+    entered, leave = threading.Event(), threading.Event()
+    def expect_without_submitting():
+        with scheduler.expecting():
+            entered.set()
+            leave.wait(5)
+    thread = threading.Thread(target=expect_without_submitting)
+    thread.start()
+    assert entered.wait(5)
+    start_time = time.perf_counter()
+    assert scheduler.submit(np.array(1)).result(timeout=5) == 2
+    assert 0.09 < time.perf_counter() - start_time < 1.0
+    leave.set()
+    thread.join(5)
+    # Nothing is expected any more, so a lone item runs right away.
+    start_time = time.perf_counter()
+    assert scheduler.submit(np.array(1)).result(timeout=5) == 2
+    assert time.perf_counter() - start_time < 0.09
+
+
+@pytest.mark.parametrize('predict', [lambda items: items[:-1], lambda items: items.repeat(2)])
+def test_mismatched_results_fail_the_batch(predict):
+    scheduler = batching.BatchScheduler(predict, max_batch_size=2, max_wait_ms=50)
+    futures = [scheduler.submit(np.array(value)) for value in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    assert scheduler.get_stats()['failed_batches'] >= 2
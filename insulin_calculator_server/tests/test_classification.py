@@ -0,0 +1,43 @@
+import io
+import time
+import pytest
+import requests
+
+from fvolume import classification
+from fvolume import config
+
+
+def test_classification_result(stub_classifier):
+    handler, url = stub_classifier
+    results = classification.get_classification_result([io.BytesIO(b'a'), io.BytesIO(b'b')], url)
+    assert handler.request_count == 2
+    assert [[item['name'] for item in result] for result in results] == [['Donut', 'Bagel']] * 2
+
+
+@pytest.mark.parametrize('status', [502, 503, 504])
+def test_classifier_gateway_errors_are_retried(stub_classifier, status):
+    handler, url = stub_classifier
+    handler.failures, handler.failure_status = config.CLASSIFIER_MAX_RETRIES, status
+    results = classification.get_classification_result([io.BytesIO(b'a')], url)
+    assert handler.request_count == config.CLASSIFIER_MAX_RETRIES + 1
+    assert results[0][0]['name'] == 'Donut'
+
+
+def test_classifier_gives_up_after_max_retries(stub_classifier):
+    handler, url = stub_classifier
+    handler.failures = config.CLASSIFIER_MAX_RETRIES + 1
+    # The last failed response is handed back as it is, after all the retries.
+    responses = classification._get_raw_classification_result([io.BytesIO(b'a')], url)
+    assert handler.request_count == config.CLASSIFIER_MAX_RETRIES + 1
+    assert responses == [b'{}']
+
+
+def test_classifier_read_timeout(stub_classifier, monkeypatch):
+    handler, url = stub_classifier
+    handler.delay = 1.0
+    monkeypatch.setattr(config, 'CLASSIFIER_TIMEOUT', (1.0, 0.2))
+    start_time = time.perf_counter()
+    with pytest.raises(requests.exceptions.RequestException):
+        classification.get_classification_result([io.BytesIO(b'a')], url)
+    # Each attempt is cut at the read timeout, instead of waiting for the answer.
+    assert time.perf_counter() - start_time < handler.delay * (config.CLASSIFIER_MAX_RETRIES + 1)
@@ -0,0 +1,38 @@
+import datetime
+import os
+import threading
+import types
+
+import data_manager
+
+
+def test_archive_writer_survives_failed_writes(tmp_path):
+    writer = data_manager.ArchiveWriter(max_queue_size=2)
+    writer.submit(str(tmp_path / 'a' / 'text.txt'), 'text')
+    # Unsupported content, and a path under a regular file.
+    writer.submit(str(tmp_path / 'a' / 'number.txt'), 1)
+    writer.submit(str(tmp_path / 'a' / 'text.txt' / 'nested.bin'), b'bytes')
+    for index in range(4):
+        writer.submit(str(tmp_path / 'b' / '{}.bin'.format(index)), b'bytes')
+    flush_thread = threading.Thread(target=writer.flush, daemon=True)
+    flush_thread.start()
+    flush_thread.join(timeout=10)
+    assert not flush_thread.is_alive()
+    stats = writer.get_stats()
+    assert stats['submitted'] == 7
+    assert stats['written'] == 5
+    assert stats['failed'] == 2
+    assert sorted(os.listdir(tmp_path / 'b')) == ['0.bin', '1.bin', '2.bin', '3.bin']
+
+
+def test_session_dirs_are_reserved_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_manager.config, 'RECOGNITION_STORAGE_DIR', str(tmp_path))
+    now = datetime.datetime(2024, 5, 6, 7, 8, 9)
+    monkeypatch.setattr(data_manager, 'datetime', types.SimpleNamespace(datetime=types.SimpleNamespace(now=lambda: now)))
+    managers = [data_manager.SessionDataManager('session') for _ in range(3)]
+    assert os.listdir(tmp_path) == []
+    session_dir = str(tmp_path / '2024_5' / '6' / '7_8_9_session')
+    # Sessions with the same id in the same second get suffixes.
+    assert [manager.session_dir for manager in managers] == [session_dir, session_dir + '_1', session_dir + '_2']
+    assert managers[0].session_dir == session_dir
+    assert sorted(os.listdir(os.path.dirname(session_dir))) == ['7_8_9_session', '7_8_9_session_1', '7_8_9_session_2']
@@ -0,0 +1,42 @@
+import pytest
+
+from fdensitylib import config
+from fdensitylib import library
+
+WORDS = ['plain', 'glazed', 'chocolate', 'fried', 'beef', 'chicken', 'rice', 'noodle', 'soup', 'cake']
+
+
+def make_library():
+    entries = [('Bread', 'Bagel', 0.0, 100.0), ('Bread', 'Plain Donut', 0.0, 200.0), ('Soup', 'Tomato Soup', 0.0, 300.0)]
+    # Many names sharing the words of the queries, none of them similar to them.
+    entries += [
+        ('Filler', '{} {} {}'.format(WORDS[index % 10], WORDS[index // 10 % 10], index), 0.0, 1.0)
+        for index in range(2000)
+    ]
+    return library.DensityLibrary(entries)
+
+
+@pytest.mark.parametrize('max_candidates', [None, 256, 8])
+def test_fuzzy_match(monkeypatch, max_candidates):
+    monkeypatch.setattr(config, 'FUZZY_MATCH_MAX_CANDIDATES', max_candidates)
+    density_library = make_library()
+    assert density_library.get_density('Bread', 'Bagel') == (0.0, 100.0)
+    assert density_library.get_density('Bread', 'Plain  Donuts') == (0.0, 200.0)
+    # A fuzzy match of another group takes precedence over the group fallback.
+    assert density_library.get_density('Bread', 'Tomato Soups') == (0.0, 300.0)
+    assert density_library.get_density('Bread', 'Unknown Food') == (0.0, 100.0)
+    assert density_library.get_density('Unknown Group', 'Unknown Food') == (0.0, 0.0)
+
+
+def test_fuzzy_match_compares_at_most_max_candidates(monkeypatch):
+    monkeypatch.setattr(config, 'FUZZY_MATCH_MAX_CANDIDATES', 16)
+    compared_counts = []
+    get_close_matches = library.difflib.get_close_matches
+    def count_close_matches(word, possibilities, *args, **kwargs):
+        possibilities = list(possibilities)
+        compared_counts.append(len(possibilities))
+        return get_close_matches(word, possibilities, *args, **kwargs)
+    monkeypatch.setattr(library.difflib, 'get_close_matches', count_close_matches)
+    density_library = make_library()
+    assert density_library.get_density('Filler', 'Plain Beef Chocolate Soup') == (0.0, 1.0)
+    assert compared_counts == [16, 16]
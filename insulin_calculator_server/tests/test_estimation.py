@@ -0,0 +1,313 @@
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+from fvolume import estimation
+from fvolume import utils
+
+
+def get_xoy_grid_lookup(point_cloud, grid_len):
+    """ The dictionary grid lookup that `estimation` used before binning all the
+        point clouds at once, kept as the reference implementation.
+    """
+    xoy_grid_lookup = {}
+    x_min, y_min = np.min(point_cloud[:,0]), np.min(point_cloud[:,1])
+    for point in point_cloud:
+        x_index = utils.get_relative_index(point[0], x_min, grid_len)
+        y_index = utils.get_relative_index(point[1], y_min, grid_len)
+        if x_index not in xoy_grid_lookup:
+            xoy_grid_lookup[x_index] = {}
+        if y_index not in xoy_grid_lookup[x_index]:
+            xoy_grid_lookup[x_index][y_index] = []
+        xoy_grid_lookup[x_index][y_index].append(point)
+    return xoy_grid_lookup
+
+
+def get_reference_area_volume(point_cloud, background_depth, grid_len):
+    """ The area and volume integration over `get_xoy_grid_lookup`, the same as
+        the previous per-point loop of `estimation.get_area_volume`.
+    """
+    lookup = get_xoy_grid_lookup(point_cloud, grid_len)
+    return (
+        sum([sum([
+            grid_len ** 2 for y_value in x_value.values()
+        ]) for x_value in lookup.values()]),
+        sum([sum([
+            (np.mean(background_depth - np.array(y_value), axis=0)[2]) * grid_len ** 2 for y_value in x_value.values()
+        ]) for x_value in lookup.values()])
+    )
+
+
+def make_point_cloud(rng, count, center):
+    """ Make a random food point cloud above a background at depth `0.5`.
+    """
+    return np.column_stack([
+        center[0] + rng.normal(0.0, 0.02, count),
+        center[1] + rng.normal(0.0, 0.02, count),
+        0.5 - rng.uniform(0.0, 0.05, count)
+    ])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_xoy_grid_area_volume_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    point_clouds = [
+        make_point_cloud(rng, count, rng.uniform(-0.2, 0.2, 2))
+        for count in rng.integers(1, 3000, size=rng.integers(1, 6))
+    ]
+    area_volumes = estimation._get_xoy_grid_area_volume(point_clouds, 0.5, 2e-3)
+    assert len(area_volumes) == len(point_clouds)
+    for point_cloud, (area, volume) in zip(point_clouds, area_volumes):
+        reference_area, reference_volume = get_reference_area_volume(point_cloud, 0.5, 2e-3)
+        assert area == pytest.approx(reference_area, rel=1e-12)
+        assert volume == pytest.approx(reference_volume, rel=1e-9)
+
+
+def test_xoy_grid_area_volume_of_empty_clouds():
+    rng = np.random.default_rng(0)
+    point_cloud = make_point_cloud(rng, 500, (0.0, 0.0))
+    area_volumes = estimation._get_xoy_grid_area_volume([np.empty((0, 3)), point_cloud, np.empty((0, 3))], 0.5, 2e-3)
+    assert area_volumes[0] == (0.0, 0.0)
+    assert area_volumes[2] == (0.0, 0.0)
+    assert area_volumes[1] == pytest.approx(get_reference_area_volume(point_cloud, 0.5, 2e-3))
+    assert estimation._get_xoy_grid_area_volume([np.empty((0, 3))], 0.5, 2e-3) == [(0.0, 0.0)]
+    assert estimation._get_xoy_grid_area_volume([], 0.5, 2e-3) == []
+
+
+def filter_interpolation_points(point_cloud, distance, count):
+    """ The per-point interpolation point filter over `get_xoy_grid_lookup`
+        that `estimation` used before counting the neighbors with a KD-tree,
+        kept as the reference implementation.
+    """
+    filtered_point_cloud = np.zeros(point_cloud.shape)
+    filtered_count = 0
+    point_x_min, point_y_min = np.min(point_cloud[:,0]), np.min(point_cloud[:,1])
+    grid_lookup = get_xoy_grid_lookup(point_cloud, distance)
+    def get_possible_points(lookup, center_coordinate):
+        c = center_coordinate
+        possible_coordinates = [
+            (c[0] - 1, c[1] - 1), (c[0], c[1] - 1), (c[0] + 1, c[1] - 1),
+            (c[0] - 1, c[1]), c, (c[0] + 1, c[1]),
+            (c[0] - 1, c[1] + 1), (c[0], c[1] + 1), (c[0] + 1, c[1] + 1)
+        ]
+        possible_coordinates = filter(lambda x: x[0] >= 0 and x[1] >= 0, possible_coordinates)
+        points = []
+        for coordinate in possible_coordinates:
+            if coordinate[0] in lookup and coordinate[1] in lookup[coordinate[0]]:
+                points += lookup[coordinate[0]][coordinate[1]]
+        return np.array(points)
+    for point in point_cloud:
+        possible_close_points = get_possible_points(
+            grid_lookup, (
+                utils.get_relative_index(point[0], point_x_min, distance),
+                utils.get_relative_index(point[1], point_y_min, distance)
+            )
+        )
+        distance_squares = np.sum(np.square(possible_close_points - point), axis=1)
+        close_points_count = len(np.where(distance_squares < distance ** 2)[0])
+        if close_points_count > count:
+            filtered_point_cloud[filtered_count] = point
+            filtered_count += 1
+    return filtered_point_cloud[:filtered_count]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_filter_interpolation_points_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    # A dense surface with sparse points in between, like the interpolated depths
+    # on the edges of the food.
+    surface_x, surface_y = np.meshgrid(np.arange(60) * 5e-4, np.arange(60) * 5e-4)
+    point_cloud = np.concatenate([
+        np.column_stack([surface_x.ravel(), surface_y.ravel(), 0.48 + rng.normal(0.0, 2e-4, surface_x.size)]),
+        make_point_cloud(rng, 300, (0.015, 0.015))
+    ])
+    point_cloud = point_cloud[rng.permutation(len(point_cloud))]
+    filtered_point_cloud = estimation._filter_interpolation_points(point_cloud)
+    reference_point_cloud = filter_interpolation_points(
+        point_cloud,
+        estimation.config.INTERPOLATION_POINT_FILTER_DISTANCE,
+        estimation.config.INTERPOLATION_POINT_FILTER_COUNT
+    )
+    assert 0 < len(filtered_point_cloud) < len(point_cloud)
+    np.testing.assert_array_equal(filtered_point_cloud, reference_point_cloud)
+
+
+def test_filter_interpolation_points_of_empty_cloud():
+    assert estimation._filter_interpolation_points(np.empty((0, 3))).shape == (0, 3)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_sorted_lof_matches_lof_on_distinct_depths(seed):
+    rng = np.random.default_rng(seed)
+    depths = np.concatenate([rng.normal(0.45, 0.01, 2000), rng.uniform(0.2, 0.6, 40)])
+    inlier_mask = estimation._get_sorted_lof_inlier_mask(depths, 20)
+    assert 0 < np.sum(~inlier_mask) < len(depths)
+    np.testing.assert_array_equal(inlier_mask, estimation._get_lof_inlier_mask(depths))
+
+
+def test_depth_inlier_mask_methods():
+    depths = np.random.default_rng(0).normal(0.45, 0.01, 500)
+    assert np.all(estimation._get_depth_inlier_mask(depths, 'none'))
+    np.testing.assert_array_equal(
+        estimation._get_depth_inlier_mask(depths),
+        estimation._get_depth_inlier_mask(depths, estimation.config.OUTLIER_REJECTION_METHOD)
+    )
+    with pytest.raises(ValueError):
+        estimation._get_depth_inlier_mask(depths, 'median')
+
+
+def test_get_area_volume_of_regulated_depth_map_matches_depth_map():
+    calibration = {
+        'intrinsic_matrix': [[120.0, 0.0, 0.0], [0.0, 120.0, 0.0], [64.0, 48.0, 1.0]],
+        'intrinsic_matrix_reference_dimensions': [128, 96],
+        'lens_distortion_lookup_table': list(np.linspace(0.0, 0.03, 42)),
+        'lens_distortion_center': [62.0, 50.0]
+    }
+    rng = np.random.default_rng(0)
+    depth_map = (0.5 + rng.normal(0.0, 1e-3, (96, 128))).astype(np.float32)
+    depth_map[30:60, 40:80] -= 0.03
+    image = np.zeros((*depth_map.shape, 3), dtype=np.uint8)
+    label_mask = np.zeros(utils.config.UNIFIED_IMAGE_SIZE, dtype=np.int64)
+    label_mask[180:320, 180:320] = 1
+    label_mask[60:100, 380:440] = 2
+    _, regulated_depth_map = utils.regulate_session_images(image, depth_map, calibration)
+    area_volumes = estimation.get_area_volume(depth_map, calibration, None, label_mask)
+    assert len(area_volumes) == 2
+    assert area_volumes == estimation.get_area_volume(
+        None, calibration, None, label_mask, regulated_depth_map=regulated_depth_map
+    )
+
+
+def make_plane_point_cloud(rng, coefficients, count, noise, outlier_count):
+    """ Make points on the plane `z = a * x + b * y + c` with vertical `noise`,
+        and `outlier_count` points above the plane, like food on a table.
+    """
+    xy = rng.uniform(-0.2, 0.2, (count + outlier_count, 2))
+    z = xy @ coefficients[:2] + coefficients[2]
+    z[:count] += rng.normal(0.0, noise, count)
+    z[count:] -= rng.uniform(0.01, 0.1, outlier_count)
+    return np.column_stack([xy, z])
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_fit_plane_ransac_recovers_plane(seed):
+    rng = np.random.default_rng(seed)
+    coefficients = np.array([0.3, -0.2, 0.5])
+    point_cloud = make_plane_point_cloud(rng, coefficients, 3000, 2e-4, 2000)
+    fitted_coefficients, inlier_mask = estimation._fit_plane_ransac(point_cloud, 2e-3, 100, 4096, seed)
+    np.testing.assert_allclose(fitted_coefficients, coefficients, atol=1e-3)
+    assert np.all(inlier_mask[:3000])
+    assert np.mean(inlier_mask[3000:]) < 0.05
+
+
+def test_fit_plane_ransac_is_deterministic_with_seed():
+    point_cloud = make_plane_point_cloud(np.random.default_rng(0), np.array([0.1, 0.1, 0.4]), 2000, 1e-3, 1000)
+    coefficients, inlier_mask = estimation._fit_plane_ransac(point_cloud, 2e-3, 20, 500, 7)
+    for _ in range(3):
+        other_coefficients, other_inlier_mask = estimation._fit_plane_ransac(point_cloud, 2e-3, 20, 500, 7)
+        np.testing.assert_array_equal(other_coefficients, coefficients)
+        np.testing.assert_array_equal(other_inlier_mask, inlier_mask)
+
+
+@pytest.mark.parametrize('point_cloud', [
+    np.zeros((0, 3)),
+    np.array([[0.0, 0.0, 0.5], [0.1, 0.0, 0.5]]),
+    np.column_stack([np.linspace(0.0, 1.0, 50), np.linspace(0.0, 2.0, 50), np.linspace(0.5, 0.6, 50)]),
+    np.tile([0.1, 0.2, 0.5], (50, 1))
+])
+def test_fit_plane_ransac_rejects_degenerate_point_clouds(point_cloud):
+    with pytest.raises(ValueError):
+        estimation._fit_plane_ransac(point_cloud, 2e-3, 100, 4096, 0)
+
+
+def test_plane_recognition_levels_the_plane():
+    rng = np.random.default_rng(0)
+    point_cloud = make_plane_point_cloud(rng, np.array([0.3, -0.2, 0.5]), 3000, 2e-4, 2000)
+    fit_mask = np.zeros(len(point_cloud), dtype=bool)
+    fit_mask[:3000:10] = True
+    inlier_mask, rotation = estimation._get_plane_recognition(point_cloud, fit_mask)
+    assert np.all(inlier_mask[:3000])
+    plane_depths = rotation.apply(point_cloud[:3000])[:, 2]
+    assert np.std(plane_depths) < 1e-3
+    # Less than 3 points to fit on fall back to the whole point cloud.
+    fallback_inlier_mask, _ = estimation._get_plane_recognition(point_cloud, np.arange(len(point_cloud)) < 2)
+    np.testing.assert_array_equal(fallback_inlier_mask, estimation._get_plane_recognition(point_cloud)[0])
+
+
+# Filtering the entities with an entity executor, in a new interpreter, so that 
+# the warnings at its exit are captured. The worker processes import `fvolume` 
+# in the fork server, which needs `conftest` for the example `config_secure`.
+ENTITY_EXECUTOR_SCRIPT = """
+import json
+import multiprocessing
+import multiprocessing.shared_memory
+import sys
+import numpy as np
+
+sys.path.insert(0, {tests_path!r})
+import conftest
+from fvolume import config
+from fvolume import estimation
+
+multiprocessing.get_context('forkserver').set_forkserver_preload(['fvolume'])
+
+
+class RecordedSharedMemory(multiprocessing.shared_memory.SharedMemory):
+    names = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.names.append(self.name)
+
+
+if __name__ == '__main__':
+    multiprocessing.shared_memory.SharedMemory = RecordedSharedMemory
+    rng = np.random.default_rng(0)
+    counts = [800, 1, 0, 2500, 40]
+    point_cloud = np.column_stack([rng.normal(0.0, 0.1, (sum(counts), 2)), rng.uniform(0.3, 0.6, sum(counts))])
+    bounds = [(int(end - count), int(end)) for count, end in zip(counts, np.cumsum(counts))]
+    config.ENTITY_WORKER_COUNT = 0
+    sequential = estimation._filter_food_point_clouds(point_cloud, bounds, 0.5)
+    config.ENTITY_WORKER_COUNT, config.ENTITY_EXECUTOR = 2, {executor!r}
+    parallel = estimation._filter_food_point_clouds(point_cloud, bounds, 0.5)
+    unlinked = []
+    for name in RecordedSharedMemory.names:
+        try:
+            multiprocessing.shared_memory.SharedMemory(name=name).close()
+            unlinked.append(False)
+        except FileNotFoundError:
+            unlinked.append(True)
+    print(json.dumps({{
+        'identical': len(sequential) == len(parallel) and all(
+            np.array_equal(cloud, other_cloud) for cloud, other_cloud in zip(sequential, parallel)
+        ),
+        'sizes': [len(cloud) for cloud in parallel],
+        'shared_memory_count': len(RecordedSharedMemory.names),
+        'unlinked': unlinked
+    }}))
+"""
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_entity_executor_matches_sequential_filtering(tmp_path, executor):
+    script_path = tmp_path / 'entity_executor.py'
+    script_path.write_text(ENTITY_EXECUTOR_SCRIPT.format(
+        tests_path=os.path.dirname(os.path.realpath(__file__)),
+        executor=executor
+    ))
+    process = subprocess.run(
+        [sys.executable, str(script_path)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=120
+    )
+    assert process.returncode == 0, process.stderr.decode('utf8')
+    report = json.loads(process.stdout.decode('utf8').strip().splitlines()[-1])
+    assert report['identical']
+    assert len(report['sizes']) == 5 and report['sizes'][2] == 0
+    assert report['shared_memory_count'] == (1 if executor == 'process' else 0)
+    assert all(report['unlinked'])
+    assert b'leaked' not in process.stderr, process.stderr.decode('utf8')
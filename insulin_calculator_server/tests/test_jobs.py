@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import time
+import pytest
+
+import jobs
+
+
+def make_manager(tmp_path, **kwargs):
+    return jobs.JobManager(
+        kwargs.pop('max_workers', 2),
+        kwargs.pop('max_pending', 4),
+        kwargs.pop('result_ttl', 60),
+        str(tmp_path / 'jobs.sqlite3'),
+        poll_interval=0.01
+    )
+
+
+def fail():
+    raise RuntimeError('failed')
+
+
+def test_job_result(tmp_path):
+    manager = make_manager(tmp_path)
+    job_id = manager.submit(lambda x: {'results': [x]}, 3)
+    status = manager.wait(job_id, 5)
+    assert status['state'] == 'done'
+    assert status['result'] == {'results': [3]}
+    assert manager.get_status('missing') is None
+    assert manager.get_stats()['done'] == 1
+
+
+def test_failed_job(tmp_path):
+    manager = make_manager(tmp_path)
+    status = manager.wait(manager.submit(fail), 5)
+    assert status['state'] == 'failed'
+    assert 'failed' in status['error']
+
+
+def test_job_queue_is_bounded(tmp_path):
+    manager = make_manager(tmp_path, max_workers=1, max_pending=2)
+    job_ids = [manager.submit(time.sleep, 0.2) for _ in range(2)]
+    with pytest.raises(jobs.JobQueueFullError):
+        manager.submit(time.sleep, 0.2)
+    for job_id in job_ids:
+        assert manager.wait(job_id, 5)['state'] == 'done'
+    manager.wait(manager.submit(time.sleep, 0), 5)
+    assert manager.get_stats()['rejected'] == 1
+
+
+def test_jobs_are_shared_by_managers(tmp_path):
+    # Another manager on the same store stands for another worker process.
+    manager, other_manager = make_manager(tmp_path), make_manager(tmp_path)
+    job_id = manager.submit(time.sleep, 0.2)
+    assert other_manager.get_status(job_id)['state'] in ('pending', 'running')
+    assert other_manager.get_stats()['pending'] + other_manager.get_stats()['running'] == 1
+    status = other_manager.wait(job_id, 5)
+    assert status['state'] == 'done'
+    assert status['result'] is None
+
+
+def test_finished_jobs_expire(tmp_path):
+    manager = make_manager(tmp_path, result_ttl=0.1)
+    job_id = manager.submit(lambda: 1)
+    assert manager.wait(job_id, 5)['state'] == 'done'
+    time.sleep(0.2)
+    assert manager.get_status(job_id) is None
+    assert manager.get_stats()['expired'] == 1
+
+
+def test_jobs_of_exited_process_fail(tmp_path):
+    process = multiprocessing.get_context('spawn').Process(target=os.getpid)
+    process.start()
+    process.join()
+    store = jobs.JobStore(str(tmp_path / 'jobs.sqlite3'))
+    store.add('orphan', process.pid)
+    manager = make_manager(tmp_path)
+    status = manager.get_status('orphan')
+    assert status['state'] == 'failed'
+    assert status['finished_at'] is not None
+
+
+@pytest.mark.parametrize('failing_methods', [['set_running'], ['set_running', 'set_finished']])
+def test_store_failures_release_the_pending_slot(tmp_path, monkeypatch, failing_methods):
+    manager = make_manager(tmp_path, max_workers=1, max_pending=1)
+    manager.wait(manager.submit(lambda: 1), 5)
+    def fail_store(*args, **kwargs):
+        raise RuntimeError('database is locked')
+    for method in failing_methods:
+        monkeypatch.setattr(manager._store, method, fail_store)
+    job_id = manager.submit(lambda: 1)
+    deadline = time.perf_counter() + 5
+    while manager._futures and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert manager._futures == {}
+    monkeypatch.undo()
+    if failing_methods == ['set_running']:
+        assert manager.get_status(job_id)['state'] == 'failed'
+    assert manager.wait(manager.submit(lambda: 2), 5)['result'] == 2
@@ -0,0 +1,35 @@
+import pytest
+
+from fvolume import model_registry
+
+
+def test_load_all_loads_eager_entries():
+    registry = model_registry.ModelRegistry()
+    warmed_up = []
+    registry.register('model', lambda: 'model', warm_up=warmed_up.append)
+    registry.register('library', lambda: 'library', eager=False)
+    assert not registry.is_ready()
+    registry.load_all(warm_up=True)
+    assert warmed_up == ['model']
+    # The lazy entries are neither loaded nor required to be ready.
+    assert registry.is_ready()
+    assert registry.get_status()['library'] == {'state': 'unloaded'}
+    assert registry.get('library') == 'library'
+    assert registry.get_status()['library']['state'] == 'ready'
+
+
+def test_failed_entry_is_not_ready():
+    registry = model_registry.ModelRegistry()
+    def fail():
+        raise OSError('missing')
+    registry.register('model', fail)
+    with pytest.raises(OSError):
+        registry.load_all()
+    assert not registry.is_ready()
+    assert registry.get_status()['model']['state'] == 'failed'
+
+
+def test_undistort_library_is_lazy():
+    status = model_registry.registry.get_status()
+    assert 'segmentation_model' in status
+    assert not model_registry.registry._eager['undistort_dll']
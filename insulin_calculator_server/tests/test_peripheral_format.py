@@ -0,0 +1,86 @@
+import json
+import struct
+import zlib
+import numpy as np
+import pytest
+
+import peripheral_format
+
+
+def make_peripheral():
+    return {
+        'calibration_data': {'intrinsic_matrix': [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]},
+        'depth_data': np.random.default_rng(0).random((48, 64)).astype(np.float32)
+    }
+
+
+def make_binary_peripheral(header, payload):
+    header_bytes = json.dumps(header).encode('utf8')
+    return struct.pack(
+        '<4sBxxxI',
+        peripheral_format.BINARY_MAGIC,
+        peripheral_format.BINARY_VERSION,
+        len(header_bytes)
+    ) + header_bytes + payload
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'float32'])
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_binary_peripheral_round_trip(dtype, compression):
+    peripheral = make_peripheral()
+    parsed = peripheral_format.parse_peripheral(
+        peripheral_format.encode_binary_peripheral(peripheral, dtype, compression)
+    )
+    assert parsed['calibration_data'] == peripheral['calibration_data']
+    assert parsed['depth_data'].dtype == np.float32
+    np.testing.assert_array_equal(parsed['depth_data'], peripheral['depth_data'].astype(dtype))
+
+
+@pytest.mark.parametrize('content', [
+    make_binary_peripheral([], b''),
+    make_binary_peripheral({'depth_data_format': 'float32'}, b''),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'compression': None}}, b''),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': 4, 'compression': None}}, b''),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [2, -2], 'compression': None}}, b''),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [2, 2.0], 'compression': None}}, b''),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float64', 'shape': [1, 2], 'compression': None}}, bytes(16)),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [1, 2], 'compression': None}}, bytes(4)),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [1, 2], 'compression': 'lz4'}}, bytes(8)),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [1, 2], 'compression': 'zlib'}}, b'corrupted'),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [1, 2], 'compression': 'zlib'}}, zlib.compress(bytes(8))[:-3]),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [65536, 65536], 'compression': None}}, b''),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [1, 2], 'compression': None}}, b'')[:-4],
+    b'[1, 2]',
+    b'"depth_data"',
+    b'{"depth_data": [[1, 2], [3]]}',
+    b'{"depth_data": {"a": 1}}',
+    b'{"depth_data": [[{"a": 1}]]}',
+    b'{"depth_data": null}',
+    b'{"depth_data": 1.5}',
+    b'{"depth_data": [1, 2]}',
+    b'{"depth_data": [[[1, 2]]]}',
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [], 'compression': None}}, bytes(4)),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [2], 'compression': None}}, bytes(8)),
+    make_binary_peripheral({'depth_data_format': {'dtype': 'float32', 'shape': [1, 1, 2], 'compression': None}}, bytes(8)),
+    b'\xff\xfe'
+])
+def test_malformed_peripheral_raises_value_error(content):
+    with pytest.raises(ValueError):
+        peripheral_format.parse_peripheral(content)
+
+
+def test_zlib_bomb_is_rejected_without_decompressing_it():
+    bomb = zlib.compress(bytes(1 << 28), 9)
+    content = make_binary_peripheral(
+        {'depth_data_format': {'dtype': 'float32', 'shape': [480, 640], 'compression': 'zlib'}},
+        bomb
+    )
+    with pytest.raises(ValueError):
+        peripheral_format.parse_peripheral(content)
+
+
+def test_json_peripheral():
+    parsed = peripheral_format.parse_peripheral(b'{"depth_data": [[1, 2], [3, 4]], "device_attitude": [0, 0, 0]}')
+    assert parsed['depth_data'].dtype == np.float32
+    np.testing.assert_array_equal(parsed['depth_data'], [[1, 2], [3, 4]])
+    assert parsed['device_attitude'] == [0, 0, 0]
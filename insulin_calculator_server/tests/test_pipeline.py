@@ -0,0 +1,88 @@
+import collections
+import json
+import os
+import signal
+import pytest
+
+import fvolume
+import pipeline
+
+
+def test_broken_process_pool_is_replaced():
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=1)
+    try:
+        worker_pid = estimation_pipeline._run_in_process_pool(os.getpid)
+        broken_pool = estimation_pipeline._get_process_pool()
+        os.kill(worker_pid, signal.SIGKILL)
+        # The call on the broken pool is retried on a new pool.
+        new_worker_pid = estimation_pipeline._run_in_process_pool(os.getpid)
+        assert new_worker_pid not in (worker_pid, os.getpid())
+        assert estimation_pipeline._get_process_pool() is not broken_pool
+    finally:
+        estimation_pipeline.shutdown()
+
+
+def test_without_process_pool():
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=0)
+    assert estimation_pipeline._run_in_process_pool(os.getpid) == os.getpid()
+
+
+def test_process_pids():
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=1)
+    try:
+        assert estimation_pipeline.get_process_pids() == []
+        worker_pid = estimation_pipeline._run_in_process_pool(os.getpid)
+        assert estimation_pipeline.get_process_pids() == [worker_pid]
+    finally:
+        estimation_pipeline.shutdown()
+    assert estimation_pipeline.get_process_pids() == []
+
+
+def test_format_server_timing():
+    timings = collections.OrderedDict([('regulation', 0.0123), ('recognition', 0.5), ('total', 1.23456)])
+    assert pipeline.format_server_timing(timings) == 'regulation;dur=12.3, recognition;dur=500.0, total;dur=1234.6'
+    assert pipeline.format_server_timing({}) == ''
+
+
+@pytest.mark.parametrize('batching', [False, True])
+def test_estimate(stub_segmentation_model, stub_classifier, session_inputs, monkeypatch, batching):
+    monkeypatch.setattr(fvolume.config, 'SEGMENTATION_BATCHING', batching)
+    handler, _ = stub_classifier
+    image, peripheral = session_inputs
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=0)
+    try:
+        results, timings = estimation_pipeline.estimate(image, peripheral)
+    finally:
+        estimation_pipeline.shutdown()
+    assert stub_segmentation_model.batch_sizes == [1]
+    assert handler.request_count == 2
+    assert list(timings) == ['regulation', 'recognition', 'classification', 'estimation', 'density', 'total']
+    assert estimation_pipeline.metrics.get_stats()['total']['count'] == 1
+    # The bounding boxes are `(origin_x, origin_y, width, height)` in the
+    # columns and rows of the color image, relative to the regulated size.
+    edge_length = fvolume.config.UNIFIED_IMAGE_SIZE[0]
+    assert [result['bounding_box'] for result in results] == [
+        [columns.start / edge_length, rows.start / edge_length, (columns.stop - columns.start) / edge_length, (rows.stop - rows.start) / edge_length]
+        for rows, columns in stub_segmentation_model.food_regions
+    ]
+    for result in results:
+        assert set(result) == {'bounding_box', 'area', 'volume', 'candidates'}
+        assert [candidate['name'] for candidate in result['candidates']] == ['Donut', 'Bagel']
+        for candidate in result['candidates']:
+            assert set(candidate) == {'group', 'name', 'score', 'area_density', 'volume_density'}
+    # Only the first region covers the box on the table.
+    assert results[0]['area'] > 0 and results[0]['volume'] > 0
+    assert results[0]['volume'] > 10 * results[1]['volume']
+    json.dumps(results)
+
+
+def test_warm_up_starts_the_processes():
+    estimation_pipeline = pipeline.NutritionEstimationPipeline(process_count=2)
+    try:
+        process_pids = estimation_pipeline.warm_up()
+        assert len(process_pids) == 2 and os.getpid() not in process_pids
+        assert estimation_pipeline.warm_up() == process_pids
+        assert estimation_pipeline._run_in_process_pool(os.getpid) in process_pids
+    finally:
+        estimation_pipeline.shutdown()
+    assert pipeline.NutritionEstimationPipeline(process_count=0).warm_up() == []
@@ -0,0 +1,26 @@
+import cv2
+import numpy as np
+
+from fvolume import recognition
+
+
+def test_encode_jpeg_channel_order_and_orientation():
+    # Red, green, blue and white quadrants of an RGB image with more columns 
+    # than rows.
+    image = np.zeros((48, 80, 3), dtype=np.uint8)
+    image[:24, :40] = [255, 0, 0]
+    image[:24, 40:] = [0, 255, 0]
+    image[24:, :40] = [0, 0, 255]
+    image[24:, 40:] = [255, 255, 255]
+    buffer = recognition._encode_jpeg(image)
+    decoded_image = cv2.imdecode(np.frombuffer(buffer.getvalue(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert decoded_image.shape == image.shape
+    # `cv2.imdecode` gives BGR images, which are the input in reversed channels.
+    assert np.mean(np.abs(decoded_image.astype(np.int64) - image[:, :, ::-1])) < 4
+    for rows, columns, bgr in [
+        (slice(4, 20), slice(4, 36), [0, 0, 255]),
+        (slice(4, 20), slice(44, 76), [0, 255, 0]),
+        (slice(28, 44), slice(4, 36), [255, 0, 0]),
+        (slice(28, 44), slice(44, 76), [255, 255, 255])
+    ]:
+        np.testing.assert_allclose(np.mean(decoded_image[rows, columns], axis=(0, 1)), bgr, atol=8)
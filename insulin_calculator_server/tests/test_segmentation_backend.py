@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pytest
+
+from fvolume import config
+from fvolume import segmentation_backend
+
+# The converted backends, their model paths and the runtime they need besides
+# the Keras model they are compared with.
+CONVERTED_BACKENDS = [
+    ('tflite', config.SEG_TFLITE_MODEL_PATH, None),
+    ('onnx', config.SEG_ONNX_MODEL_PATH, 'onnxruntime')
+]
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        segmentation_backend.load_segmentation_backend('torch')
+
+
+@pytest.fixture(scope='module')
+def keras_backend():
+    pytest.importorskip('tensorflow')
+    pytest.importorskip('keras')
+    if not os.path.exists(config.SEG_MODEL_PATH):
+        pytest.skip('The Keras model is not found at {}.'.format(config.SEG_MODEL_PATH))
+    return segmentation_backend.load_segmentation_backend('keras')
+
+
+@pytest.mark.parametrize('backend, model_path, runtime', CONVERTED_BACKENDS)
+def test_converted_backend_matches_keras(keras_backend, backend, model_path, runtime):
+    if runtime is not None:
+        pytest.importorskip(runtime)
+    if not os.path.exists(model_path):
+        pytest.skip('The {} model is not found at {}.'.format(backend, model_path))
+    converted_backend = segmentation_backend.load_segmentation_backend(backend)
+    images = np.random.default_rng(0).standard_normal((2, *config.UNIFIED_IMAGE_SIZE, 3)).astype(np.float32)
+    keras_result = keras_backend.predict(images)
+    converted_result = converted_backend.predict(images)
+    assert converted_result.shape == keras_result.shape
+    # Quantized models differ slightly in probability, the masks should agree.
+    keras_mask = keras_result >= config.FOOD_PROB_THRESHOLD
+    converted_mask = converted_result >= config.FOOD_PROB_THRESHOLD
+    assert np.mean(keras_mask == converted_mask) >= 0.99
+    # A second batch of another size runs through the resized input.
+    assert converted_backend.predict(images[:1]).shape == keras_result[:1].shape
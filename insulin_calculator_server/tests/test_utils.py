@@ -0,0 +1,168 @@
+import os
+import numpy as np
+import cv2
+import pytest
+
+from fvolume import config
+from fvolume import utils
+
+requires_undistort_dll = pytest.mark.skipif(
+    not os.path.exists(config.UNDISTORT_DLL_PATH),
+    reason='The undistort shared object is not built, see `fvolume/c_core/Makefile`.'
+)
+
+
+def make_rectify_inputs():
+    rng = np.random.default_rng(0)
+    image = (rng.random((48, 64, 3)) * 255).astype(np.uint8)
+    return image, np.linspace(0.0, 0.02, 42), np.array([24.0, 32.0])
+
+
+@requires_undistort_dll
+def test_rectify_image_c_into_out():
+    image, lookup_table, distortion_center = make_rectify_inputs()
+    out = np.empty_like(image)
+    rectified_image = utils.rectify_image_c(image, lookup_table, distortion_center, out=out)
+    assert rectified_image is out
+    np.testing.assert_array_equal(out, utils.rectify_image_c(image, lookup_table, distortion_center))
+
+
+@requires_undistort_dll
+@pytest.mark.parametrize('make_out', [
+    lambda image: np.empty(image.shape, dtype=np.float32),
+    lambda image: np.empty(image.shape[::-1], dtype=image.dtype),
+    lambda image: np.empty((*image.shape[:2], 6), dtype=image.dtype)[:, :, :3],
+    lambda image: image
+])
+def test_rectify_image_c_rejects_invalid_out(make_out):
+    image, lookup_table, distortion_center = make_rectify_inputs()
+    with pytest.raises(ValueError):
+        utils.rectify_image_c(image, lookup_table, distortion_center, out=make_out(image))
+
+
+def make_calibration():
+    return {
+        'intrinsic_matrix': [[120.0, 0.0, 0.0], [0.0, 120.0, 0.0], [64.0, 48.0, 1.0]],
+        'intrinsic_matrix_reference_dimensions': [128, 96],
+        'lens_distortion_lookup_table': list(np.linspace(0.0, 0.03, 42)),
+        'lens_distortion_center': [62.0, 50.0]
+    }
+
+
+def get_legacy_regulated_image(image, calibration):
+    """ The previous regulation, which transposes the full image, resizes it,
+        rectifies it point by point with `get_lens_distortion_point`, and then
+        center crops and resizes it, kept as the reference implementation.
+    """
+    transposed_image = np.swapaxes(image, 0, 1)
+    image_shape = transposed_image.shape
+    scale = min(config.UNIFIED_IMAGE_SIZE) / min(image_shape[:2])
+    resized_image = cv2.resize(
+        transposed_image,
+        (int(image_shape[1] * scale), int(image_shape[0] * scale))
+    )
+    reference_scale = min(resized_image.shape[:2]) / min(calibration['intrinsic_matrix_reference_dimensions'])
+    lookup_table = np.array(calibration['lens_distortion_lookup_table'])
+    distortion_center = np.array(calibration['lens_distortion_center']) * reference_scale
+    rectified_image = np.zeros_like(resized_image)
+    for index in np.ndindex(resized_image.shape[:2]):
+        original_index = utils.get_lens_distortion_point(
+            np.array(index),
+            lookup_table,
+            distortion_center,
+            np.array(resized_image.shape[:2])
+        )
+        if all(0 <= value < length for value, length in zip(original_index, resized_image.shape[:2])):
+            rectified_image[index] = resized_image[original_index]
+    return cv2.resize(utils.center_crop(rectified_image), config.UNIFIED_IMAGE_SIZE)
+
+
+@pytest.fixture
+def small_unified_image_size(monkeypatch):
+    monkeypatch.setattr(config, 'UNIFIED_IMAGE_SIZE', (48, 48))
+    utils.clear_undistort_map_cache()
+    yield
+    utils.clear_undistort_map_cache()
+
+
+def make_session_images(image_shape, depth_shape):
+    rng = np.random.default_rng(0)
+    image = (rng.random(image_shape) * 255).astype(np.uint8)
+    depth_map = rng.uniform(0.3, 0.6, depth_shape).astype(np.float32)
+    return image, depth_map
+
+
+@pytest.mark.parametrize('image_shape, depth_shape', [
+    ((96, 128, 3), (48, 64)),
+    ((128, 96, 3), (64, 48)),
+    ((96, 128, 3), (50, 50))
+])
+def test_regulate_session_images_matches_legacy_regulation(small_unified_image_size, image_shape, depth_shape):
+    image, depth_map = make_session_images(image_shape, depth_shape)
+    calibration = make_calibration()
+    regulated_image, regulated_depth_map = utils.regulate_session_images(image, depth_map, calibration)
+    legacy_image = get_legacy_regulated_image(image, calibration)
+    assert regulated_image.shape == legacy_image.shape == (48, 48, 3)
+    assert regulated_image.dtype == np.uint8
+    assert np.max(np.abs(regulated_image.astype(np.int64) - legacy_image)) <= 1
+    legacy_depth_map = get_legacy_regulated_image(depth_map, calibration)
+    assert regulated_depth_map.shape == legacy_depth_map.shape == (48, 48)
+    np.testing.assert_allclose(regulated_depth_map, legacy_depth_map, rtol=1e-6)
+    np.testing.assert_array_equal(regulated_image, utils.regulate_image(image, calibration))
+    np.testing.assert_array_equal(regulated_depth_map, utils.regulate_image(depth_map, calibration))
+
+
+def test_regulate_session_images_looks_up_the_maps_once(small_unified_image_size):
+    image, depth_map = make_session_images((96, 128, 3), (48, 64))
+    utils.regulate_session_images(image, depth_map, make_calibration())
+    cache_info = utils.get_undistort_map_cache_info()
+    assert (cache_info['hits'], cache_info['misses'], cache_info['size']) == (0, 1, 1)
+
+
+@requires_undistort_dll
+@pytest.mark.parametrize('channel', [None, 1, 3])
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32])
+def test_rectify_image_remap_matches_rectify_image_c(channel, dtype):
+    image, lookup_table, distortion_center = make_rectify_inputs()
+    image = image[:, :, 0] if channel is None else image[:, :, :channel]
+    image = np.ascontiguousarray(image, dtype=dtype)
+    rectified_image = utils.rectify_image_remap(image, lookup_table, distortion_center)
+    reference_image = utils.rectify_image_c(image, lookup_table, distortion_center)
+    assert rectified_image.shape == reference_image.shape
+    assert rectified_image.dtype == reference_image.dtype
+    # Both sample the nearest pixel, which may only differ where a mapped point 
+    # is rounded across a pixel boundary.
+    assert np.mean(rectified_image == reference_image) >= 0.999
+
+
+def test_undistort_map_cache_counters():
+    utils.clear_undistort_map_cache()
+    max_size = config.UNDISTORT_MAP_CACHE_SIZE
+    lookup_table = np.linspace(0.0, 0.02, 42)
+    distortion_centers = [np.array([8.0, 8.0 + index]) for index in range(max_size + 1)]
+    try:
+        for distortion_center in distortion_centers[:max_size]:
+            utils.get_undistort_maps(lookup_table, distortion_center, (16, 24))
+        assert utils.get_undistort_map_cache_info() == {
+            'hits': 0, 'misses': max_size, 'size': max_size, 'max_size': max_size
+        }
+        # Touching the oldest entry makes the second oldest the least recently 
+        # used, which is then evicted by a new entry.
+        maps = utils.get_undistort_maps(lookup_table, distortion_centers[0], (16, 24))
+        assert maps is utils.get_undistort_maps(lookup_table, distortion_centers[0], (16, 24))
+        utils.get_undistort_maps(lookup_table, distortion_centers[max_size], (16, 24))
+        assert utils.get_undistort_map_cache_info() == {
+            'hits': 2, 'misses': max_size + 1, 'size': max_size, 'max_size': max_size
+        }
+        assert maps is utils.get_undistort_maps(lookup_table, distortion_centers[0], (16, 24))
+        utils.get_undistort_maps(lookup_table, distortion_centers[1], (16, 24))
+        assert utils.get_undistort_map_cache_info() == {
+            'hits': 3, 'misses': max_size + 2, 'size': max_size, 'max_size': max_size
+        }
+        # The cache is also keyed by the image size and the center crop.
+        utils.get_undistort_maps(lookup_table, distortion_centers[0], (24, 16))
+        utils.get_undistort_maps(lookup_table, distortion_centers[0], (16, 24), center_cropped=True)
+        assert utils.get_undistort_map_cache_info()['misses'] == max_size + 4
+    finally:
+        utils.clear_undistort_map_cache()
+    assert utils.get_undistort_map_cache_info() == {'hits': 0, 'misses': 0, 'size': 0, 'max_size': max_size}